@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+
+#    Benchmarks for JPEG2000 GML data parser
+#    Copyright (C) 2019  Pekka Helenius
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+################################################################
+
+import sys
+import os.path
+import argparse
+import struct
+import json
+import time
+import itertools
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import gmlparser
+
+################################################################
+#
+# SYNTHETIC CORPUS
+
+# Synthetic JPEG2000 files with valid box structure:
+#
+#   signature, ftyp, jp2h, GML association box and jp2c, with the
+#   GML box either before or after the codestream.
+#
+# Codestream contents are not valid image data. Codestreams are
+# written as sparse files, so a corpus of large files takes little
+# disk space.
+
+gml_header = '''<?xml version="1.0" encoding="UTF-8"?>
+<gml:FeatureCollection xmlns:gml="http://www.opengis.net/gml" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+  <gml:boundedBy>
+    <gml:Envelope srsName="urn:ogc:def:crs:EPSG::{srs}">
+      <gml:lowerCorner>{x_low} {y_low}</gml:lowerCorner>
+      <gml:upperCorner>{x_high} {y_high}</gml:upperCorner>
+    </gml:Envelope>
+  </gml:boundedBy>
+'''
+
+gml_member = '''  <gml:featureMember>
+    <gml:RectifiedGridCoverage dimension="2" gml:id="RGC{num:04d}">
+      <gml:rectifiedGridDomain>
+        <gml:RectifiedGrid dimension="2">
+          <gml:limits>
+            <gml:GridEnvelope>
+              <gml:low>0 0</gml:low>
+              <gml:high>{x_pixels} {y_pixels}</gml:high>
+            </gml:GridEnvelope>
+          </gml:limits>
+          <gml:axisName>x</gml:axisName>
+          <gml:axisName>y</gml:axisName>
+          <gml:origin>
+            <gml:Point gml:id="P{num:04d}" srsName="urn:ogc:def:crs:EPSG::{srs}">
+              {origin}
+            </gml:Point>
+          </gml:origin>
+          <gml:offsetVector srsName="urn:ogc:def:crs:EPSG::{srs}">{resolution} 0</gml:offsetVector>
+          <gml:offsetVector srsName="urn:ogc:def:crs:EPSG::{srs}">0 -{resolution}</gml:offsetVector>
+        </gml:RectifiedGrid>
+      </gml:rectifiedGridDomain>
+      <gml:rangeSet>
+        <gml:File>
+          <gml:rangeParameters/>
+          <gml:fileName>gmljp2://codestream/{num}</gml:fileName>
+          <gml:fileStructure>Record Interleaved</gml:fileStructure>
+        </gml:File>
+      </gml:rangeSet>
+    </gml:RectifiedGridCoverage>
+  </gml:featureMember>
+'''
+
+gml_footer = '''</gml:FeatureCollection>
+'''
+
+# Codestream size suffixes
+size_units = { 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3 }
+
+# Size in bytes of '4096', '64K', '1M' or '2G'
+#
+def parsesize(size):
+
+    unit = size_units.get(size[-1:].upper())
+    if unit is None:
+        return int(size)
+    return int(float(size[:-1]) * unit)
+
+# GML document of 'members' grid coverages. Origins are given as
+# gml:pos or as deprecated gml:coordinates elements.
+#
+def gmldocument(members = 1, coordinates = False, srs = 3067,
+                x_low = 380000, y_low = 6670000, pixels = 12000, resolution = 0.5):
+
+    x_high = x_low + pixels * resolution
+    y_high = y_low + pixels * resolution
+
+    if coordinates:
+        origin = '<gml:coordinates>{},{}</gml:coordinates>'
+    else:
+        origin = '<gml:pos>{} {}</gml:pos>'
+    origin = origin.format(x_low + resolution / 2, y_high - resolution / 2)
+
+    document = gml_header.format(srs = srs, x_low = x_low, y_low = y_low, x_high = x_high, y_high = y_high)
+
+    for num in range(members):
+        document += gml_member.format(num = num, srs = srs, origin = origin, resolution = resolution,
+                                      x_pixels = pixels - 1, y_pixels = pixels - 1)
+
+    return (document + gml_footer).encode('utf-8')
+
+# Box of given type and contents
+#
+def jp2box(boxtype, payload):
+    return struct.pack('>I', 8 + len(payload)) + boxtype + payload
+
+# Write a synthetic JPEG2000 file.
+#
+# 'position' is 'before' or 'after' the codestream box.
+#
+def writejp2(path, gml, codestream = 4096, position = 'before'):
+
+    signature = jp2box(b'jP  ', b'\r\n\x87\n')
+    filetype = jp2box(b'ftyp', b'jp2 \x00\x00\x00\x00jp2 ')
+    header = jp2box(b'jp2h',
+                    jp2box(b'ihdr', struct.pack('>IIHBBBB', 12000, 12000, 3, 7, 7, 0, 0)) +
+                    jp2box(b'colr', b'\x01\x00\x00\x00\x00\x00\x10'))
+
+    gmlbox = jp2box(b'asoc', jp2box(b'lbl ', b'gml.data') +
+                    jp2box(b'asoc', jp2box(b'lbl ', b'gml.root-instance') + jp2box(b'xml ', gml)))
+
+    # Codestream box with extended length, SOC and SIZ markers and
+    # a sparse body. The last byte is written to set the file size.
+    codestreambox = struct.pack('>I4sQ', 1, b'jp2c', 16 + codestream)
+    markers = b'\xff\x4f\xff\x51'
+
+    with open(path, 'wb') as f:
+        f.write(signature + filetype + header)
+
+        if position == 'before':
+            f.write(gmlbox)
+
+        f.write(codestreambox + markers)
+        if codestream > len(markers):
+            f.seek(codestream - len(markers) - 1, os.SEEK_CUR)
+            f.write(b'\x00')
+
+        if position == 'after':
+            f.write(gmlbox)
+
+# Write a corpus of all combinations of given codestream sizes,
+# GML positions, origin elements and document sizes.
+# Returns paths of the written files.
+#
+def corpus(directory, sizes = ('4K',), positions = ('before', 'after'),
+           origins = ('pos', 'coordinates'), members = (1,)):
+
+    os.makedirs(directory, exist_ok = True)
+    paths = []
+
+    for size, position, origin, count in itertools.product(sizes, positions, origins, members):
+
+        name = 'tile_{}_{}_{}_{}.jp2'.format(size, position, origin, count)
+        path = os.path.join(directory, name)
+
+        gml = gmldocument(members = count, coordinates = (origin == 'coordinates'))
+        writejp2(path, gml, parsesize(size), position)
+        paths.append(path)
+
+    return paths
+
+################################################################
+#
+# BENCHMARK
+
+# Benchmark stages, in order:
+#
+#   header:  open file and check JPEG2000 header
+#   locate:  find and read GML metadata
+#   parse:   parse GML data
+#   lookup:  key lookups and worldfile values
+#   xml, json, tfw, info: output formats
+#   jsonstream: JSON written from unparsed GML data, see write_json
+#
+bench_stages = ('header', 'locate', 'parse', 'lookup', 'xml', 'json', 'jsonstream', 'tfw', 'info')
+
+# Keys looked up in the 'lookup' stage
+bench_keys = ('@srsName', 'lowerCorner', 'upperCorner', 'low', 'high', 'offsetVector')
+
+# Peak resident set size of this process in megabytes
+#
+def peakrss():
+
+    import resource
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Kilobytes on Linux, bytes on macOS
+    if sys.platform == 'darwin':
+        return rss / 1024 ** 2
+    return rss / 1024
+
+# File object discarding everything written to it
+class NullWriter(object):
+    def write(self, data):
+        return len(data)
+
+# Seconds used in each stage for one file
+#
+def benchfile(path, formatting = 'raw'):
+
+    timer = time.perf_counter
+    times = {}
+
+    start = timer()
+    f = gmlparser.openinput(path)
+    try:
+        gmlparser.jp2check(f)
+        times['header'] = timer() - start
+
+        start = timer()
+        metadata = gmlparser.gmldata(f)
+        times['locate'] = timer() - start
+    finally:
+        f.close()
+
+    # JSON is streamed only if GML data has not been parsed
+    start = timer()
+    gmlparser.GMLDocument(path, metadata).write_json(NullWriter(), formatting)
+    times['jsonstream'] = timer() - start
+
+    document = gmlparser.GMLDocument(path, metadata)
+
+    start = timer()
+    document.tree()
+    times['parse'] = timer() - start
+
+    start = timer()
+    index = document.index()
+    for key in bench_keys:
+        gmlparser.findgmlkey(index, key, 0)
+    document.georef()
+    times['lookup'] = timer() - start
+
+    for outputformat in ('xml', 'json', 'tfw', 'info'):
+        start = timer()
+        gmlparser.render(document, outputformat, formatting)
+        times[outputformat] = timer() - start
+
+    return times, len(metadata)
+
+# Benchmark a list of files. Each file is run 'repeat' times, and the
+# fastest run of each stage is counted.
+#
+# Returns a result dictionary:
+#
+#   {"files": ..., "bytes": ..., "peakrss": ..., "stages": {stage: {"seconds": ..., "throughput": ...}}}
+#
+# where 'seconds' is the mean time of the stage per file and
+# 'throughput' is files per second. Per-file values can be compared
+# between corpora of different size.
+#
+def benchmark(paths, repeat = 5, formatting = 'raw'):
+
+    totals = dict.fromkeys(bench_stages, 0.0)
+    metadatasize = 0
+
+    for path in paths:
+        best = dict.fromkeys(bench_stages, float('inf'))
+
+        for i in range(repeat):
+            times, size = benchfile(path, formatting)
+            for stage in bench_stages:
+                best[stage] = min(best[stage], times[stage])
+
+        for stage in bench_stages:
+            totals[stage] += best[stage]
+        metadatasize += size
+
+    stages = {}
+    for stage in bench_stages:
+        seconds = totals[stage] / len(paths)
+        stages[stage] = {
+            'seconds':    seconds,
+            'throughput': 1 / seconds if seconds > 0 else None
+        }
+
+    return {
+        'files':   len(paths),
+        'bytes':   metadatasize,
+        'peakrss': peakrss(),
+        'stages':  stages
+    }
+
+# Compare results against a baseline. Returns a list of
+# (stage, baseline seconds, seconds, ratio, regressed) tuples.
+# A stage has regressed if it is slower than the baseline
+# by more than 'threshold' (e.g. 0.1 for 10 percent).
+#
+def compare(result, baseline, threshold = 0.1):
+
+    comparison = []
+
+    for stage in bench_stages:
+        if stage not in baseline['stages']:
+            continue
+
+        before = baseline['stages'][stage]['seconds']
+        after = result['stages'][stage]['seconds']
+        ratio = after / before if before > 0 else float('inf')
+
+        comparison.append((stage, before, after, ratio, ratio > 1 + threshold))
+
+    return comparison
+
+def report(result, comparison = None, o = sys.stdout):
+
+    o.write('Files: {}, GML data: {:.1f} kB, peak RSS: {:.1f} MB\n'.format(
+            result['files'], result['bytes'] / 1024, result['peakrss']))
+
+    o.write('{:<10} {:>12} {:>14}\n'.format('stage', 's/file', 'files/s'))
+    for stage in bench_stages:
+        values = result['stages'][stage]
+        throughput = values['throughput']
+        o.write('{:<10} {:>12.6f} {:>14}\n'.format(
+                stage, values['seconds'], 'Unknown' if throughput is None else '{:.1f}'.format(throughput)))
+
+    if comparison is None:
+        return
+
+    o.write('\nAgainst baseline (s/file):\n')
+    o.write('{:<10} {:>12} {:>12} {:>8}\n'.format('stage', 'baseline', 'current', 'ratio'))
+    for stage, before, after, ratio, regressed in comparison:
+        o.write('{:<10} {:>12.6f} {:>12.6f} {:>8.2f}{}\n'.format(
+                stage, before, after, ratio, ' SLOWER' if regressed else ''))
+
+################################################################
+#
+# INPUT ARGUMENTS
+
+def corpusargumentparser():
+
+    argparser = argparse.ArgumentParser(prog = 'gmlbench.py corpus', description = 'Write a synthetic JPEG2000 corpus')
+
+    argparser.add_argument('directory', help = 'Output directory')
+    argparser.add_argument('-s', '--sizes', help = 'Codestream sizes, e.g. 4K,1M,2G (Default: 4K,1M)', default = '4K,1M', dest = 'sizes')
+    argparser.add_argument('-p', '--positions', help = 'GML box positions (Default: before,after)', default = 'before,after', dest = 'positions')
+    argparser.add_argument('-g', '--origins', help = 'Origin elements (Default: pos,coordinates)', default = 'pos,coordinates', dest = 'origins')
+    argparser.add_argument('-m', '--members', help = 'Grid coverages per GML document (Default: 1,100)', default = '1,100', dest = 'members')
+
+    return argparser
+
+def runargumentparser():
+
+    argparser = argparse.ArgumentParser(prog = 'gmlbench.py run', description = 'Benchmark metadata extraction')
+
+    argparser.add_argument('inputs', help = 'Input files or directories', nargs = '+')
+    argparser.add_argument('-r', '--repeat', help = 'Runs per file (Default: 5)', type = int, default = 5, dest = 'repeat')
+    argparser.add_argument('-l', '--formatting', help = 'Output formatting (Default: raw; Available: raw, pretty)', default = 'raw', dest = 'formatting')
+    argparser.add_argument('--save', help = 'Save results as a baseline file', dest = 'savefile')
+    argparser.add_argument('--compare', help = 'Compare results against a baseline file', dest = 'baselinefile')
+    argparser.add_argument('--threshold', help = 'Allowed slowdown against baseline in percent (Default: 10)', type = float, default = 10.0, dest = 'threshold')
+
+    return argparser
+
+################################################################
+
+def corpusmain(argv):
+
+    args = corpusargumentparser().parse_args(argv)
+
+    paths = corpus(args.directory,
+                   sizes = args.sizes.split(','),
+                   positions = args.positions.split(','),
+                   origins = args.origins.split(','),
+                   members = [ int(count) for count in args.members.split(',') ])
+
+    for path in paths:
+        print(path)
+
+    return 0
+
+# Exits with status 1 if any stage is slower than the baseline
+#
+def runmain(argv):
+
+    args = runargumentparser().parse_args(argv)
+
+    paths = list(gmlparser.batchpaths(args.inputs))
+    if len(paths) == 0:
+        raise ValueError("Error: no input files")
+
+    result = benchmark(paths, args.repeat, args.formatting)
+
+    comparison = None
+    if args.baselinefile is not None:
+        with open(args.baselinefile, 'r') as i:
+            baseline = json.load(i)
+        comparison = compare(result, baseline, args.threshold / 100)
+
+    report(result, comparison)
+
+    if args.savefile is not None:
+        with open(args.savefile, 'w') as o:
+            json.dump(result, o, indent=2, sort_keys=True)
+
+    if comparison is not None and any(regressed for stage, before, after, ratio, regressed in comparison):
+        return 1
+
+    return 0
+
+commands = {
+    'corpus': corpusmain,
+    'run':    runmain
+}
+
+def main(argv = None):
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if len(argv) == 0 or argv[0] not in commands:
+        sys.stderr.write('Usage: gmlbench.py corpus|run ... (see: gmlbench.py <command> -h)\n')
+        return 2
+
+    return commands[argv[0]](argv[1:])
+
+if __name__ == '__main__':
+    sys.exit(main())
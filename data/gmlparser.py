@@ -23,618 +23,5873 @@ from warnings import warn as Warn
 import os.path
 import argparse
 import re
-import xmltodict
+import struct
 import json
-import urllib.request as URL
 import math
+import itertools
+import array
+import time
+import threading
+import contextlib
+import io
+
+# xmltodict and urllib are imported on demand, so that importing this
+# module and running '--help' stay fast.
 # TODO import csv
 
-# TODO retrieve place name by using metadata coordinates & ref.system info
-#   requires internet connection and connection to a valid server
-#
-# TODO rename JPEG2000 file based on metadata entries, syntax given by user
-#
 # TODO fix tfw export for JPEG2000 files
 
 ################################################################
 #
-# INPUT ARGUMENTS
+# PROFILING
+
+# Per-stage counters of metadata extraction. Profiling is off unless
+# a profiler is active in the current thread:
+#
+#   profiler = Profiler()
+#   with profiling(profiler):
+#       document = read_gml('image.jp2')
+#       document.to_json()
+#   profiler.stats()
+#
+# Stages are named blocks of work (see profile_stages). Each stage
+# counts:
+#
+#   calls:      number of times the stage was run
+#   seconds:    wall time, including nested stages
+#   bytesread:  bytes read from input files
+#   seeks:      seeks in input files
+#   allocated:  peak memory allocated in the stage, in bytes. Only
+#               counted if the profiler traces allocations (tracemalloc)
+#   traversals: full passes over GML data or its tree
+#   lookups:    key lookups in the GML path index
+#
+# Counters other than seconds and allocated go to the innermost stage.
+#
+# 'callback' is called with stage name and a dictionary of counters
+# of the run each time a stage ends, e.g. to export the counters to
+# a metrics system.
+
+profile_stages = (
+    'header',       # open file and check JPEG2000 header
+    'locate',       # find GML metadata in the file
+    'read',         # read and decode GML metadata
+    'stream',       # extract georeference values without parsing, see gmlstream
+    'parse',        # parse GML data into a tree
+    'index',        # build the GML path index
+    'georef',       # worldfile values
+    'extent',       # physical area sizes and corners
+    'xml', 'json', 'tfw', 'info' # output formats
+)
+
+profile_counters = ('calls', 'seconds', 'bytesread', 'seeks', 'allocated', 'traversals', 'lookups')
+
+# Profiler of the current thread
+def activeprofiler():
+    return getattr(profile_state, 'profiler', None)
+
+class Profiler(object):
+
+    def __init__(self, allocations = False, callback = None):
+        self.allocations = allocations
+        self.callback = callback
+
+        # Counters of each stage name
+        self.counters = {}
+
+        # Open stages: name, start time, start memory and peak memory
+        self.running = []
+
+    def start(self, name):
+
+        current = peak = 0
+        if self.allocations:
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+
+            # Peak of the enclosing stage so far, before resetting the peak
+            if len(self.running) > 0:
+                self.running[-1][3] = max(self.running[-1][3], peak)
+            tracemalloc.reset_peak()
+
+        self.running.append([ name, time.perf_counter(), current, current ])
+
+    def end(self):
+
+        name, started, current, peak = self.running.pop()
+
+        values = dict.fromkeys(profile_counters, 0)
+        values['calls'] = 1
+        values['seconds'] = time.perf_counter() - started
+
+        if self.allocations:
+            import tracemalloc
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            values['allocated'] = peak - current
+            if len(self.running) > 0:
+                self.running[-1][3] = max(self.running[-1][3], peak)
+
+        counters = self.counters.setdefault(name, dict.fromkeys(profile_counters, 0))
+        for counter in ('calls', 'seconds'):
+            counters[counter] += values[counter]
+        counters['allocated'] = max(counters['allocated'], values['allocated'])
+
+        if self.callback is not None:
+            self.callback(name, values)
+
+    # Add to a counter of the innermost stage
+    def count(self, counter, value = 1):
+        name = self.running[-1][0] if len(self.running) > 0 else None
+        counters = self.counters.setdefault(name, dict.fromkeys(profile_counters, 0))
+        counters[counter] += value
+
+    # Add counters of another profiler, see stats
+    def merge(self, stats):
+        for name, values in stats.items():
+            counters = self.counters.setdefault(name, dict.fromkeys(profile_counters, 0))
+            for counter in profile_counters:
+                if counter == 'allocated':
+                    counters[counter] = max(counters[counter], values[counter])
+                else:
+                    counters[counter] += values[counter]
+
+    # Counters of each stage as a dictionary. Counts outside
+    # of any stage are under 'other'.
+    def stats(self):
+        return dict([ ('other' if name is None else name, dict(values))
+                      for name, values in self.counters.items() ])
+
+# Active profiler of each thread
+profile_state = threading.local()
+
+# Make 'profiler' the active profiler of this thread in a with block.
+# If 'profiler' is None, profiling is not changed.
+#
+@contextlib.contextmanager
+def profiling(profiler):
 
-argparser = argparse.ArgumentParser()
+    # Nothing to profile
+    if profiler is None:
+        yield None
+        return
 
-argparser.add_argument('-i', '--input', help = 'Input JPEG2000 image file', nargs = '?', dest = 'inputfile')
-argparser.add_argument('-f', '--dataformat', help = 'Output format (Default: xml; Available: xml | json | [tfw|worldfile] | info)', nargs = '?', dest = 'outputformat')
-argparser.add_argument('-o', '--output', help = 'Output file name', nargs = '?', dest = 'outputfile')
-argparser.add_argument('-l', '--formatting', help = 'Data formatting (Default: raw; Available: raw, pretty)', nargs = '?', dest = 'formatting')
+    import tracemalloc
 
-args = argparser.parse_args()
+    previous = activeprofiler()
+    tracing = tracemalloc.is_tracing()
 
-# Formatting defaults to pretty format
-#
-if args.formatting is None:
-    args.formatting = 'pretty'
+    if profiler.allocations and not tracing:
+        tracemalloc.start()
 
-################################################################
+    profile_state.profiler = profiler
+    try:
+        yield profiler
+    finally:
+        profile_state.profiler = previous
+        if profiler.allocations and not tracing:
+            tracemalloc.stop()
 
-if not len(sys.argv) > 1:
-    argparser.print_help()
-    exit(0)
+# Named stage of the active profiler, if any
+#
+@contextlib.contextmanager
+def profilestage(name):
 
-if not args.inputfile.endswith('.jp2'):
-    Warn("Warning: Not a valid JPEG2000 file suffix")
+    profiler = activeprofiler()
 
-if args.outputformat is None:
-    raise ValueError("Error: No output format or file specified")
+    if profiler is None:
+        yield
+        return
 
-elif args.outputformat not in ('json', 'xml', 'tfw', 'worldfile', 'info'):
-    raise ValueError("Error: Not a valid output format")
+    profiler.start(name)
+    try:
+        yield
+    finally:
+        profiler.end()
 
-################################################################
+# Add to a counter of the active profiler, if any
 #
-# JPEG2000 CHECK STRINGS
+def profilecount(counter, value = 1):
+    profiler = activeprofiler()
+    if profiler is not None:
+        profiler.count(counter, value)
 
-# Look for these jp2 strings in file header
+# Input file which counts bytes read and seeks
 #
-jp2_header_str = ['ftypjp2', 'jp2 jpx', 'jp2', 'jp2h', 'jp2 J2P1']
+class ProfiledFile(object):
 
-# First string to look for in the selected jp2 file
-# Basically, we are looking for the start of footer of the file
-# which is indicated by this string
+    def __init__(self, f):
+        self.f = f
+
+    def read(self, size = -1):
+        data = self.f.read(size)
+        profilecount('bytesread', len(data))
+        return data
+
+    def seek(self, offset, whence = 0):
+        profilecount('seeks')
+        return self.f.seek(offset, whence)
+
+    def tell(self):
+        return self.f.tell()
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+# Percentiles of each counter of each stage over many profiler
+# stats (see Profiler.stats), e.g. of files of a batch run.
 #
-# We need to convert the string into bytes with encode method
-# for the following while loop.
+# Values are kept in compact arrays, 8 bytes per file and counter,
+# so that memory use stays low on long runs.
 #
-mdata_start_str = [ str.encode('gml.data'), str.encode('gxml'), str.encode('fxml') ]
-mdata_end_str = str.encode('uuid')
+class ProfileSummary(object):
+
+    def __init__(self):
+        self.files = 0
+        self.values = {}
+
+    def add(self, stats):
+        self.files += 1
+        for name, counters in stats.items():
+            for counter, value in counters.items():
+                self.values.setdefault((name, counter), array.array('d')).append(value)
+
+    # Percentiles of files where the stage was run:
+    #
+    #   {stage: {counter: {"p50": ..., "p90": ..., "p99": ..., "max": ..., "total": ...}}}
+    #
+    def percentiles(self):
+
+        percentiles = {}
+        for (name, counter), values in self.values.items():
+            values = sorted(values)
+            summary = {}
+            for p in (50, 90, 99):
+                summary['p' + str(p)] = values[min(len(values) - 1, int(len(values) * p / 100))]
+            summary['max'] = values[-1]
+            summary['total'] = sum(values)
+            percentiles.setdefault(name, {})[counter] = summary
+
+        return percentiles
 
 ################################################################
 #
-# OPEN JPEG2000 file
+# JPEG2000 BOX READER
 
-# Open the image file in read-only binary mode
-with open(args.inputfile, 'rb') as f:
+# JPEG2000 files consist of boxes (ISO/IEC 15444-1, Annex I).
+# Each box starts with a 4-byte length (LBox) and a 4-byte type (TBox).
+# If LBox is 1, the actual length is given in the following 8-byte
+# field (XLBox). If LBox is 0, the box extends to the end of the file.
+#
+# We only read box headers and seek past box contents, so the
+# codestream box (jp2c) is never read no matter how large it is.
 
-################################################################
+# JPEG2000 signature box, always the first 12 bytes of the file
 #
-# JPEG2000 header check
+jp2_signature = b'\x00\x00\x00\x0cjP  \r\n\x87\n'
 
-    # Check for the first 4 file lines
-    header_lines = f.readlines()[0:3]
+# Accepted brands in the file type box (ftyp)
+#
+jp2_brands = [ b'jp2 ', b'jpx ', b'jpm ' ]
 
-    # Declare a variable to store header text string
-    header_str = ''
+# Label box (lbl) contents which mark association boxes (asoc) carrying
+# GML metadata. The XML box (xml) inside such association box contains
+# the GML data.
+#
+gml_labels = [ b'gml.data', b'gxml', b'fxml' ]
+
+class JP2Box(object):
+
+    def __init__(self, boxtype, offset, headerlength, length):
+        self.boxtype      = boxtype
+        self.offset       = offset
+        self.headerlength = headerlength
+        self.length       = length
+
+        # Set by metadataboxes: enclosing superboxes, outermost first,
+        # contents of the label boxes (lbl) applying to the box, outermost
+        # first, and the UUID of uuid boxes
+        self.parents      = ()
+        self.labels       = ()
+        self.uuid         = None
+
+    # Start and end file offsets of box contents
+    @property
+    def start(self):
+        return self.offset + self.headerlength
+
+    @property
+    def end(self):
+        return self.offset + self.length
+
+    # Innermost label, or None
+    @property
+    def label(self):
+        return self.labels[-1] if len(self.labels) > 0 else None
+
+# Iterate over boxes between file offsets 'start' and 'end'.
+# Nested boxes are read by calling this again with the start and
+# end offsets of the superbox contents.
+#
+def readboxes(f, start, end):
 
-    # For each header line 1-4...
-    for a in header_lines:
+    offset = start
 
-        # Decode binary formatted string (bytes -> string conversion) and ignore any errors we encounter
-        header_decode = a.decode('utf-8', errors='ignore')
+    while offset < end:
+        f.seek(offset)
+        header = f.read(8)
 
-        # Store decoded string into header_str variable
-        header_str += header_decode
+        if len(header) < 8:
+            raise ValueError("Error: Truncated JPEG2000 box header")
 
-    # Check existence of each jp2 specific string we have defined in 'jp2_header_str' list above
-    for jp2_str in jp2_header_str:
+        length, boxtype = struct.unpack('>I4s', header)
+        headerlength = 8
 
-        # If a jp2 specific string is found, set up a new variable t and break the for loop
-        if jp2_str in header_str:
-            t = ''
-            break
+        if length == 1:
+            xlength = f.read(8)
+            if len(xlength) < 8:
+                raise ValueError("Error: Truncated JPEG2000 box header")
+            length = struct.unpack('>Q', xlength)[0]
+            headerlength = 16
 
-    # Variable t is not defined if any valid jp2 string is not found. Thus, this test gives
-    # us and exception (NameError) if no any jp2 string is found.
-    try:
-        t
-    except NameError:
-        raise ValueError("Error: Not a valid JPEG2000 file")
+        elif length == 0:
+            length = end - offset
 
-################################################################
+        if length < headerlength or offset + length > end:
+            raise ValueError("Error: Invalid JPEG2000 box length")
+
+        yield JP2Box(boxtype, offset, headerlength, length)
+        offset += length
+
+# Get file size without reading the file
 #
-# PARSE METADATA LINES
+def filesize(f):
+    return f.seek(0, os.SEEK_END)
+
+# Check signature and file type boxes in the file header
+#
+def jp2check(f):
 
-    # Enumerate all lines, look for metadata start line, using
-    # string 'mdata_start_str' as a reference
-    # Break the loop when found. If not found, abort.
-    #
-    # Return to the first line again in order to parse footer lines
     f.seek(0)
+    if f.read(12) != jp2_signature:
+        raise ValueError("Error: Not a valid JPEG2000 file")
 
-    for mstart_num, mstart_line in enumerate(f):
-        # TODO better formatting for this if statement:
-        if mdata_start_str[0] in mstart_line or mdata_start_str[1] in mstart_line or mdata_start_str[2] in mstart_line:
-            break
-            # else
-                # TODO echo cannot found metadata start. Abort
+    header = f.read(16)
+    if len(header) < 16 or header[4:8] != b'ftyp':
+        raise ValueError("Error: Not a valid JPEG2000 file")
 
-    # TODO should return value 2
-    #print(mstart_num)
-    #sys.exit()
+    # Brand and compatibility list of the file type box
+    length = struct.unpack('>I', header[0:4])[0]
+    brands = header[8:12] + f.read(max(length - 16, 0))
 
-    # Enumerate all lines, look for metadata end line, using
-    # string 'mdata_end_str' as a reference
-    # Break the loop when found. If not found, abort.
-    #
-    f.seek(0)
-    for mend_num, mend_line in enumerate(f):
-        if mdata_end_str in mend_line:
-            break
-        # else
-            # TODO echo cannot found metadata end. Abort
+    for brand in jp2_brands:
+        if brand in [ brands[i:i+4] for i in range(0, len(brands), 4) ]:
+            return
 
-    # Reset readlines
-    #
-    # Convert metadata start line from 'str' type to 'list' with split method
-    # and merge it with the rest of the metadata lines, defined by readlines method.
-    # Type of this line list is 'list', thus we use + operator to combine these
-    # lists.
-    #
-    f.seek(0)
-    metadata_lines = mstart_line.split() + f.readlines()[mstart_num:mend_num]
-    #mdata_lines = mstart_line.split() + f.readlines()
-
-    # Create a new metadata_str variable where we will store our extracted footer strings.
-    metadata_str = ''
-    for byteline in metadata_lines:
-
-        # Try decode each metadata line to UTF-8 format.
-        # As these lines are binary code, the conversion will fail for some
-        # of them. In a case of failure, we let the for loop pass to the next
-        # line
-        #
-        # Add each decoded line into 'footer_str' variable
-        #
-        try:
-            byteline_decoded = byteline.decode('utf-8', errors='strict')
-            metadata_str += byteline_decoded
+    raise ValueError("Error: Not a valid JPEG2000 file")
 
-        except Exception:
-            pass
+# Metadata box types: XML boxes and UUID boxes (e.g. GeoJP2)
+#
+metadata_boxtypes = [ b'xml ', b'uuid' ]
+
+# Names of known UUID box contents
+#
+uuid_names = {
+    bytes.fromhex('b14bf8bd083d4b43a5ae8cd7d5a6ce03'): 'geojp2',
+    bytes.fromhex('be7acfcb97a942e89c71999491e3afac'): 'xmp'
+}
 
-    f.close()
-    metadata_xml_all = re.sub(r'(^[^<]*)|([^>]$)', '', metadata_str)
+# Iterate over metadata boxes in file order, descending into
+# association boxes. Only box headers, labels and UUIDs are read.
+#
+# A label box (lbl) labels the boxes following it in its association
+# box, and the boxes nested in them.
+#
+def metadataboxes(f, start, end, labels = (), parents = ()):
 
-    # Create a list element from extracted metadata strings
-    metadata_xml_all_list = metadata_xml_all.split()
+    for box in readboxes(f, start, end):
 
-    # Find the last element containing <> symbols in metadata_xml_list, 
-    # get the string between them and store it to new variable
-    for i in reversed(metadata_xml_all_list):
-        if re.match('</*.*>', i):
-            last_tag = re.sub('</|>', '', i)
-            break
+        if box.boxtype == b'lbl ':
+            f.seek(box.start)
+            labels = labels + (f.read(min(box.end - box.start, 64)).rstrip(b'\x00'),)
 
-    # In the original metadata list, find the first occurence of the 'last_tag'
-    for firstxml_index, value in enumerate(metadata_xml_all_list):
-        if re.match('<' + last_tag + '>?', value):
-            break
+        elif box.boxtype == b'asoc':
+            for child in metadataboxes(f, box.start, box.end, labels, parents + (box,)):
+                yield child
 
-    # For joined metadata list, delete all list entries presented before our 'last_tag'
-    # Convert list to string format
-    metadata_parsed_list = metadata_xml_all_list[firstxml_index:]
-    metadata_joined_list = ' '.join(metadata_parsed_list)
+        elif box.boxtype in metadata_boxtypes:
+            box.parents = parents
+            box.labels = labels
+            if box.boxtype == b'uuid':
+                f.seek(box.start)
+                box.uuid = f.read(16)
+            yield box
 
 ################################################################
 #
+# JPEG2000 MARKER SCANNER
 
-class GMLDataParser(object):
+# Fallback for non-conforming files with broken box lengths.
+#
+# The file is scanned in fixed-size chunks for GML label strings (see
+# 'gml_labels'). Consecutive chunks overlap so that markers crossing
+# chunk boundaries are found as well. Memory use is bounded by the
+# chunk size, whatever the file size is.
 
-    def __init__(self, datalist):
-        self.datalist = datalist
+# Default chunk size and memory ceiling in bytes
+#
+scan_chunksize = 1024 * 1024
+scan_maxmemory = 16 * 1024 * 1024
 
-    def xmlraw(self):
-        return xmltodict.parse(self.datalist)
+# Iterate over file contents between offsets 'start' and 'end'.
+# Each chunk is extended by 'overlap' bytes from the next chunk.
+#
+def scanchunks(f, start, end, chunksize, overlap):
 
-    def xmlpretty(self):
-        return xmltodict.unparse(xmltodict.parse(self.datalist),
-        pretty=True,indent="  ",newl="\n")
+    offset = start
 
-    def jsonraw(self):
-        return json.dumps(xmltodict.parse(self.datalist),
-        separators=(',', ':'))
+    while offset < end:
+        f.seek(offset)
+        data = f.read(min(chunksize + overlap, end - offset))
 
-    def jsonpretty(self):
-        return json.dumps(xmltodict.parse(self.datalist),
-        indent=2, sort_keys=True)
+        if len(data) == 0:
+            break
 
-    # Convert GML metadata to JSON tree object
-    def jsontree(self):
-        return json.loads(self.jsonpretty())
-
-    # Function to get nested key values from JSON data
-    # by arainchi
-    # https://stackoverflow.com/a/19871956
-    def findkey(self, tree, keyvalue):
-        if isinstance(tree, list):
-            for i in tree:
-                for x in self.findkey(i, keyvalue):
-                    yield x
-        elif isinstance(tree, dict):
-            if keyvalue in tree:
-                yield tree[keyvalue]
-            for j in tree.values():
-                for x in self.findkey(j, keyvalue):
-                    yield x
-
-gmlparser = GMLDataParser(metadata_joined_list)
-gml_json = gmlparser.jsontree()
-
-def findgmlkey(data, gmlkey, num):
-    try:
-        return list(gmlparser.findkey(data, gmlkey))[num]
-    except:
-        # In a case we can't parse GML data for this element, return string 'Unknown'
-        return str("Unknown")
+        yield offset, data
+        offset += chunksize
 
-################################################################
+# Find the first file offset matching the compiled regular expression
+# 'pattern'. Matches may not be longer than 'overlap' bytes.
 #
-# Extract relevant values for TFW file/Worldfile
+def scanmarker(f, pattern, start, end, chunksize, overlap):
 
-class GML_Pos_offsetVectors():
+    for offset, data in scanchunks(f, start, end, chunksize, overlap):
+        match = pattern.search(data)
+        if match is not None:
+            return offset + match.start()
 
-    # Sample metadata structure of JPEG2000 files (may differ!):
+    return None
 
-    # offsetVector_1 and offsetVector_2:
-    #
-    # gml:FeatureCollection
-    #     gml:featureMember
-    #         gml:FeatureCollection
-    #             gml:featureMember
-    #                 gml:RectifiedGridCoverage
-    #                     gml:rectifiedGridDomain
-    #                         gml:RectifiedGrid
-    #                             gml:offsetVector[0]
-    #                                 #text
-    #                             gml:offsetVector[1]
-    #                                 #text
-    #
-    # gml_pos:
-    #
-    # gml:FeatureCollection
-    #     gml:featureMember
-    #         gml:FeatureCollection
-    #             gml:featureMember
-    #                 gml:RectifiedGridCoverage
-    #                     gml:rectifiedGridDomain
-    #                         gml:RectifiedGrid
-    #                             gml:origin
-    #                                 gml:Point
-    #                                     gml:pos
+# Scan the file for GML data and return start and end offsets of it.
+#
+# window    = scan only the last 'window' bytes of the file
+# maxmemory = memory ceiling for scan chunks and GML data
+#
+def jp2scan(f, window = None, chunksize = scan_chunksize, maxmemory = scan_maxmemory):
 
-    # Find offsetVector elements in the file metadata
-    # These elements include field #text which we are searching for
+    end = filesize(f)
+    begin = 0
 
-    gml_offsetVector_1 = findgmlkey(gml_json, '#text', 0)
-    gml_offsetVector_2 = findgmlkey(gml_json, '#text', 1)
+    if window is not None:
+        begin = max(end - window, 0)
 
-    # Check whether we have gml:pos or gml:coordinates element in the file metadata
-    # gml:coordinates is a deprecated type according to opengis.net
-    try:
-        gml_pos = findgmlkey(gml_json, 'gml:pos', 0)
-    except:
-        gml_pos = findgmlkey(gml_json, 'gml:coordinates', 0)
-
-    # Convert gml_pos to list type in a case it is string type
-    if type(gml_pos) is str:
-
-        # Split values, use any other symbol as a separator except for dot, minus prefix and numbers.
-        gml_pos = re.split('[^\-^\d^\.]+', gml_pos)
-
-        # Get semi-major axis of the Earth from ESPG metadata
-        # TODO get this actually from metadata!
-        #try:
-            # Try to get the value
-        # Fallback value
-        #except:
-        earth_axis_semimajor = 6378137
-
-        # Estimated meters for one degree on Earth surface for used ellipsoid model 
-        dec_mult = float((2 * math.pi * earth_axis_semimajor) / 360)
-
-    # Declare a new list 'l'
-    l = []
-    for d in (gml_offsetVector_1, gml_offsetVector_2):
-        if type(d) is str:
-            d = re.split('[^\-^\d^\.]+', d)
-
-        # Add extracted value to list 'l'
-        l += d
-
-    # Assumed length of list gml_pos is either 4 (gml:pos) or 6 (gml:coordinates).
-    # We must treat these list types differently.
-    # In a case length is either of those, return error.
-    #
-    # Map correct gml_pos values into new array 'g'
-    #
-    g = [0] * 4
-    if len(l) == 4:
-        g[0] = l[0]
-        g[1] = l[1]
-        g[2] = l[2]
-        g[3] = l[3]
-
-    elif len(l) == 6:
-        g[0] = l[3]
-        g[1] = l[4] # TODO is this correct index?
-        g[2] = l[2] # TODO is this correct index?
-        g[3] = l[1]
+    chunksize = min(chunksize, maxmemory)
 
-    else:
-        raise ValueError("Error: Incorrect worldfile metadata definition for rotational and pixel size values")
+    # Find the GML label, then the XML box following it
+    labels = re.compile(b'|'.join([ re.escape(l) for l in gml_labels ]))
+    overlap = max([ len(l) for l in gml_labels ])
+
+    marker = scanmarker(f, labels, begin, end, chunksize, overlap)
+
+    if marker is None:
+        raise ValueError("Error: No GML metadata found")
+
+    xmlbox = scanmarker(f, re.compile(b'xml '), marker, end, chunksize, 4)
+    if xmlbox is None:
+        xmlbox = marker
 
-    # World file definition
-    # https://en.wikipedia.org/wiki/World_file
+    start = scanmarker(f, re.compile(b'<'), xmlbox, end, chunksize, 1)
+    if start is None:
+        raise ValueError("Error: No GML metadata found")
+
+    # Get name of the root element. XML declaration, comments and
+    # other markup starting with '<?' or '<!' are skipped.
+    f.seek(start)
+    head = f.read(4096)
+    root = re.search(rb'<([A-Za-z_][\w.:-]*)', head)
+
+    if root is None:
+        raise ValueError("Error: No GML metadata found")
+
+    # Count nesting of root elements, since GML root elements
+    # (gml:FeatureCollection) may contain elements with the same name.
+    # The GML data ends where the first root element is closed.
     #
-    # g[0]          = pixel size of X-axis in map units
-    # g[1]          = Y-axis rotation
-    # g[2]          = X-axis rotation
-    # g[3]          = pixel size of Y-axis in map units
-    # gml_pos[0]    = X-coordinate of the center of the upper left pixel
-    # gml_pos[1]    = Y-coordinate of the center of the upper left pixel
+    # Only matches starting within a chunk (not within its overlap)
+    # are counted, so that each match is counted exactly once.
+    # Self-closing root elements ('<root/>') are not nested.
+    tag = re.compile(b'<(/?)' + re.escape(root.group(1)) + rb'[\s/>]')
+    overlap = len(root.group(1)) + 3
+    depth = 0
+
+    for offset, data in scanchunks(f, start, end, chunksize, overlap):
+
+        last = offset + chunksize >= end
+
+        for match in tag.finditer(data):
+            if match.start() >= chunksize and not last:
+                break
+
+            tagend = scanmarker(f, re.compile(b'>'), offset + match.start(), end, chunksize, 1)
+            if tagend is None:
+                break
+
+            if match.group(1) == b'':
+                f.seek(tagend - 1)
+                if f.read(1) != b'/':
+                    depth += 1
+                    continue
+            else:
+                depth -= 1
 
-    # TODO should gml_pos[1] value be decreased by -1?
+            if depth > 0:
+                continue
 
-gml_posinfo = GML_Pos_offsetVectors()
+            if tagend + 1 - start > maxmemory:
+                raise ValueError("Error: GML metadata exceeds memory limit")
+
+            return start, tagend + 1
+
+        if offset + chunksize - start > maxmemory:
+            raise ValueError("Error: GML metadata exceeds memory limit")
+
+    raise ValueError("Error: Incomplete GML metadata")
 
 ################################################################
 #
-# ESPG INFORMATION RETRIEVAL
+# REMOTE FILES
 
-class ESPGRetrieval():
+# JPEG2000 files behind HTTP servers are read with HTTP range requests
+# (RFC 7233), so only box headers and GML data are transferred and the
+# codestream is skipped like in local files.
+#
+# Connections are kept alive and reused. The number of concurrent
+# requests to one host is limited by the connection pool.
 
-    #def __init__(self):
-    #try:
-    espg_number = int(findgmlkey(gml_json, '@srsName', 0).split(':')[-1])
-    #except:
-        #Warn("Warning: Not a valid ESPG number found")
-        #return
-    espg_file = str(espg_number) + '.xml'
-
-    def ESPG_retrieve():
-        if not os.path.isfile('./' + espg_file):
-
-            # ESPG XML data URL
-            espg_url = 'http://epsg.io/' + espg_file
-            urlreq = URL.Request(
-                espg_url,
-                data = None,
-                headers={
-                    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_3) AppleWebKit/537.36 #(KHTML, like Gecko) Chrome/35.0.1916.47 Safari/537.36'
-                }
-            )
+def isremote(path):
+    return path.startswith('http://') or path.startswith('https://')
+
+# Absolute path of a local file, or the URL of a remote file
+#
+def inputkey(path):
+    if isremote(path):
+        return path
+    return os.path.abspath(path)
+
+class HTTPConnectionPool(object):
+
+    def __init__(self, maxperhost = 4, timeout = 60):
+
+        self.maxperhost = maxperhost
+        self.timeout = timeout
+        self.lock = threading.Lock()
+
+        # Idle connections and request slots for each (scheme, host, port)
+        self.idle = {}
+        self.slots = {}
+
+    def hostslots(self, host):
+        with self.lock:
+            if host not in self.slots:
+                self.slots[host] = threading.BoundedSemaphore(self.maxperhost)
+                self.idle[host] = []
+            return self.slots[host]
+
+    def connect(self, host):
+        import http.client
+
+        scheme, hostname, port = host
+        if scheme == 'https':
+            return http.client.HTTPSConnection(hostname, port, timeout = self.timeout)
+        return http.client.HTTPConnection(hostname, port, timeout = self.timeout)
+
+    # Send a GET request and return (status, headers, body). Requests
+    # on reused connections are retried once on a fresh connection,
+    # as the server may have closed an idle connection.
+    #
+    # check(status, headers) is called before the body is read. If it
+    # raises, the connection is closed without reading the body.
+    def request(self, url, headers, check = None):
+
+        import http.client
+        import urllib.parse
+
+        parts = urllib.parse.urlsplit(url)
+        host = (parts.scheme, parts.hostname, parts.port)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+
+        slots = self.hostslots(host)
+
+        with slots:
+            for attempt in (0, 1):
+                with self.lock:
+                    reused = len(self.idle[host]) > 0
+                    connection = self.idle[host].pop() if reused else self.connect(host)
 
-            # Try to download the XML file and save it
-            with open(espg_file, 'w') as espg_of:
                 try:
-                    espg_of.write(str(URL.urlopen(urlreq).read().decode('utf-8')))
-                except:
-                    Warn("Warning: Could not download ESPG metadata")
+                    connection.request('GET', target, headers = headers)
+                    response = connection.getresponse()
 
-                espg_of.close()
+                except (http.client.HTTPException, OSError):
+                    connection.close()
+                    if reused and attempt == 0:
+                        continue
+                    raise
 
-    @staticmethod
-    def ESPG_read():
-        with open(espg_file, 'r') as espg_rf:
-            espg_metadata_list = espg_rf.read()
+                try:
+                    if check is not None:
+                        check(response.status, response.headers)
+                    body = response.read()
+                except Exception:
+                    connection.close()
+                    raise
+
+                if response.will_close:
+                    connection.close()
+                else:
+                    with self.lock:
+                        self.idle[host].append(connection)
+
+                return response.status, response.headers, body
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+                del connections[:]
+
+# Shared connection pool, see remotepool
+http_pool = None
+
+def remotepool():
+    global http_pool
+    if http_pool is None:
+        http_pool = HTTPConnectionPool()
+    return http_pool
+
+# Read-only file object over HTTP range requests.
+#
+# Reads are served from a read-ahead block of 'blocksize' bytes, so
+# reading consecutive small box headers costs a single request.
+# Seeking never sends requests.
+
+class HTTPRangeFile(object):
+
+    def __init__(self, url, pool = None, blocksize = 16 * 1024):
+        self.url = url
+        self.pool = pool or remotepool()
+        self.blocksize = blocksize
+        self.position = 0
+        self.size = None
+        self.etag = None
+
+        # Read-ahead buffer and its file offset
+        self.buffer = b''
+        self.bufferoffset = 0
+
+        # Number of requests sent
+        self.requests = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.buffer = b''
+
+    # Bytes from 'start' up to 'end'. Responses other than the requested
+    # range (e.g. the whole file from servers ignoring Range) are not read.
+    def fetch(self, start, end):
+
+        ranges = []
+
+        def check(status, headers):
+
+            if status == 416:
+                return
+
+            if status != 206:
+                raise ValueError("Error: HTTP range request failed with status " + str(status) + ": " + self.url)
+
+            # Content-Range: bytes <start>-<end>/<size>
+            contentrange = headers.get('Content-Range', '')
+            match = re.match(r'bytes\s+(\d+)-(\d+)/(\d+|\*)', contentrange)
+            if match is None or int(match.group(1)) != start or int(match.group(2)) >= end:
+                raise ValueError("Error: Invalid HTTP range response: " + self.url)
+
+            ranges.append(match)
+
+        self.requests += 1
+        status, headers, body = self.pool.request(self.url, {
+            'Range': 'bytes=' + str(start) + '-' + str(end - 1),
+            'User-Agent': 'gmlparser'
+        }, check)
 
-            espgparser = GMLDataParser(espg_metadata_list)
-            espg_json = espgparser.jsonpretty()
+        if status == 416:
+            return b''
 
-        gml_datum          = findgmlkey(espg_json, 'gml:datumName', 0)
-        gml_ellipsoid      = findgmlkey(espg_json, 'gml:ellipsoidName', 0)
-        gml_coordsys       = findgmlkey(espg_json, 'gml:srsName', 0)
+        match = ranges[0]
+        if match.group(3) != '*':
+            self.size = int(match.group(3))
 
-        gml_axis_1_abbrev  = findgmlkey(espg_json, 'gml:axisAbbrev', 0)
-        gml_axis_1_dir     = findgmlkey(espg_json, 'gml:axisDirection', 0).capitalize()
+        self.etag = headers.get('ETag') or headers.get('Last-Modified')
 
-        gml_axis_2_abbrev  = findgmlkey(espg_json, 'gml:axisAbbrev', 1)
-        gml_axis_2_dir     = findgmlkey(espg_json, 'gml:axisDirection', 1).capitalize()
+        return body
 
-        # TODO. Have child element #text which contains the actual value
-        gml_semimajor_axis = findgmlkey(espg_json, 'gml:semiMajorAxis', 0)
-        gml_inverse_flat   = findgmlkey(espg_json, 'gml:inverseFlattening', 0)
+    def seek(self, offset, whence = os.SEEK_SET):
 
-#espg_data = ESPGRetrieval()
-#espg_data.ESPG_read()
-#sys.exit()
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            if self.size is None:
+                self.buffer = self.fetch(0, self.blocksize)
+                self.bufferoffset = 0
+            offset += self.size
+
+        self.position = max(offset, 0)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, n = -1):
+
+        if n is None or n < 0:
+            if self.size is None:
+                self.seek(0, os.SEEK_END)
+                self.seek(self.position)
+            n = max(self.size - self.position, 0)
+
+        start = self.position
+        end = start + n
+
+        if start < self.bufferoffset or end > self.bufferoffset + len(self.buffer):
+            fetchend = start + max(n, self.blocksize)
+            if self.size is not None:
+                fetchend = min(fetchend, self.size)
+            if fetchend <= start:
+                return b''
+            self.buffer = self.fetch(start, fetchend)
+            self.bufferoffset = start
+
+        data = self.buffer[start - self.bufferoffset:end - self.bufferoffset]
+        self.position += len(data)
+
+        return data
+
+    # Size and ETag (or Last-Modified) of the remote file, see GMLCache
+    def identity(self):
+        if self.size is None:
+            self.seek(0, os.SEEK_END)
+            self.seek(0)
+        return (self.size, self.etag)
+
+# Open a local file or a HTTP URL for reading
+#
+def openinput(path):
+    if isremote(path):
+        return HTTPRangeFile(path)
+    return open(path, 'rb')
+
+# File size and modification time, or size and ETag for remote files
+#
+def inputidentity(f):
+    if isinstance(f, HTTPRangeFile):
+        return f.identity()
+    st = os.fstat(f.fileno())
+    return (st.st_size, st.st_mtime_ns)
 
 ################################################################
 #
-# PHYSICAL AREA SIZE CALCULATOR
+# GML METADATA EXTRACTION
 
-def axisCalculator():
+# Read GML data from the file.
+#
+# JPEG2000 boxes are walked first. If the file has broken box lengths
+# or no XML boxes, the file is scanned for GML markers instead.
+#
+# XML box of GML data found by walking the box structure, or None
+# if the box structure is broken or has no XML boxes
+#
+def locategmlbox(f):
 
-    # Axis-based data
     try:
-        x_high = float(findgmlkey(gml_json, 'gml:upperCorner', 0).split()[0])
-        x_low  = float(findgmlkey(gml_json, 'gml:lowerCorner', 0).split()[0])
-        y_high = float(findgmlkey(gml_json, 'gml:upperCorner', 0).split()[1])
-        y_low  = float(findgmlkey(gml_json, 'gml:lowerCorner', 0).split()[1])
+        return gmlbox(metadataboxes(f, 0, filesize(f)))
+    except ValueError:
+        return None
 
-    except:
+# The first XML box labelled as GML data (see 'gml_labels'), or the
+# first XML box if none is labelled. Boxes after it are not read.
+#
+def gmlbox(boxes):
 
-        # Pixel-based data
-        try:
-            x_high = float(findgmlkey(gml_json, 'gml:high', 0).split()[0])
-            x_low  = float(findgmlkey(gml_json, 'gml:low', 0).split()[0])
-            y_high = float(findgmlkey(gml_json, 'gml:high', 0).split()[1])
-            y_low  = float(findgmlkey(gml_json, 'gml:low', 0).split()[1])
-
-        except:
-            x_high = "Unknown"
-            x_low  = "Unknown"
-            y_high = "Unknown"
-            y_low  = "Unknown"
-
-    for t in (x_high, x_low, y_high, y_low):
-        if type(t) is not float:
-            return list([
-            'Unknown',
-            'Unknown',
-            'Unknown',
-            'Unknown',
-            'Unknown'
-            ])
-
-    def RadtoGrad(num):
-        rad_to_deg = 180 * num / math.pi
-        deg_to_grad = 10 * rad_to_deg / 9
-        return deg_to_grad
+    first = None
 
-###############################
-# X and Y lengths
-# Area size in km^2
+    for box in boxes:
+        if box.boxtype != b'xml ':
+            continue
+        if any([ label in gml_labels for label in box.labels ]):
+            return box
+        if first is None:
+            first = box
 
-    x_length = x_high - x_low 
-    y_length = y_high - y_low
-    xy_area  = (x_length * y_length) / 1000000
+    return first
 
-###############################
-# Inverse geodetic calculation
+def gmldata(f, window = None, maxmemory = scan_maxmemory):
 
-    xy_hypotenuse = math.sqrt(x_length ** 2 + y_length ** 2)
-    inverse_geod_angle = RadtoGrad(math.atan2(y_length, x_length))
+    with profilestage('locate'):
+        gmlbox = locategmlbox(f)
 
-###############################
+        if gmlbox is not None:
+            start = gmlbox.start
+            end = gmlbox.end
+        else:
+            start, end = jp2scan(f, window = window, maxmemory = maxmemory)
 
-    return list([
-        format(x_length, '.2f'),
-        format(y_length, '.2f'),
-        format(xy_area,  '.2f'),
-        format(xy_hypotenuse, '.2f'),
-        format(inverse_geod_angle, '.2f')
-        ])
+    with profilestage('read'):
+        f.seek(start)
+        data = f.read(end - start)
+
+        # XML box contents may be padded
+        return data.strip(b'\x00 \t\r\n').decode('utf-8')
+
+# Table of all metadata boxes of a file (see metadataboxes), built in
+# one pass over box headers.
+#
+# Box contents are read, decoded and parsed on first access only, so
+# large XML boxes which are not used cost nothing. The GML box (see
+# gmlbox) is the one read by read_gml.
+#
+class BoxTable(object):
+
+    def __init__(self, path, boxes):
+        self.path  = path
+        self.boxes = boxes
 
-gml_calc = axisCalculator()
+        # Contents and parsers by box number
+        self.payloads = {}
+        self.parsers  = {}
+
+    # Input file, counting bytes read if profiled
+    @staticmethod
+    def open(path):
+        f = openinput(path)
+        if activeprofiler() is not None:
+            f = ProfiledFile(f)
+        return f
+
+    @classmethod
+    def read(cls, path):
+
+        with profilestage('header'):
+            f = cls.open(path)
+            try:
+                jp2check(f)
+            except Exception:
+                f.close()
+                raise
+
+        with f:
+            with profilestage('locate'):
+                return cls(path, list(metadataboxes(f, 0, filesize(f))))
+
+    def __len__(self):
+        return len(self.boxes)
+
+    # Number of the GML box, or None
+    def gmlindex(self):
+        box = gmlbox(self.boxes)
+        return None if box is None else self.boxes.index(box)
+
+    def box(self, i):
+        if i < 0 or i >= len(self.boxes):
+            raise ValueError("Error: No metadata box " + str(i))
+        return self.boxes[i]
+
+    # Contents of a box (bytes). UUIDs of uuid boxes are left out.
+    def payload(self, i):
+        if i not in self.payloads:
+            box = self.box(i)
+            start = box.start + (16 if box.boxtype == b'uuid' else 0)
+            with profilestage('read'):
+                with self.open(self.path) as f:
+                    f.seek(start)
+                    self.payloads[i] = f.read(box.end - start)
+        return self.payloads[i]
+
+    # Contents of an XML box as text
+    def text(self, i):
+        if self.box(i).boxtype != b'xml ':
+            raise ValueError("Error: Not an XML box")
+        return self.payload(i).strip(b'\x00 \t\r\n').decode('utf-8')
+
+    # Parser of an XML box, see GMLDataParser
+    def parser(self, i):
+        if i not in self.parsers:
+            self.parsers[i] = GMLDataParser(self.text(i))
+        return self.parsers[i]
+
+    # Document of an XML box, see GMLDocument. The document shares
+    # the parser of the box.
+    def document(self, i):
+        document = GMLDocument(self.path, None)
+        document.parser = self.parser(i)
+        document.boxtable = self
+        return document
+
+    # Description of a box: number, type, file offset and length, label,
+    # UUID and enclosing superbox types
+    def row(self, i):
+        box = self.boxes[i]
+        uuid = None
+        if box.uuid is not None:
+            uuid = uuid_names.get(box.uuid, box.uuid.hex())
+        return {
+            'box':     i,
+            'type':    box.boxtype.decode('latin-1').strip(),
+            'offset':  box.offset,
+            'length':  box.length,
+            'label':   None if box.label is None else box.label.decode('utf-8', 'replace'),
+            'uuid':    uuid,
+            'parents': [ parent.boxtype.decode('latin-1').strip() for parent in box.parents ],
+            'gml':     box is gmlbox(self.boxes)
+        }
+
+    def rows(self):
+        return [ self.row(i) for i in range(len(self.boxes)) ]
 
 ################################################################
 #
-# TFW FORMAT PARSE
+# GML DATA PARSER
 
-def tfwparse():
+class GMLDataParser(object):
 
-    worldfile_values = gml_posinfo.g + gml_posinfo.gml_pos
+    def __init__(self, datalist):
+        self.datalist = datalist
 
-    worldfile_out = ''
-    for value in worldfile_values:
-        worldfile_out += format(float(value)) + '\n'
+        # GML data is parsed once into this tree. All output formats
+        # and key lookups use the same tree.
+        self.tree = None
 
-    # Return gml_out, remove last empty line
-    return worldfile_out[:-1]
+        # Number of xmltodict.parse calls for this data, should never exceed 1
+        self.parsecount = 0
+
+        self.pathindex = None
+
+    def parse(self):
+        if self.tree is None:
+            import xmltodict
+            with profilestage('parse'):
+                profilecount('traversals')
+                self.tree = xmltodict.parse(self.datalist)
+            self.parsecount += 1
+        return self.tree
+
+    def xmlraw(self):
+        return self.parse()
+
+    def xmlpretty(self):
+        import xmltodict
+        return xmltodict.unparse(self.parse(),
+        pretty=True,indent="  ",newl="\n")
+
+    def jsonraw(self):
+        return json.dumps(self.parse(),
+        separators=(',', ':'))
+
+    def jsonpretty(self):
+        return json.dumps(self.parse(),
+        indent=2, sort_keys=True)
+
+    # Convert GML metadata to JSON tree object
+    def jsontree(self):
+        return self.parse()
+
+    # Index of all keys in the tree, see GMLPathIndex
+    def index(self):
+        if self.pathindex is None:
+            tree = self.parse()
+            with profilestage('index'):
+                profilecount('traversals')
+                self.pathindex = GMLPathIndex(tree)
+        return self.pathindex
 
 ################################################################
 #
-# INFORMATION PARSE
+# GML PATH INDEX
 
-# Extract all important metadata elements
+# Index of element and attribute names of a parsed GML tree, built in
+# a single traversal.
+#
+# Each name ('gml:pos', '@srsName', 'gml:offsetVector') is mapped to an
+# ordered list of (path, value) pairs. A path is a tuple of (name, index)
+# steps from the root element, where index is the position of the
+# element among its siblings of the same name:
+#
+#   (('gml:FeatureCollection', 0), ..., ('gml:RectifiedGrid', 0), ('gml:offsetVector', 1))
+#
+# Entries of each element are added before walking into its children in
+# sorted key order, which is the order of the pretty JSON output.
 
-def infoparse():
+class GMLPathIndex(object):
 
-    def getkeys():
+    def __init__(self, tree):
 
-        # TODO these might or might not be defined in JSON data!
-        infolist = [
-          ['Image Name',                 args.inputfile.split('.')[0]       ],
-          ['Source Name',                findgmlkey(gml_json, '@srsName', 0)          ],
-          ['GML File Name',              findgmlkey(gml_json, 'gml:fileName', 0)      ],
-          ['File Structure',             findgmlkey(gml_json, 'gml:fileStructure', 0) ],
-          ['Rectified Grid Coverage ID', findgmlkey(gml_json, '@dimension', 0)        ],
-         #['Axis Names',            ' '.join(findgmlkey('gml:axisName', 0)) ],
-          ['Map Scale',                         ],
-          ['Upper Corner Coordinates',   findgmlkey(gml_json, 'gml:upperCorner', 0)   ],
-          ['Lower Corner Coordinates',   findgmlkey(gml_json, 'gml:lowerCorner', 0)   ],
-          ['X-axis Length in Meters',    gml_calc[0]                        ],
-          ['Y-axis Length in Meters',    gml_calc[1]                        ],
-          ['Area Size in Square Kilometers', gml_calc[2]                    ],
-          ['Distance of Corners Points in Meters', gml_calc[3]                     ],
-          ['Azimuth Angle of Corner Points in Gradians', gml_calc[4] ],
-          ['Grid Envelope High',         findgmlkey(gml_json, 'gml:high', 0)          ],
-          ['Grid Envelope Low',          findgmlkey(gml_json, 'gml:low', 0)           ],
-          ['X-axis Pixel Size in Map Units', gml_posinfo.g[0]               ],
-          ['Y-axis pixel size in Map Units', gml_posinfo.g[3]               ],
-          ['X-axis Rotation',           gml_posinfo.g[1]                    ],
-          ['Y-axis Rotation',           gml_posinfo.g[2]                    ],
-          ['Upper Left Pixel X-coordinate Center in Map Units', gml_posinfo.gml_pos[0]   ],
-          ['Upper Left Pixel Y-coordinate Center in Map Units', gml_posinfo.gml_pos[1]   ]
-          #['EPSG Projection Code',                     
-          #['Projection Name',
-          #['Projection Area',
-          #['Image Area',
-        ]
+        self.tree = tree
 
-        #row_format ="{:>15}" * (len(teams_list) + 1)
-        #print(row_format.format("", *teams_list))
-        #for team, row in zip(teams_list, data):
-         #   print row_format.format(team, *row)
+        # Qualified names and local names (without namespace prefix)
+        self.names = {}
+        self.localnames = {}
 
-        #for i in infolist:
-        #    print(i)
+        self.walk(tree, ())
 
-        #sys.exit()
+    @staticmethod
+    def localname(name):
+        if name.startswith('@'):
+            return '@' + name[1:].split(':')[-1]
+        return name.split(':')[-1]
 
-        for i in range(len(infolist)):
-            for j in range(len(infolist[i])):
-                    print(infolist[i][j], end=' ')
-            print('')
+    def add(self, name, path, value):
+        entry = (path, value)
+        self.names.setdefault(name, []).append(entry)
+        self.localnames.setdefault(self.localname(name), []).append(entry)
 
-    getkeys()
+    def walk(self, tree, path):
 
-    #print(gml_source)
+        children = []
 
-################################
-#
-# OUTPUT WRITING
+        for name in sorted(tree):
+            values = tree[name]
+            if not isinstance(values, list):
+                values = [values]
 
-try:
-    args.outputfile
+            for i, value in enumerate(values):
+                childpath = path + ((name, i),)
+                self.add(name, childpath, value)
+                if isinstance(value, dict):
+                    children.append((childpath, value))
 
-    with open(args.outputfile, 'w') as o:
+        for childpath, value in children:
+            self.walk(value, childpath)
 
-        if args.outputformat in 'xml':
-            if args.formatting in 'pretty':
-                o.write(gmlparser.xmlpretty())
-            elif args.formatting in 'raw':
-                o.write(gmlparser.jsonraw())
-            else:
-                raise ValueError("Error: Undefined formatting")
+    # Text of an element value. Elements with attributes
+    # have their text in '#text' key.
+    @staticmethod
+    def text(value):
+        if isinstance(value, dict):
+            return value.get('#text')
+        return value
+
+    # All (path, value) pairs of a qualified name
+    def findall(self, name):
+        profilecount('lookups')
+        return self.names.get(name, [])
+
+    # Text of the num:th occurrence of a qualified name
+    def find(self, name, num = 0, default = None):
+        profilecount('lookups')
+        entries = self.names.get(name, [])
+        if num < len(entries):
+            return self.text(entries[num][1])
+        return default
+
+    # Sort key of a path in document order. Entries are indexed in
+    # sorted name order, but the tree keeps names of each element in
+    # the order they first occur in GML data (attributes first).
+    def documentorder(self, path):
+        key = []
+        node = self.tree
+        for name, i in path:
+            key.append((list(node).index(name), i))
+            node = node[name]
+            if isinstance(node, list):
+                node = node[i]
+        return key
+
+    # Text of the first occurrence of a qualified name in document order
+    def first(self, name, default = None):
+        entries = self.findall(name)
+        if len(entries) == 0:
+            return default
+        return self.text(min(entries, key = lambda entry: self.documentorder(entry[0]))[1])
+
+    # All (path, value) pairs matching a selector, see GMLSelector
+    def select(self, selector):
+        profilecount('lookups')
+        selector = compileselector(selector)
+        return [ entry for entry in self.localnames.get(selector.localname, [])
+                 if selector.matches(entry[0]) ]
+
+    # Text of the num:th element matching a selector
+    def selectone(self, selector, num = 0, default = None):
+        entries = self.select(selector)
+        if num < len(entries):
+            return self.text(entries[num][1])
+        return default
+
+# Path selectors such as 'RectifiedGrid/offsetVector[1]' or
+# 'Envelope/@srsName'.
+#
+# Steps are separated by '/'. A step without namespace prefix matches
+# any prefix. An optional [index] matches the position among siblings
+# of the same name, counting from 0. Selectors match the end of a path
+# unless they start with '/'.
 
-        elif args.outputformat in 'json':
-            if args.formatting in 'pretty':
-                o.write(gmlparser.jsonpretty())
-            elif args.formatting in 'raw':
-                o.write(gmlparser.jsonraw())
-            else:
-                raise ValueError("Error: invalid data formatting")
+class GMLSelector(object):
 
-        elif args.outputformat in 'tfw' or args.outputformat in 'worldfile':
-            o.write(tfwparse())
+    step_regex = re.compile(r'^(@?[^\[\]/@]+)(?:\[(\d+)\])?$')
 
-        elif args.outputformat in 'info':
-            o.write(infoparse())
-        else:
-            raise ValueError("Error: invalid data format")
+    def __init__(self, selector):
 
-except:
+        self.absolute = selector.startswith('/')
+        self.steps = []
 
-    if args.outputformat in 'xml':
-        if args.formatting in 'pretty':
-            print(gmlparser.xmlpretty())
-        elif args.formatting in 'raw':
-            print(gmlparser.xmlraw())
-        else:
-            raise ValueError("Error: Undefined formatting")
+        for step in selector.strip('/').split('/'):
+            match = self.step_regex.match(step)
+            if match is None:
+                raise ValueError("Error: Invalid GML selector: " + selector)
 
-    elif args.outputformat in 'json':
-        if args.formatting in 'pretty':
-            print(gmlparser.jsonpretty())
-        elif args.formatting in 'raw':
-            print(gmlparser.jsonraw())
-        else:
-            raise ValueError("Error: Undefined formatting")
+            name = match.group(1)
+            index = match.group(2)
+            self.steps.append((name, ':' in name, None if index is None else int(index)))
 
-    elif args.outputformat in 'tfw' or args.outputformat in 'worldfile':
-        print(tfwparse())
+        self.localname = GMLPathIndex.localname(self.steps[-1][0])
 
-    elif args.outputformat in 'info':
-        print(infoparse())
+    def matches(self, path):
+
+        if len(path) < len(self.steps) or (self.absolute and len(path) != len(self.steps)):
+            return False
+
+        for (name, qualified, index), (pathname, pathindex) in zip(reversed(self.steps), reversed(path)):
+            if qualified:
+                if name != pathname:
+                    return False
+            elif name != GMLPathIndex.localname(pathname):
+                return False
+
+            if index is not None and index != pathindex:
+                return False
+
+        return True
+
+# Compiled selectors by selector string
+gml_selectors = {}
+
+def compileselector(selector):
+    if isinstance(selector, GMLSelector):
+        return selector
+    if selector not in gml_selectors:
+        gml_selectors[selector] = GMLSelector(selector)
+    return gml_selectors[selector]
+
+def findgmlkey(index, gmlkey, num):
+    # In a case we can't find GML data for this element, return string 'Unknown'
+    return index.find(gmlkey, num, "Unknown")
+
+################################################################
+#
+# STREAMING EXTRACTION
+
+# Extract only a declared set of fields from GML data, without parsing
+# it into a tree. Parsing stops as soon as all fields are found.
+#
+# Fields are given as {name: (selectors, count)}. Texts of the first
+# 'count' elements or attributes matching any of the selectors (see
+# GMLSelector) are collected in document order. Returns a compact
+# record {name: [text, ...]}.
+
+# Fields needed for worldfile output
+#
+georef_fields = {
+    'offsetVector': (('RectifiedGrid/offsetVector',), 2),
+    'pos':          (('RectifiedGrid/origin/Point/pos',
+                      'RectifiedGrid/origin/Point/coordinates'), 1),
+    'srsName':      (('@srsName',), 1)
+}
+
+# Size of data slices fed to the parser
+stream_chunksize = 64 * 1024
+
+class GMLStreamDone(Exception):
+    pass
+
+def gmlstream(data, fields):
+
+    from xml.parsers import expat
+
+    selectors = [ (name, [ compileselector(s) for s in spec[0] ], spec[1])
+                  for name, spec in fields.items() ]
+
+    record = dict([ (name, []) for name in fields ])
+    missing = len(selectors)
+
+    if missing == 0:
+        return record
+
+    # Element path and, for each open element, counts of child names
+    # for sibling indexes
+    path = []
+    siblings = [ {} ]
+
+    # Open elements whose text is collected: (depth, name, text parts)
+    collecting = []
+
+    def collect(name, value):
+        nonlocal missing
+        record[name].append(value)
+        if len(record[name]) == fields[name][1]:
+            missing -= 1
+        if missing == 0:
+            raise GMLStreamDone()
+
+    def wanted(elementpath):
+        for name, s, count in selectors:
+            if len(record[name]) < count:
+                for selector in s:
+                    if selector.matches(elementpath):
+                        return name
+        return None
+
+    def start(tag, attrs):
+        counts = siblings[-1]
+        path.append((tag, counts.get(tag, 0)))
+        counts[tag] = counts.get(tag, 0) + 1
+        siblings.append({})
+
+        for i in range(0, len(attrs), 2):
+            name = wanted(tuple(path) + (('@' + attrs[i], 0),))
+            if name is not None:
+                collect(name, attrs[i + 1])
+
+        name = wanted(tuple(path))
+        if name is not None:
+            collecting.append((len(path), name, []))
+
+    def end(tag):
+        if len(collecting) > 0 and collecting[-1][0] == len(path):
+            depth, name, parts = collecting.pop()
+            collect(name, ''.join(parts).strip())
+        path.pop()
+        siblings.pop()
+
+    def characters(text):
+        if len(collecting) > 0 and collecting[-1][0] == len(path):
+            collecting[-1][2].append(text)
+
+    parser = expat.ParserCreate()
+    parser.ordered_attributes = True
+    parser.buffer_text = True
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = characters
+
+    with profilestage('stream'):
+        profilecount('traversals')
+        try:
+            for i in range(0, len(data), stream_chunksize):
+                parser.Parse(data[i:i + stream_chunksize], False)
+            parser.Parse('', True)
+        except GMLStreamDone:
+            pass
+
+    return record
+
+################################################################
+#
+# STREAMING JSON CONVERSION
+
+# Convert GML data to JSON text directly from parser events, without
+# building a tree. Output is byte-identical to GMLDataParser.jsonraw
+# and jsonpretty (xmltodict.parse and json.dumps).
+#
+# xmltodict puts repeated child elements into a list at the place of
+# the first one, and in pretty format, indentation depends on whether
+# a value ends up in a list. So when an element ends, its value is
+# serialized to a single string, indented relative to the element
+# itself, and kept until the enclosing element ends. Only open elements
+# and the serialized values of their children are held in memory.
+
+class GMLJSONConverter(object):
+
+    def __init__(self, pretty = False):
+        from json.encoder import encode_basestring_ascii
+
+        self.pretty = pretty
+        self.quote = encode_basestring_ascii
+
+        # Open elements: [ attributes, { name: [ values ] }, text parts ]
+        self.stack = [ [ [], {}, [] ] ]
+
+    def start(self, name, attrs):
+        attributes = [ ('@' + attrs[i], self.quote(attrs[i + 1])) for i in range(0, len(attrs), 2) ]
+        self.stack.append([ attributes, {}, [] ])
+
+    def end(self, name):
+        attributes, children, text = self.stack.pop()
+
+        text = ''.join(text).strip()
+
+        if len(attributes) == 0 and len(children) == 0:
+            value = self.quote(text) if text != '' else 'null'
+        else:
+            entries = attributes + [ (child, values[0] if len(values) == 1 else self.array(values))
+                                     for child, values in children.items() ]
+            if text != '':
+                entries.append(('#text', self.quote(text)))
+            value = self.object(entries)
+
+        self.stack[-1][1].setdefault(name, []).append(value)
+
+    def characters(self, text):
+        self.stack[-1][2].append(text)
+
+    # Nested value, one level deeper
+    def indent(self, value):
+        return value.replace('\n', '\n  ')
+
+    def object(self, entries):
+
+        if not self.pretty:
+            return '{' + ','.join([ self.quote(key) + ':' + item for key, item in entries ]) + '}'
+
+        entries.sort(key = lambda entry: entry[0])
+        return '{\n  ' + ',\n  '.join([ self.quote(key) + ': ' + self.indent(item)
+                                          for key, item in entries ]) + '\n}'
+
+    def array(self, items):
+
+        if not self.pretty:
+            return '[' + ','.join(items) + ']'
+
+        return '[\n  ' + ',\n  '.join([ self.indent(item) for item in items ]) + '\n]'
+
+    # JSON text of the document in chunks
+    def chunks(self, chunksize = stream_chunksize):
+
+        attributes, children, text = self.stack[0]
+        if len(children) == 0:
+            raise ValueError("Error: No GML data")
+
+        value = self.object([ (name, values[0]) for name, values in children.items() ])
+        self.stack = [ [ [], {}, [] ] ]
+
+        for i in range(0, len(value), chunksize):
+            yield value[i:i + chunksize]
+
+# Write GML data (str) as JSON to a file object 'o'
+#
+def gmljson(data, o, pretty = False):
+
+    from xml.parsers import expat
+
+    converter = GMLJSONConverter(pretty)
+
+    parser = expat.ParserCreate('utf-8')
+    parser.ordered_attributes = True
+    parser.buffer_text = True
+    parser.StartElementHandler = converter.start
+    parser.EndElementHandler = converter.end
+    parser.CharacterDataHandler = converter.characters
+
+    def forbid_entities(*args):
+        raise ValueError("entities are disabled")
+    parser.EntityDeclHandler = forbid_entities
+
+    with profilestage('json'):
+        profilecount('traversals')
+
+        for i in range(0, len(data), stream_chunksize):
+            parser.Parse(data[i:i + stream_chunksize].encode('utf-8'), False)
+        parser.Parse(b'', True)
+
+        for chunk in converter.chunks():
+            o.write(chunk)
+
+################################################################
+#
+# Extract relevant values for TFW file/Worldfile
+
+# World file values and spatial reference system of a tile.
+#
+# World file definition
+# https://en.wikipedia.org/wiki/World_file
+#
+# a = pixel size of X-axis in map units
+# d = Y-axis rotation
+# b = X-axis rotation
+# e = pixel size of Y-axis in map units
+# c = X-coordinate of the center of the upper left pixel
+# f = Y-coordinate of the center of the upper left pixel
+#
+# srs = EPSG code, or None if not known (see epsgcode)
+#
+# Values are parsed once into floats. Many records can be packed
+# into contiguous arrays, see packgeoreferences.
+#
+class GeoReference(object):
+
+    # Sample metadata structure of JPEG2000 files (may differ!):
+
+    # offsetVector_1 and offsetVector_2:
+    #
+    # gml:FeatureCollection
+    #     gml:featureMember
+    #         gml:FeatureCollection
+    #             gml:featureMember
+    #                 gml:RectifiedGridCoverage
+    #                     gml:rectifiedGridDomain
+    #                         gml:RectifiedGrid
+    #                             gml:offsetVector[0]
+    #                             gml:offsetVector[1]
+    #
+    # gml_pos:
+    #
+    # gml:FeatureCollection
+    #     gml:featureMember
+    #         gml:FeatureCollection
+    #             gml:featureMember
+    #                 gml:RectifiedGridCoverage
+    #                     gml:rectifiedGridDomain
+    #                         gml:RectifiedGrid
+    #                             gml:origin
+    #                                 gml:Point
+    #                                     gml:pos
+
+    offsetVector_selector = compileselector('RectifiedGrid/offsetVector')
+    pos_selector          = compileselector('RectifiedGrid/origin/Point/pos')
+    coordinates_selector  = compileselector('RectifiedGrid/origin/Point/coordinates')
+
+    __slots__ = ('a', 'd', 'b', 'e', 'c', 'f', 'srs')
+
+    # Names of values in world file order
+    fields = ('a', 'd', 'b', 'e', 'c', 'f')
+
+    # Numbers in GML coordinate strings, e.g. '380000.25 6675999.75',
+    # '380000.25,6675999.75' or '1.5E-1 0'
+    number_pattern = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+    # Find offsetVector and gml:pos elements from a parsed tree
+    @classmethod
+    def fromindex(cls, index):
+
+        # Find offsetVector elements in the file metadata
+
+        gml_offsetVector_1 = index.selectone(cls.offsetVector_selector, 0)
+        gml_offsetVector_2 = index.selectone(cls.offsetVector_selector, 1)
+
+        # Check whether we have gml:pos or gml:coordinates element in the file metadata
+        # gml:coordinates is a deprecated type according to opengis.net
+        gml_pos = index.selectone(cls.pos_selector)
+        if gml_pos is None:
+            gml_pos = index.selectone(cls.coordinates_selector)
+
+        # First srsName in document order, as in fromstream
+        return cls.fromgml(gml_offsetVector_1, gml_offsetVector_2, gml_pos, index.first('@srsName'))
+
+    # Find offsetVector and gml:pos elements without parsing the whole
+    # GML data, see gmlstream
+    @classmethod
+    def fromstream(cls, data):
+
+        record = gmlstream(data, georef_fields)
+        offsetvectors = record['offsetVector'] + [ None, None ]
+        gml_pos = record['pos'] + [ None ]
+        srsname = record['srsName'] + [ None ]
+
+        return cls.fromgml(offsetvectors[0], offsetvectors[1], gml_pos[0], srsname[0])
+
+    # Values from GML element texts.
+    #
+    # Offset vectors have two components (x, y) or three components
+    # (x, y, z). In both cases the first two components of the first
+    # vector give a and d, and the first two components of the second
+    # vector give b and e. Origin gives c and f, with a possible third
+    # coordinate ignored.
+    #
+    @classmethod
+    def fromgml(cls, gml_offsetVector_1, gml_offsetVector_2, gml_pos, srsname = None):
+
+        values = []
+
+        for text, lengths in ((gml_offsetVector_1, (2, 3)), (gml_offsetVector_2, (2, 3)), (gml_pos, (2, 3))):
+            numbers = [] if text is None else cls.number_pattern.findall(text)
+            if len(numbers) not in lengths:
+                raise ValueError("Error: Incorrect worldfile metadata definition for rotational and pixel size values")
+            values += [ float(numbers[0]), float(numbers[1]) ]
+
+        return cls(*values, srs = epsgcode(srsname))
+
+    def __init__(self, a, d, b, e, c, f, srs = None):
+        self.a = a
+        self.d = d
+        self.b = b
+        self.e = e
+        self.c = c
+        self.f = f
+        self.srs = srs
+
+    # Values in world file order
+    def worldfile(self):
+        return (self.a, self.d, self.b, self.e, self.c, self.f)
+
+    # Values and EPSG code as a list, see GMLCache
+    def tolist(self):
+        return list(self.worldfile()) + [ self.srs ]
+
+    @classmethod
+    def fromlist(cls, values):
+        return cls(*values)
+
+# Pack georeferences into a flat array('d') of seven values per
+# record: world file values and EPSG code. Unknown EPSG codes are NaN.
+#
+# A million records take 56 MB, instead of a million small objects.
+#
+def packgeoreferences(georefs, values = None):
+
+    if values is None:
+        values = array.array('d')
+
+    nan = float('nan')
+    for georef in georefs:
+        values.extend(georef.worldfile())
+        values.append(nan if georef.srs is None else georef.srs)
+
+    return values
+
+# NumPy structured array type of georeferences. Unknown EPSG codes are 0.
+georef_dtype = [ ('a', 'f8'), ('d', 'f8'), ('b', 'f8'), ('e', 'f8'), ('c', 'f8'), ('f', 'f8'), ('srs', 'i4') ]
+
+# Convert packed georeferences (see packgeoreferences) to a NumPy
+# structured array of georef_dtype
+#
+def georeferencearray(values):
+
+    import numpy
+
+    values = numpy.frombuffer(values, dtype = float).reshape(-1, 7)
+
+    records = numpy.zeros(len(values), dtype = georef_dtype)
+    for i, name in enumerate(GeoReference.fields):
+        records[name] = values[:, i]
+    records['srs'] = numpy.nan_to_num(values[:, 6], nan = 0)
+
+    return records
+
+################################################################
+#
+# ESPG INFORMATION RETRIEVAL
+
+# Get EPSG code from a spatial reference system name such as
+# 'urn:ogc:def:crs:EPSG::3067', 'EPSG:3067' or
+# 'http://www.opengis.net/def/crs/EPSG/0/3067'. Returns None for
+# other names.
+#
+def epsgcode(srsname):
+    if srsname is None or 'EPSG' not in srsname.upper():
+        return None
+    match = re.search(r'(\d+)\s*$', srsname)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+# Coordinate reference system definition, extracted from
+# EPSG GML definitions (e.g. http://epsg.io/3067.xml)
+
+class CRSDefinition(object):
+
+    __slots__ = ('code', 'name', 'datum', 'ellipsoid', 'axes', 'semimajor', 'inverseflattening', 'wkt',
+                 'method', 'parameters')
+
+    def __init__(self, code, name = None, datum = None, ellipsoid = None, axes = None,
+                 semimajor = None, inverseflattening = None, wkt = None, method = None, parameters = None):
+        self.code              = code
+        self.name              = name
+        self.datum             = datum
+        self.ellipsoid         = ellipsoid
+        # List of [abbreviation, direction] for each axis
+        self.axes              = axes or []
+        self.semimajor         = semimajor
+        self.inverseflattening = inverseflattening
+        # Well-known text definition (ESRI .prj format), if imported
+        self.wkt               = wkt
+        # EPSG code of the map projection method (e.g. 9807: Transverse
+        # Mercator) and its parameters by EPSG parameter code, in degrees
+        # and metres (see projection_parameters)
+        self.method            = method
+        self.parameters        = parameters or {}
+
+    def todict(self):
+        return dict([ (name, getattr(self, name)) for name in self.__slots__ ])
+
+    @classmethod
+    def fromdict(cls, values):
+        return cls(**values)
+
+    @classmethod
+    def fromgml(cls, code, data):
+
+        index = GMLDataParser(data).index()
+
+        def number(value):
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return None
+
+        # Axes of the coordinate system of this CRS are closest to the root
+        # element. Projected CRS definitions also carry axes of their base CRS.
+        axes = index.select('CoordinateSystemAxis')
+        if len(axes) > 0:
+            depth = min([ len(path) for path, value in axes ])
+            axes = [ [ GMLPathIndex.text(value.get('gml:axisAbbrev')),
+                       str(GMLPathIndex.text(value.get('gml:axisDirection'))).capitalize() ]
+                     for path, value in axes if len(path) == depth and isinstance(value, dict) ]
+        else:
+            axes = [ [ index.find('gml:axisAbbrev', i), str(index.find('gml:axisDirection', i)).capitalize() ]
+                     for i in range(len(index.findall('gml:axisAbbrev'))) ]
+
+        semimajor = number(index.find('gml:semiMajorAxis'))
+        inverseflattening = number(index.find('gml:inverseFlattening'))
+        semiminor = number(index.find('gml:semiMinorAxis'))
+
+        if inverseflattening is None and semimajor is not None and semiminor is not None and semimajor != semiminor:
+            inverseflattening = semimajor / (semimajor - semiminor)
+
+        name = index.find('gml:srsName')
+        if name is None:
+            names = index.findall('gml:name')
+            if len(names) > 0:
+                name = GMLPathIndex.text(min(names, key = lambda entry: len(entry[0]))[1])
+
+        # Projection parameters of a projected CRS. Parameters in units
+        # other than those of projection_units are left out.
+        def child(value, name):
+            for key, item in value.items():
+                if GMLPathIndex.localname(key) == name:
+                    return item
+            return None
+
+        parameters = {}
+        for path, value in index.select('Conversion/parameterValue/ParameterValue'):
+            parameter = child(value, 'operationParameter')
+            number = child(value, 'value')
+            if not isinstance(parameter, dict) or not isinstance(number, dict):
+                continue
+            unit = epsgcode(number.get('@uom'))
+            parameter = epsgcode(child(parameter, '@href'))
+            if parameter is not None and unit in projection_units:
+                try:
+                    parameters[str(parameter)] = projection_units[unit](float(number.get('#text')))
+                except (TypeError, ValueError):
+                    pass
+
+        return cls(
+            code,
+            name              = name,
+            datum             = index.selectone('GeodeticDatum/name', 0, index.find('gml:datumName')),
+            ellipsoid         = index.selectone('Ellipsoid/name', 0, index.find('gml:ellipsoidName')),
+            axes              = axes,
+            semimajor         = semimajor,
+            inverseflattening = inverseflattening,
+            method            = epsgcode(index.selectone('Conversion/method/@href')),
+            parameters        = parameters
+        )
+
+# Local registry of EPSG coordinate reference systems (SQLite).
+#
+# Definitions are bulk imported from a directory of EPSG GML files
+# named <code>.xml, and stored as compact JSON records indexed by code.
+# Well-known text definitions named <code>.prj or <code>.wkt in the
+# same directory are added to them, see sidecars.
+# get_crs(code) keeps recently used definitions in memory.
+#
+# If fetchurl is given (e.g. 'http://epsg.io/'), definitions missing
+# from the registry are downloaded from <fetchurl><code>.xml and added
+# to it. Nothing is written to the working directory.
+
+class CRSRegistry(object):
+
+    def __init__(self, path = ':memory:', fetchurl = None, cachesize = 256):
+
+        import sqlite3
+        import functools
+
+        self.fetchurl = fetchurl
+        self.db = sqlite3.connect(path, check_same_thread = False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS crs (code INTEGER PRIMARY KEY, definition TEXT)')
+
+        self.get_crs = functools.lru_cache(maxsize = cachesize)(self.lookup)
+
+    def add(self, code, data):
+        definition = CRSDefinition.fromgml(code, data)
+
+        # Keep well-known text imported before
+        row = self.db.execute('SELECT definition FROM crs WHERE code = ?', (code,)).fetchone()
+        if row is not None:
+            definition.wkt = json.loads(row[0]).get('wkt')
+
+        self.db.execute('INSERT OR REPLACE INTO crs VALUES (?, ?)', (code, json.dumps(definition.todict())))
+        return definition
+
+    # Add well-known text to the definition of a code
+    def addwkt(self, code, wkt):
+        row = self.db.execute('SELECT definition FROM crs WHERE code = ?', (code,)).fetchone()
+        if row is None:
+            definition = CRSDefinition(code)
+        else:
+            definition = CRSDefinition.fromdict(json.loads(row[0]))
+        definition.wkt = wkt.strip()
+        self.db.execute('INSERT OR REPLACE INTO crs VALUES (?, ?)', (code, json.dumps(definition.todict())))
+        return definition
+
+    # Import all <code>.xml and <code>.prj files of a directory.
+    # Returns number of imported files.
+    def importdir(self, directory):
+
+        count = 0
+
+        for name in sorted(os.listdir(directory)):
+            code, suffix = os.path.splitext(name)
+            suffix = suffix.lower()
+            if suffix not in ('.xml', '.gml', '.prj', '.wkt') or not code.isdigit():
+                continue
+
+            with open(os.path.join(directory, name), 'r', encoding = 'utf-8') as espg_rf:
+                if suffix in ('.xml', '.gml'):
+                    self.add(int(code), espg_rf.read())
+                else:
+                    self.addwkt(int(code), espg_rf.read())
+            count += 1
+
+        self.db.commit()
+        self.get_crs.cache_clear()
+
+        return count
+
+    def fetch(self, code):
+        import urllib.request as URL
+
+        # ESPG XML data URL
+        urlreq = URL.Request(
+            self.fetchurl + str(code) + '.xml',
+            data = None,
+            headers={
+                'User-Agent': 'gmlparser'
+            }
+        )
+
+        with URL.urlopen(urlreq, timeout = 30) as response:
+            return response.read().decode('utf-8')
+
+    # Definition of an EPSG code, or None if not known
+    def lookup(self, code):
+
+        row = self.db.execute('SELECT definition FROM crs WHERE code = ?', (code,)).fetchone()
+        if row is not None:
+            return CRSDefinition.fromdict(json.loads(row[0]))
+
+        if self.fetchurl is None:
+            return None
+
+        try:
+            data = self.fetch(code)
+        except OSError:
+            Warn("Warning: Could not download ESPG metadata")
+            return None
+
+        definition = self.add(code, data)
+        self.db.commit()
+
+        return definition
+
+    # Canonical name of a spatial reference system: 'EPSG:<code>' for
+    # EPSG codes in any form ('urn:ogc:def:crs:EPSG::3067',
+    # 'http://www.opengis.net/def/crs/EPSG/0/3067' or 'EPSG:3067'),
+    # other names as such
+    @staticmethod
+    def canonical(srsname):
+        code = epsgcode(srsname)
+        if code is not None:
+            return 'EPSG:' + str(code)
+        return srsname
+
+    # Definition of a spatial reference system name in any form, or None
+    def resolve(self, srsname):
+        code = epsgcode(srsname)
+        if code is None:
+            return None
+        return self.get_crs(code)
+
+    def codes(self):
+        return [ row[0] for row in self.db.execute('SELECT code FROM crs ORDER BY code') ]
+
+    def close(self):
+        self.db.close()
+
+class ESPGRetrieval():
+
+    def __init__(self, index):
+        self.espg_number = epsgcode(findgmlkey(index, '@srsName', 0))
+        if self.espg_number is None:
+            Warn("Warning: Not a valid ESPG number found")
+
+    # Get ESPG definition from a CRS registry, see CRSRegistry
+    def ESPG_read(self, registry):
+
+        if self.espg_number is None:
+            return None
+
+        definition = registry.get_crs(self.espg_number)
+        if definition is None:
+            return None
+
+        self.gml_datum          = definition.datum
+        self.gml_ellipsoid      = definition.ellipsoid
+        self.gml_coordsys       = definition.name
+
+        axes = definition.axes + [ [ "Unknown", "Unknown" ] ] * 2
+
+        self.gml_axis_1_abbrev  = axes[0][0]
+        self.gml_axis_1_dir     = axes[0][1]
+
+        self.gml_axis_2_abbrev  = axes[1][0]
+        self.gml_axis_2_dir     = axes[1][1]
+
+        self.gml_semimajor_axis = definition.semimajor
+        self.gml_inverse_flat   = definition.inverseflattening
+
+        return definition
+
+################################################################
+#
+# PHYSICAL AREA SIZE CALCULATOR
+
+# Get lower and upper corner coordinates (x_low, y_low, x_high, y_high)
+# Returns None if corners are not found
+#
+def axisCorners(index):
+
+    # Axis-based data
+    try:
+        x_high = float(findgmlkey(index, 'gml:upperCorner', 0).split()[0])
+        x_low  = float(findgmlkey(index, 'gml:lowerCorner', 0).split()[0])
+        y_high = float(findgmlkey(index, 'gml:upperCorner', 0).split()[1])
+        y_low  = float(findgmlkey(index, 'gml:lowerCorner', 0).split()[1])
+
+    except (ValueError, IndexError, AttributeError):
+
+        # Pixel-based data
+        try:
+            x_high = float(findgmlkey(index, 'gml:high', 0).split()[0])
+            x_low  = float(findgmlkey(index, 'gml:low', 0).split()[0])
+            y_high = float(findgmlkey(index, 'gml:high', 0).split()[1])
+            y_low  = float(findgmlkey(index, 'gml:low', 0).split()[1])
+
+        except (ValueError, IndexError, AttributeError):
+            return None
+
+    return (x_low, y_low, x_high, y_high)
+
+# Get map coordinates of lower and upper corners (x_low, y_low, x_high, y_high).
+#
+# Envelope corners are used if found. Otherwise corners are computed
+# from the grid envelope and worldfile values (see GeoReference),
+# covering whole pixels. Returns None if corners can't be determined.
+#
+def mapCorners(index, gml_posinfo):
+
+    try:
+        x_high = float(findgmlkey(index, 'gml:upperCorner', 0).split()[0])
+        x_low  = float(findgmlkey(index, 'gml:lowerCorner', 0).split()[0])
+        y_high = float(findgmlkey(index, 'gml:upperCorner', 0).split()[1])
+        y_low  = float(findgmlkey(index, 'gml:lowerCorner', 0).split()[1])
+
+        return (x_low, y_low, x_high, y_high)
+
+    except (ValueError, IndexError, AttributeError):
+        pass
+
+    try:
+        low  = [ float(v) for v in findgmlkey(index, 'gml:low', 0).split()[0:2] ]
+        high = [ float(v) for v in findgmlkey(index, 'gml:high', 0).split()[0:2] ]
+
+        georef = gml_posinfo()
+        g = [ georef.a, georef.d, georef.b, georef.e ]
+        x_origin = georef.c
+        y_origin = georef.f
+
+    except (ValueError, IndexError, AttributeError):
+        return None
+
+    x = []
+    y = []
+    for i in (-0.5, high[0] - low[0] + 0.5):
+        for j in (-0.5, high[1] - low[1] + 0.5):
+            x.append(x_origin + i * g[0] + j * g[2])
+            y.append(y_origin + i * g[1] + j * g[3])
+
+    return (min(x), min(y), max(x), max(y))
+
+def RadtoGrad(num):
+    rad_to_deg = 180 * num / math.pi
+    deg_to_grad = 10 * rad_to_deg / 9
+    return deg_to_grad
+
+# Values are returned as floats, see formatcalc for output formatting
+#
+def axisCalculator(index):
+
+    corners = axisCorners(index)
+
+    if corners is None:
+        return list([
+        'Unknown',
+        'Unknown',
+        'Unknown',
+        'Unknown',
+        'Unknown'
+        ])
+
+    x_low, y_low, x_high, y_high = corners
+
+###############################
+# X and Y lengths
+# Area size in km^2
+
+    x_length = x_high - x_low 
+    y_length = y_high - y_low
+    xy_area  = (x_length * y_length) / 1000000
+
+###############################
+# Inverse geodetic calculation
+
+    xy_hypotenuse = math.sqrt(x_length ** 2 + y_length ** 2)
+    inverse_geod_angle = RadtoGrad(math.atan2(y_length, x_length))
+
+###############################
+
+    return list([
+        x_length,
+        y_length,
+        xy_area,
+        xy_hypotenuse,
+        inverse_geod_angle
+        ])
+
+# Format axisCalculator values for output
+#
+def formatcalc(value):
+    if type(value) is float:
+        return format(value, '.2f')
+    return value
+
+################################################################
+#
+# CATALOG AREA CALCULATOR
+
+# Vectorized version of axisCalculator for whole tile catalogs (NumPy).
+#
+# Corner arrays have shape (N, 2): one (x, y) row for each tile.
+# Tiles with unknown corners may be given as NaN rows, their values
+# are NaN as well and they are left out of catalog statistics.
+
+def axisArrays(lower, upper):
+
+    import numpy
+
+    lower = numpy.asarray(lower, dtype = float).reshape(-1, 2)
+    upper = numpy.asarray(upper, dtype = float).reshape(-1, 2)
+
+    x_length = upper[:, 0] - lower[:, 0]
+    y_length = upper[:, 1] - lower[:, 1]
+
+    return {
+        'x_length': x_length,
+        'y_length': y_length,
+        'area':     (x_length * y_length) / 1000000,
+        'diagonal': numpy.hypot(x_length, y_length),
+        'azimuth':  numpy.degrees(numpy.arctan2(y_length, x_length)) * 10 / 9
+    }
+
+# Corners of tiles from grid envelopes, origins (map coordinates of
+# the grid point 'low') and offset vectors.
+#
+# low, high and origin have shape (N, 2), offsetvectors (N, 2, 2) with
+# the two offset vectors of each tile as rows. Corners cover whole pixels,
+# i.e. reach half a pixel outside the outermost pixel centers.
+#
+# Returns lower and upper corner arrays of shape (N, 2).
+#
+def gridCorners(low, high, origin, offsetvectors):
+
+    import numpy
+
+    low           = numpy.asarray(low, dtype = float).reshape(-1, 2)
+    high          = numpy.asarray(high, dtype = float).reshape(-1, 2)
+    origin        = numpy.asarray(origin, dtype = float).reshape(-1, 2)
+    offsetvectors = numpy.asarray(offsetvectors, dtype = float).reshape(-1, 2, 2)
+
+    # Grid coordinates of the 4 corners relative to 'low', shape (N, 4, 2)
+    size = high - low + 1
+    steps = numpy.array([ [ 0, 0 ], [ 1, 0 ], [ 0, 1 ], [ 1, 1 ] ], dtype = float)
+    grid = steps[numpy.newaxis, :, :] * size[:, numpy.newaxis, :] - 0.5
+
+    # Map coordinates of the corners, shape (N, 4, 2)
+    corners = origin[:, numpy.newaxis, :] + numpy.einsum('ncg,ngm->ncm', grid, offsetvectors)
+
+    return corners.min(axis = 1), corners.max(axis = 1)
+
+# Catalog statistics: tile count, total area in km^2 and union bounding box
+#
+def axisStatistics(lower, upper):
+
+    import numpy
+
+    lower = numpy.asarray(lower, dtype = float).reshape(-1, 2)
+    upper = numpy.asarray(upper, dtype = float).reshape(-1, 2)
+
+    known = ~(numpy.isnan(lower).any(axis = 1) | numpy.isnan(upper).any(axis = 1))
+    lower = lower[known]
+    upper = upper[known]
+
+    stats = {
+        'count':   int(known.sum()),
+        'unknown': int((~known).sum()),
+        'area':    float(axisArrays(lower, upper)['area'].sum()),
+        'lower':   None,
+        'upper':   None
+    }
+
+    if stats['count'] > 0:
+        stats['lower'] = lower.min(axis = 0).tolist()
+        stats['upper'] = upper.max(axis = 0).tolist()
+
+    return stats
+
+################################################################
+#
+# MAP PROJECTIONS
+
+# Latitudes and longitudes of map coordinates, for many points in
+# one NumPy call.
+#
+# Transverse Mercator (EPSG method 9807) is supported: UTM zones and
+# the Finnish ETRS-TM35FIN and ETRS-GKnFIN systems among others.
+# Projection and ellipsoid parameters come from EPSG definitions of
+# a registry (see CRSRegistry), or from built-in definitions of common
+# EPSG codes (see builtinprojection).
+#
+# No datum transformations are done: ETRS89 and WGS 84 coordinates
+# differ by less than a metre, which does not matter for tile footprints.
+
+# Conversions of projection parameter values to degrees or metres,
+# by EPSG unit code
+#
+def dmsdegrees(value):
+    # Sexagesimal DMS: DDD.MMSSsss
+    sign = -1 if value < 0 else 1
+    value = abs(value)
+    degrees = math.floor(value)
+    minutes = math.floor(round((value - degrees) * 100, 8))
+    seconds = (value - degrees) * 10000 - minutes * 100
+    return sign * (degrees + minutes / 60 + seconds / 3600)
+
+projection_units = {
+    9001: float,                          # metre
+    9101: math.degrees,                   # radian
+    9102: float,                          # degree
+    9105: lambda value: value * 0.9,      # grad
+    9110: dmsdegrees,                     # sexagesimal DMS
+    9122: float,                          # degree (supplier to define representation)
+    9201: float                           # unity
+}
+
+# EPSG codes of geographic coordinate reference systems (latitude and
+# longitude in degrees)
+geographic_codes = (4326, 4258, 4269, 4617, 4167, 4123)
+
+# Ellipsoids: semi-major axis in metres and inverse flattening
+ellipsoid_grs80 = (6378137.0, 298.257222101)
+ellipsoid_wgs84 = (6378137.0, 298.257223563)
+
+# Transverse Mercator projection, after EPSG Guidance Note 7-2 (JHS
+# formulas, series in n to the 4th power). Accurate to a millimetre
+# within 4 degrees of the central meridian, and to a few centimetres
+# within 10 degrees.
+#
+# Angles are given in degrees, distances in metres. 'northingfirst'
+# tells the axis order of the coordinate reference system.
+
+class TransverseMercator(object):
+
+    def __init__(self, semimajor, inverseflattening, latitude0, longitude0, scale,
+                 falseeasting, falsenorthing, northingfirst = False):
+
+        self.longitude0    = longitude0
+        self.scale         = scale
+        self.falseeasting  = falseeasting
+        self.falsenorthing = falsenorthing
+        self.northingfirst = northingfirst
+
+        f = 1 / inverseflattening
+        n = f / (2 - f)
+
+        self.e = math.sqrt(f * (2 - f))
+        self.B = semimajor / (1 + n) * (1 + n ** 2 / 4 + n ** 4 / 64)
+
+        # Series coefficients of the forward and inverse projections
+        self.h = [
+            n / 2 - 2 / 3 * n ** 2 + 5 / 16 * n ** 3 + 41 / 180 * n ** 4,
+            13 / 48 * n ** 2 - 3 / 5 * n ** 3 + 557 / 1440 * n ** 4,
+            61 / 240 * n ** 3 - 103 / 140 * n ** 4,
+            49561 / 161280 * n ** 4
+        ]
+        self.hinverse = [
+            n / 2 - 2 / 3 * n ** 2 + 37 / 96 * n ** 3 - 1 / 360 * n ** 4,
+            1 / 48 * n ** 2 + 1 / 15 * n ** 3 - 437 / 1440 * n ** 4,
+            17 / 480 * n ** 3 - 37 / 840 * n ** 4,
+            4397 / 161280 * n ** 4
+        ]
+
+        # Meridional arc of the latitude of origin
+        xi = self.conformal(math.radians(latitude0))
+        self.M0 = self.B * (xi + sum([ h * math.sin(2 * k * xi) for k, h in enumerate(self.h, 1) ]))
+
+    # Conformal latitude of latitudes in radians
+    def conformal(self, lat):
+        import numpy
+        Q = numpy.arcsinh(numpy.tan(lat)) - self.e * numpy.arctanh(self.e * numpy.sin(lat))
+        return numpy.arctan(numpy.sinh(Q))
+
+    # Map coordinates of latitudes and longitudes in degrees
+    def forward(self, lat, lon):
+
+        import numpy
+
+        beta = self.conformal(numpy.radians(numpy.asarray(lat, dtype = float)))
+        dlon = numpy.radians(numpy.asarray(lon, dtype = float) - self.longitude0)
+
+        eta0 = numpy.arctanh(numpy.cos(beta) * numpy.sin(dlon))
+        xi0 = numpy.arcsin(numpy.sin(beta) * numpy.cosh(eta0))
+
+        xi, eta = xi0.copy(), eta0.copy()
+        for k, h in enumerate(self.h, 1):
+            xi += h * numpy.sin(2 * k * xi0) * numpy.cosh(2 * k * eta0)
+            eta += h * numpy.cos(2 * k * xi0) * numpy.sinh(2 * k * eta0)
+
+        easting = self.falseeasting + self.scale * self.B * eta
+        northing = self.falsenorthing + self.scale * (self.B * xi - self.M0)
+
+        return easting, northing
+
+    # Latitudes and longitudes in degrees of map coordinates
+    def inverse(self, easting, northing):
+
+        import numpy
+
+        eta = (numpy.asarray(easting, dtype = float) - self.falseeasting) / (self.B * self.scale)
+        xi = ((numpy.asarray(northing, dtype = float) - self.falsenorthing) + self.scale * self.M0) / (self.B * self.scale)
+
+        xi0, eta0 = xi.copy(), eta.copy()
+        for k, h in enumerate(self.hinverse, 1):
+            xi0 -= h * numpy.sin(2 * k * xi) * numpy.cosh(2 * k * eta)
+            eta0 -= h * numpy.cos(2 * k * xi) * numpy.sinh(2 * k * eta)
+
+        beta = numpy.arcsin(numpy.sin(xi0) / numpy.cosh(eta0))
+
+        # Isometric latitude, by fixed-point iteration
+        Q = numpy.arcsinh(numpy.tan(beta))
+        Qe = Q.copy()
+        for i in range(20):
+            previous = Qe
+            Qe = Q + self.e * numpy.arctanh(self.e * numpy.tanh(Qe))
+            if numpy.nanmax(numpy.abs(Qe - previous), initial = 0) < 1e-14:
+                break
+
+        lat = numpy.degrees(numpy.arctan(numpy.sinh(Qe)))
+        lon = self.longitude0 + numpy.degrees(numpy.arcsin(numpy.tanh(eta0) / numpy.cos(beta)))
+
+        return lat, lon
+
+    # Projection of an EPSG definition (see CRSDefinition), or None if
+    # it is not a Transverse Mercator projection
+    @classmethod
+    def fromdefinition(cls, definition):
+
+        parameters = definition.parameters
+        needed = ('8801', '8802', '8805', '8806', '8807')
+
+        if definition.method != 9807 or any([ code not in parameters for code in needed ]):
+            return None
+        if definition.semimajor is None or definition.inverseflattening is None:
+            return None
+
+        northingfirst = len(definition.axes) > 0 and definition.axes[0][1] == 'North'
+
+        return cls(definition.semimajor, definition.inverseflattening,
+                   *[ parameters[code] for code in needed ], northingfirst = northingfirst)
+
+# Transverse Mercator projections of common EPSG codes, or None
+#
+def builtinprojection(code):
+
+    # WGS 84 / UTM zones, north and south
+    if 32601 <= code <= 32660:
+        return TransverseMercator(*ellipsoid_wgs84, 0, (code - 32600) * 6 - 183, 0.9996, 500000, 0)
+    if 32701 <= code <= 32760:
+        return TransverseMercator(*ellipsoid_wgs84, 0, (code - 32700) * 6 - 183, 0.9996, 500000, 10000000)
+
+    # ETRS89 / UTM zones 28N - 38N
+    if 25828 <= code <= 25838:
+        return TransverseMercator(*ellipsoid_grs80, 0, (code - 25800) * 6 - 183, 0.9996, 500000, 0)
+
+    # ETRS89 / TM34, TM35 and TM36 (Finland)
+    if 3046 <= code <= 3048:
+        return TransverseMercator(*ellipsoid_grs80, 0, (code - 3046) * 6 + 21, 0.9996, 500000, 0)
+
+    # ETRS89 / ETRS-TM35FIN, easting and northing (3067) or northing
+    # and easting (5048)
+    if code == 3067:
+        return TransverseMercator(*ellipsoid_grs80, 0, 27, 0.9996, 500000, 0)
+    if code == 5048:
+        return TransverseMercator(*ellipsoid_grs80, 0, 27, 0.9996, 500000, 0, northingfirst = True)
+
+    # ETRS89 / ETRS-GK19FIN - ETRS-GK31FIN, northing and easting
+    if 3873 <= code <= 3885:
+        meridian = code - 3854
+        return TransverseMercator(*ellipsoid_grs80, 0, meridian, 1.0, meridian * 1000000 + 500000, 0,
+                                  northingfirst = True)
+
+    return None
+
+# Projection of an EPSG code: from the registry if it has a Transverse
+# Mercator definition of the code, otherwise built-in. None if unknown.
+#
+def mapprojection(code, registry = None):
+
+    if registry is not None:
+        definition = registry.get_crs(code)
+        if definition is not None and definition.method is not None:
+            return TransverseMercator.fromdefinition(definition)
+
+    return builtinprojection(code)
+
+# Names in the short form 'EPSG:3067' give easting (or longitude)
+# first, as in most GIS software. Other forms follow the EPSG axis order.
+#
+def eastingfirst(srsname):
+    return srsname.strip().upper().startswith('EPSG:')
+
+# Latitudes and longitudes in degrees of points in map coordinates.
+#
+# 'points' has shape (N, 2), and 'srsnames' a spatial reference system
+# name for each point. Points of each reference system are transformed
+# in one call. Points of unknown reference systems give NaN.
+#
+def geographicpoints(srsnames, points, registry = None):
+
+    import numpy
+
+    points = numpy.asarray(points, dtype = float).reshape(-1, 2)
+    lat = numpy.full(len(points), numpy.nan)
+    lon = numpy.full(len(points), numpy.nan)
+
+    groups = {}
+    for i, srsname in enumerate(srsnames):
+        groups.setdefault(srsname, []).append(i)
+
+    for srsname, rows in groups.items():
+
+        code = epsgcode(srsname)
+        if code is None:
+            continue
+
+        rows = numpy.array(rows)
+        first, second = points[rows, 0], points[rows, 1]
+
+        if code in geographic_codes:
+            if eastingfirst(srsname):
+                lon[rows], lat[rows] = first, second
+            else:
+                lat[rows], lon[rows] = first, second
+            continue
+
+        projection = mapprojection(code, registry)
+        if projection is None:
+            continue
+
+        if projection.northingfirst and not eastingfirst(srsname):
+            first, second = second, first
+        lat[rows], lon[rows] = projection.inverse(first, second)
+
+    return lat, lon
+
+# Footprints of tiles in WGS 84 longitudes and latitudes, from spatial
+# reference system names and lower and upper corner arrays of shape
+# (N, 2) (see mapCorners).
+#
+# Returns an array of shape (N, 4, 2): (longitude, latitude) of the
+# four corners of each tile, NaN for unknown footprints.
+#
+def geographicfootprints(srsnames, lower, upper, registry = None):
+
+    import numpy
+
+    lower = numpy.asarray(lower, dtype = float).reshape(-1, 2)
+    upper = numpy.asarray(upper, dtype = float).reshape(-1, 2)
+
+    # Corners of each tile, one after another
+    corners = numpy.stack([ lower,
+                            numpy.stack([ upper[:, 0], lower[:, 1] ], axis = 1),
+                            upper,
+                            numpy.stack([ lower[:, 0], upper[:, 1] ], axis = 1) ], axis = 1)
+
+    lat, lon = geographicpoints([ srsname for srsname in srsnames for i in range(4) ],
+                                corners.reshape(-1, 2), registry)
+
+    return numpy.stack([ lon, lat ], axis = 1).reshape(-1, 4, 2)
+
+# Spatial reference system names and lower and upper corners of batch
+# records (see batchrecord). Corners of failed records and of records
+# without extent are NaN.
+#
+def blockcorners(records):
+
+    nan = [ float('nan') ] * 2
+    srsnames, lower, upper = [], [], []
+
+    for record in records:
+        extent = record['extent']
+        known = record['error'] is None and extent is not None and extent['lower'] is not None
+        srsnames.append(record['srs'] if known else None)
+        lower.append(extent['lower'] if known else nan)
+        upper.append(extent['upper'] if known else nan)
+
+    return srsnames, lower, upper
+
+# Add WGS 84 footprints of tiles to batch records (see batchrecord)
+# as 'wgs84': corners as [longitude, latitude] pairs, and the lower and
+# upper corners of their bounding box. In blocks of 'blocksize' records.
+#
+def wgs84records(records, registry = None, blocksize = 1024):
+
+    import numpy
+
+    for block in chunked(records, blocksize):
+
+        footprints = geographicfootprints(*blockcorners(block), registry = registry)
+
+        for record, footprint in zip(block, footprints):
+            if numpy.isnan(footprint).any():
+                record['wgs84'] = None
+            else:
+                record['wgs84'] = {
+                    'footprint': footprint.tolist(),
+                    'lower':     footprint.min(axis = 0).tolist(),
+                    'upper':     footprint.max(axis = 0).tolist()
+                }
+            yield record
+
+################################################################
+#
+# GAZETTEER
+
+# Offline place names of tile centres (NumPy).
+#
+# Places are read from a GeoNames TSV file (geonameid, name, asciiname,
+# alternatenames, latitude, longitude, feature class, feature code,
+# country code, ..., population) or a TSV file of name, latitude and
+# longitude, and saved as an index file (uncompressed .npz, no pickles).
+# Arrays of the index file are memory mapped, so loading takes a few
+# milliseconds whatever the size, and only pages of searched cells are
+# read from disk.
+#
+# Places are kept as unit vectors, sorted by the cells of a uniform 3D
+# grid. Nearest places of many points are found at once: cells around
+# the points are searched in growing rings until the nearest place found
+# is closer than any place in the cells not searched yet.
+
+# Mean earth radius in kilometers
+earth_radius = 6371.0088
+
+# Unit vectors of points given in degrees, shape (N, 3)
+#
+def unitvectors(lat, lon):
+
+    import numpy
+
+    lat = numpy.radians(numpy.asarray(lat, dtype = float))
+    lon = numpy.radians(numpy.asarray(lon, dtype = float))
+
+    return numpy.stack([ numpy.cos(lat) * numpy.cos(lon),
+                         numpy.cos(lat) * numpy.sin(lon),
+                         numpy.sin(lat) ], axis = 1)
+
+# Chord length of a great circle distance in kilometers, and back
+#
+def distancechord(distance):
+    return 2 * math.sin(min(math.pi, distance / earth_radius) / 2)
+
+def chorddistance(chord):
+    import numpy
+    return 2 * earth_radius * numpy.arcsin(numpy.minimum(chord / 2, 1))
+
+# Cell offsets at Chebyshev distance 'ring' from a cell, shape (N, 3)
+#
+def ringoffsets(ring):
+
+    import numpy
+
+    steps = numpy.arange(-ring, ring + 1)
+    offsets = numpy.stack(numpy.meshgrid(steps, steps, steps, indexing = 'ij'), axis = -1).reshape(-1, 3)
+
+    return offsets[numpy.abs(offsets).max(axis = 1) == ring]
+
+class Gazetteer(object):
+
+    # Index file arrays
+    fields = ('vectors', 'cells', 'names', 'offsets', 'countries', 'population')
+
+    # vectors:    unit vectors of places (float32), sorted by cells
+    # cells:      grid cell of each place
+    # cellsize:   edge length of grid cells, in unit vector units
+    # names:      UTF-8 place names, one after another
+    # offsets:    start of each name in 'names', and the end of the last one
+    # countries:  ISO 3166 country codes (b'' if unknown)
+    # population: population (0 if unknown)
+    #
+    def __init__(self, vectors, cells, cellsize, names, offsets, countries, population):
+        self.vectors    = vectors
+        self.cells      = cells
+        self.cellsize   = float(cellsize)
+        self.names      = names
+        self.offsets    = offsets
+        self.countries  = countries
+        self.population = population
+
+        self.gridsize = int(math.ceil(2 / self.cellsize)) + 1
+
+    # Grid cells of unit vectors, as (i, j, k) rows
+    def cellcoordinates(self, vectors):
+        import numpy
+        cells = numpy.floor((vectors + 1) / self.cellsize).astype(numpy.int64)
+        return numpy.clip(cells, 0, self.gridsize - 1)
+
+    def cellid(self, cells):
+        return (cells[..., 0] * self.gridsize + cells[..., 1]) * self.gridsize + cells[..., 2]
+
+    # Build an index of places: names and latitudes, longitudes in degrees.
+    # Cell size is given in kilometers.
+    @classmethod
+    def fromplaces(cls, names, lat, lon, countries = None, population = None, cellsize = 10.0):
+
+        import numpy
+
+        encoded = [ name.encode('utf-8') for name in names ]
+
+        if countries is None:
+            countries = [ '' ] * len(encoded)
+        if population is None:
+            population = [ 0 ] * len(encoded)
+
+        vectors = unitvectors(lat, lon).astype(numpy.float32)
+        gazetteer = cls(vectors, None, distancechord(cellsize), None, None, None, None)
+
+        cells = gazetteer.cellid(gazetteer.cellcoordinates(vectors.astype(float)))
+        order = numpy.argsort(cells, kind = 'stable')
+
+        lengths = numpy.array([ len(name) for name in encoded ], dtype = numpy.int64)
+        offsets = numpy.zeros(len(encoded) + 1, dtype = numpy.int64)
+        numpy.cumsum(lengths[order], out = offsets[1:])
+
+        return cls(vectors[order], cells[order], gazetteer.cellsize,
+                   numpy.frombuffer(b''.join([ encoded[i] for i in order ]), dtype = numpy.uint8), offsets,
+                   numpy.array(countries, dtype = 'S2')[order], numpy.array(population, dtype = numpy.int64)[order])
+
+    # Read places from a TSV file. Of GeoNames files, only places of
+    # the given feature classes (e.g. P: populated places) and with at
+    # least 'minpopulation' inhabitants are read.
+    @classmethod
+    def fromtsv(cls, path, featureclasses = ('P',), minpopulation = 0, cellsize = 10.0):
+
+        names, lat, lon, countries, population = [], array.array('d'), array.array('d'), [], []
+
+        with open(path, 'r', encoding = 'utf-8') as i:
+            for line in i:
+                columns = line.rstrip('\n').split('\t')
+
+                try:
+                    if len(columns) >= 15:
+                        if columns[6] not in featureclasses or int(columns[14] or 0) < minpopulation:
+                            continue
+                        place = (columns[1], float(columns[4]), float(columns[5]), columns[8][0:2], int(columns[14] or 0))
+                    elif len(columns) >= 3:
+                        place = (columns[0], float(columns[1]), float(columns[2]), '', 0)
+                    else:
+                        continue
+                except ValueError:
+                    # Header line
+                    continue
+
+                names.append(place[0])
+                lat.append(place[1])
+                lon.append(place[2])
+                countries.append(place[3])
+                population.append(place[4])
+
+        if len(names) == 0:
+            raise ValueError("Error: No places found in " + path)
+
+        return cls.fromplaces(names, lat, lon, countries, population, cellsize)
+
+    # Arrays of an index file, memory mapped. numpy.savez stores each
+    # array as a .npy file in an uncompressed ZIP archive, so the data of
+    # an array starts at a fixed file offset. Compressed arrays are read.
+    @staticmethod
+    def maparrays(path):
+
+        import numpy
+        import zipfile
+
+        arrays = {}
+
+        with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+            for info in archive.infolist():
+                name = info.filename[:-len('.npy')]
+
+                if info.compress_type != zipfile.ZIP_STORED:
+                    with archive.open(info) as member:
+                        arrays[name] = numpy.lib.format.read_array(member, allow_pickle = False)
+                    continue
+
+                # Local file header: 30 bytes, file name and extra field
+                f.seek(info.header_offset)
+                header = f.read(30)
+                namelength, extralength = struct.unpack('<HH', header[26:30])
+                f.seek(info.header_offset + 30 + namelength + extralength)
+
+                version = numpy.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, fortran, dtype = numpy.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, fortran, dtype = numpy.lib.format.read_array_header_2_0(f)
+
+                if dtype.hasobject:
+                    raise ValueError("Error: Invalid gazetteer index file: " + path)
+
+                if len(shape) == 0 or 0 in shape:
+                    data = f.read(dtype.itemsize * int(numpy.prod(shape)))
+                    arrays[name] = numpy.frombuffer(data, dtype = dtype).reshape(shape)
+                else:
+                    arrays[name] = numpy.memmap(path, dtype = dtype, mode = 'r', offset = f.tell(),
+                                                shape = shape, order = 'F' if fortran else 'C')
+
+        return arrays
+
+    @classmethod
+    def load(cls, path):
+
+        arrays = cls.maparrays(path)
+
+        values = dict([ (name, arrays[name]) for name in cls.fields ])
+        values['cellsize'] = float(arrays['cellsize'])
+
+        return cls(**values)
+
+    def save(self, path):
+
+        import numpy
+
+        values = dict([ (name, getattr(self, name)) for name in self.fields ])
+
+        # numpy.savez adds suffix .npz to other names
+        with open(path, 'wb') as o:
+            numpy.savez(o, cellsize = self.cellsize, **values)
+
+    def name(self, i):
+        return bytes(self.names[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    # Place i as a dictionary, with distance in kilometers
+    def place(self, i, distance):
+        return {
+            'name':       self.name(i),
+            'country':    self.countries[i].decode('ascii') or None,
+            'population': int(self.population[i]),
+            'distance':   round(float(distance), 3)
+        }
+
+    # Nearest places of points given in degrees, within 'maxdistance'
+    # kilometers. Returns place indexes (-1 if none found) and distances
+    # in kilometers (NaN if none found).
+    def nearest(self, lat, lon, maxdistance = 100.0, blocksize = 4096):
+
+        import numpy
+
+        points = unitvectors(lat, lon).reshape(-1, 3)
+        chords = numpy.full(len(points), numpy.inf)
+        found = numpy.full(len(points), -1, dtype = numpy.int64)
+
+        maxchord = 2.0 if maxdistance is None else distancechord(maxdistance)
+        rings = int(math.ceil(maxchord / self.cellsize))
+        valid = numpy.isfinite(points).all(axis = 1)
+
+        for start in range(0, len(points), blocksize):
+
+            active = numpy.nonzero(valid[start:start + blocksize])[0] + start
+            cells = self.cellcoordinates(points[active])
+
+            for ring in range(rings + 1):
+
+                if len(active) == 0:
+                    break
+
+                # Cells of the ring around each active point
+                neighbours = cells[:, numpy.newaxis, :] + ringoffsets(ring)[numpy.newaxis, :, :]
+                q, c = numpy.nonzero(((neighbours >= 0) & (neighbours < self.gridsize)).all(axis = 2))
+                ids = self.cellid(neighbours[q, c])
+
+                first = numpy.searchsorted(self.cells, ids, 'left')
+                counts = numpy.searchsorted(self.cells, ids, 'right') - first
+                q, first, counts = q[counts > 0], first[counts > 0], counts[counts > 0]
+
+                if len(q) > 0:
+
+                    # All places in the cells, paired with their points
+                    queries = numpy.repeat(active[q], counts)
+                    places = numpy.repeat(first - numpy.cumsum(counts) + counts, counts) + numpy.arange(counts.sum())
+                    distances = numpy.sqrt(((points[queries] - self.vectors[places]) ** 2).sum(axis = 1))
+
+                    # Nearest place of each point
+                    order = numpy.lexsort((distances, queries))
+                    queries, nearest = numpy.unique(queries[order], return_index = True)
+                    nearest = order[nearest]
+
+                    closer = distances[nearest] < chords[queries]
+                    chords[queries[closer]] = distances[nearest][closer]
+                    found[queries[closer]] = places[nearest][closer]
+
+                # Places in cells outside the ring are further than 'ring' cells away
+                cells = cells[chords[active] > ring * self.cellsize]
+                active = active[chords[active] > ring * self.cellsize]
+
+        outside = chords > maxchord
+        found[outside] = -1
+
+        distances = chorddistance(numpy.where(outside, numpy.nan, chords))
+
+        return found, distances
+
+# Centres of tiles in degrees, from spatial reference system names and
+# lower and upper corner arrays of shape (N, 2) (see mapCorners).
+# Returns latitude and longitude arrays, NaN for unknown centres.
+#
+def tilecentres(srsnames, lower, upper, registry = None):
+
+    import numpy
+
+    lower = numpy.asarray(lower, dtype = float).reshape(-1, 2)
+    upper = numpy.asarray(upper, dtype = float).reshape(-1, 2)
+
+    return geographicpoints(srsnames, (lower + upper) / 2, registry)
+
+# Add nearest places of tiles to batch records (see batchrecord) as
+# 'place', in blocks of 'blocksize' records
+#
+def placerecords(records, gazetteer, maxdistance = 100.0, registry = None, blocksize = 1024):
+
+    for block in chunked(records, blocksize):
+
+        found, distances = gazetteer.nearest(*tilecentres(*blockcorners(block), registry = registry),
+                                             maxdistance = maxdistance)
+
+        for record, i, distance in zip(block, found, distances):
+            record['place'] = None if i < 0 else gazetteer.place(i, distance)
+            yield record
+
+################################################################
+#
+# TFW FORMAT PARSE
+
+def tfwparse(gml_posinfo):
+
+    worldfile_values = gml_posinfo.worldfile()
+
+    worldfile_out = ''
+    for value in worldfile_values:
+        worldfile_out += format(value) + '\n'
+
+    # Return gml_out, remove last empty line
+    return worldfile_out[:-1]
+
+################################################################
+#
+# INFORMATION PARSE
+
+# Extract all important metadata elements
+
+def infoparse(inputfile, index, gml_posinfo, gml_calc, place = None, withplace = False):
+
+    def getkeys():
+
+        # TODO these might or might not be defined in JSON data!
+        infolist = [
+          ['Image Name',                 inputfile.split('.')[0]       ],
+          ['Source Name',                findgmlkey(index, '@srsName', 0)          ],
+          ['GML File Name',              findgmlkey(index, 'gml:fileName', 0)      ],
+          ['File Structure',             findgmlkey(index, 'gml:fileStructure', 0) ],
+          ['Rectified Grid Coverage ID', findgmlkey(index, '@dimension', 0)        ],
+         #['Axis Names',            ' '.join(findgmlkey('gml:axisName', 0)) ],
+          ['Map Scale',                         ],
+          ['Upper Corner Coordinates',   findgmlkey(index, 'gml:upperCorner', 0)   ],
+          ['Lower Corner Coordinates',   findgmlkey(index, 'gml:lowerCorner', 0)   ],
+          ['X-axis Length in Meters',    formatcalc(gml_calc[0])                     ],
+          ['Y-axis Length in Meters',    formatcalc(gml_calc[1])                     ],
+          ['Area Size in Square Kilometers', formatcalc(gml_calc[2])                 ],
+          ['Distance of Corners Points in Meters', formatcalc(gml_calc[3])                  ],
+          ['Azimuth Angle of Corner Points in Gradians', formatcalc(gml_calc[4]) ],
+          ['Grid Envelope High',         findgmlkey(index, 'gml:high', 0)          ],
+          ['Grid Envelope Low',          findgmlkey(index, 'gml:low', 0)           ],
+          ['X-axis Pixel Size in Map Units', gml_posinfo.a                  ],
+          ['Y-axis pixel size in Map Units', gml_posinfo.e                  ],
+          ['X-axis Rotation',           gml_posinfo.d                       ],
+          ['Y-axis Rotation',           gml_posinfo.b                       ],
+          ['Upper Left Pixel X-coordinate Center in Map Units', gml_posinfo.c   ],
+          ['Upper Left Pixel Y-coordinate Center in Map Units', gml_posinfo.f   ]
+          #['EPSG Projection Code',                     
+          #['Projection Name',
+          #['Projection Area',
+          #['Image Area',
+        ]
+
+        # Nearest place from a gazetteer, see Gazetteer
+        if withplace:
+            infolist.append(['Nearest Place', formatplace(place)])
+
+        # One line for each entry, values separated by spaces
+        info_out = ''
+        for i in range(len(infolist)):
+            for j in range(len(infolist[i])):
+                info_out += str(infolist[i][j]) + ' '
+            info_out += '\n'
+
+        return info_out
+
+    # Return info_out, remove last empty line
+    return getkeys()[:-1]
+
+# Format a place (see Gazetteer.place) for output
+#
+def formatplace(place):
+    if place is None:
+        return 'Unknown'
+    name = place['name']
+    if place['country'] is not None:
+        name += ', ' + place['country']
+    return name + ' (' + format(place['distance'], '.1f') + ' km)'
+
+################################################################
+#
+# GML DOCUMENT
+
+# GML metadata of a single JPEG2000 file.
+#
+# Values are computed on first use only, so that e.g. writing a
+# worldfile does not compute physical area sizes.
+
+class GMLDocument(object):
+
+    def __init__(self, path, metadata):
+        self.path = path
+        self.parser = GMLDataParser(metadata)
+        self.gml_posinfo = None
+        self.gml_calc = None
+        self.gml_corners = None
+
+        # File size and modification time, and hash of GML data, see GMLCache
+        self.identity = None
+        self.hash = None
+
+        self.boxtable = None
+
+    def tree(self):
+        return self.parser.jsontree()
+
+    def index(self):
+        return self.parser.index()
+
+    # Worldfile values, see GeoReference.
+    # If GML data has not been parsed yet, only the needed
+    # elements are extracted from it.
+    def georef(self):
+        if self.gml_posinfo is None:
+            with profilestage('georef'):
+                if self.parser.tree is None:
+                    self.gml_posinfo = GeoReference.fromstream(self.parser.datalist)
+                else:
+                    self.gml_posinfo = GeoReference.fromindex(self.index())
+        return self.gml_posinfo
+
+    # Spatial reference system name, e.g. 'urn:ogc:def:crs:EPSG::3067'
+    def srs(self):
+        return findgmlkey(self.index(), '@srsName', 0)
+
+    # Coordinate reference system definition from a CRS registry, see CRSRegistry
+    def crs(self, registry):
+        return ESPGRetrieval(self.index()).ESPG_read(registry)
+
+    # Physical area sizes, see axisCalculator
+    def extent(self):
+        if self.gml_calc is None:
+            index = self.index()
+            with profilestage('extent'):
+                self.gml_calc = axisCalculator(index)
+        return self.gml_calc
+
+    # Map coordinates of lower and upper corners, see mapCorners
+    def corners(self):
+        if self.gml_corners is None:
+            index = self.index()
+            with profilestage('extent'):
+                self.gml_corners = mapCorners(index, self.georef)
+        return self.gml_corners
+
+    def to_xml(self, formatting = 'pretty'):
+        tree = self.parser.parse()
+        with profilestage('xml'):
+            profilecount('traversals')
+            if formatting == 'pretty':
+                return self.parser.xmlpretty()
+            elif formatting == 'raw':
+                return str(tree)
+        raise ValueError("Error: Undefined formatting")
+
+    # If GML data has not been parsed yet, JSON is converted directly
+    # from it, see GMLJSONConverter
+    def to_json(self, formatting = 'pretty'):
+        if self.parser.tree is None:
+            o = io.StringIO()
+            self.write_json(o, formatting)
+            return o.getvalue()
+
+        with profilestage('json'):
+            profilecount('traversals')
+            if formatting == 'pretty':
+                return self.parser.jsonpretty()
+            elif formatting == 'raw':
+                return self.parser.jsonraw()
+        raise ValueError("Error: Undefined formatting")
+
+    # All metadata boxes of the file, see BoxTable
+    def boxes(self):
+        if self.boxtable is None:
+            self.boxtable = BoxTable.read(self.path)
+        return self.boxtable
+
+    # Box table as JSON (raw) or as a table (pretty)
+    def to_boxes(self, formatting = 'pretty'):
+        rows = self.boxes().rows()
+
+        if formatting == 'raw':
+            return json.dumps(rows)
+        elif formatting != 'pretty':
+            raise ValueError("Error: Undefined formatting")
+
+        # Label column is as wide as the longest label
+        line = '{:>3} {:<4} {:>12} {:>12} {:<' + str(max([ len(row['label'] or '-') for row in rows ] + [ 5 ])) + '} {}'
+
+        lines = [ line.format('Box', 'Type', 'Offset', 'Length', 'Label', 'Contents') ]
+        for row in rows:
+            contents = row['uuid'] or ''
+            if row['gml']:
+                contents = 'GML data'
+            lines.append(line.format(row['box'], row['type'], row['offset'], row['length'],
+                                     row['label'] or '-', contents).rstrip())
+
+        return '\n'.join(lines)
+
+    # Write JSON to a file object 'o' in chunks
+    def write_json(self, o, formatting = 'pretty'):
+        if formatting not in ('pretty', 'raw'):
+            raise ValueError("Error: Undefined formatting")
+
+        if self.parser.tree is None:
+            gmljson(self.parser.datalist, o, formatting == 'pretty')
+        else:
+            o.write(self.to_json(formatting))
+
+    def to_worldfile(self):
+        gml_posinfo = self.georef()
+        with profilestage('tfw'):
+            return tfwparse(gml_posinfo)
+
+    # Nearest place of the tile centre within 'maxdistance' kilometers,
+    # see Gazetteer.place. None if not found. Map projections are taken
+    # from the registry if given, see mapprojection.
+    def place(self, gazetteer, maxdistance = 100.0, registry = None):
+        corners = self.corners()
+        if corners is None:
+            return None
+        found, distances = gazetteer.nearest(*tilecentres([ self.srs() ], corners[0:2], corners[2:4], registry),
+                                             maxdistance = maxdistance)
+        if found[0] < 0:
+            return None
+        return gazetteer.place(found[0], distances[0])
+
+    # With a gazetteer, the nearest place is given too
+    def to_info(self, gazetteer = None, maxdistance = 100.0, registry = None):
+        index, gml_posinfo, gml_calc = self.index(), self.georef(), self.extent()
+        place = None if gazetteer is None else self.place(gazetteer, maxdistance, registry)
+        with profilestage('info'):
+            return infoparse(self.path, index, gml_posinfo, gml_calc, place, gazetteer is not None)
+
+# Read GML metadata of a file: the header and metadata byte ranges
+# only. Returns metadata and file identity (see inputidentity).
+#
+# f = input file of the path, if already opened (see openinput)
+#
+def readmetadata(path, window = None, maxmemory = scan_maxmemory, f = None):
+
+    with profilestage('header'):
+
+        # Open the image file in read-only binary mode
+        if f is None:
+            f = openinput(path)
+
+        try:
+            identity = inputidentity(f)
+
+            if activeprofiler() is not None:
+                f = ProfiledFile(f)
+
+            # JPEG2000 header check
+            jp2check(f)
+
+        except Exception:
+            f.close()
+            raise
+
+    with f:
+
+        # Extract GML metadata
+        metadata = gmldata(f, window = window, maxmemory = maxmemory)
+
+    return metadata, identity
+
+# Read GML metadata of a JPEG2000 file.
+#
+# window and maxmemory are passed to the marker scanner used
+# for files with broken box structure, see jp2scan.
+#
+# HTTP URLs are read with range requests, see HTTPRangeFile.
+#
+# If a cache (see GMLCache) is given, unchanged files are not read
+# at all, and GML data already seen in other files is not parsed again.
+#
+def read_gml(path, window = None, maxmemory = scan_maxmemory, cache = None):
+
+    f = None
+
+    if cache is not None:
+
+        # Size and ETag of a remote file come with the first range
+        # request. Reading the metadata continues from the same file.
+        identity = None
+        if isremote(path):
+            f = openinput(path)
+            try:
+                identity = inputidentity(f)
+            except Exception:
+                f.close()
+                raise
+
+        document = cache.get(path, identity)
+        if document is not None:
+            if f is not None:
+                f.close()
+            return document
+
+    metadata, identity = readmetadata(path, window, maxmemory, f)
+
+    if cache is not None:
+        document = cache.getbyhash(path, metadata, identity)
+        if document is not None:
+            return document
+
+    document = GMLDocument(path, metadata)
+    document.identity = identity
+
+    return document
+
+################################################################
+#
+# METADATA CACHE
+
+# On-disk cache of extracted metadata (SQLite).
+#
+# Files are identified by path, size and modification time, or by URL,
+# size and ETag (or Last-Modified) for remote files. Cached
+# entries are keyed by a hash of the GML data, so that a touched file
+# with unchanged GML data still finds its entry. Each entry stores the
+# GML data and whatever has been computed of it: the parsed tree (as
+# JSON), worldfile values and physical area sizes.
+#
+# If maxsize (bytes) is given, least recently used entries are
+# evicted when the cache grows larger than that.
+
+class GMLCache(object):
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS files (
+            path  TEXT PRIMARY KEY,
+            size  INTEGER,
+            mtime INTEGER,
+            hash  TEXT,
+            etag  TEXT
+        );
+        CREATE INDEX IF NOT EXISTS files_hash ON files (hash);
+        CREATE TABLE IF NOT EXISTS entries (
+            hash   TEXT PRIMARY KEY,
+            gml    TEXT,
+            tree   TEXT,
+            georef TEXT,
+            extent TEXT,
+            size   INTEGER,
+            used   REAL
+        );
+        CREATE TABLE IF NOT EXISTS stats (
+            name  TEXT PRIMARY KEY,
+            value INTEGER
+        );
+    '''
+
+    # Schema version, kept in the user_version of the database. Caches
+    # of other versions are cleared on open.
+    version = 2
+
+    counters = ('hits', 'hashhits', 'misses')
+
+    def __init__(self, path, maxsize = None):
+
+        import sqlite3
+
+        self.maxsize = maxsize
+        self.db = sqlite3.connect(path, timeout = 60)
+        self.db.execute('PRAGMA journal_mode = WAL')
+
+        if self.db.execute('PRAGMA user_version').fetchone()[0] != self.version:
+            self.db.executescript('DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS entries; '
+                                  'DROP TABLE IF EXISTS stats; PRAGMA user_version = ' + str(self.version) + ';')
+        self.db.executescript(self.schema)
+
+        # Counters are kept in memory and added to the stats table on close
+        self.counts = dict([ (name, 0) for name in self.counters ])
+
+    @staticmethod
+    def gmlhash(metadata):
+        import hashlib
+        return hashlib.sha1(metadata.encode('utf-8')).hexdigest()
+
+    def document(self, path, row, identity):
+
+        h, gml, tree, georef, extent = row
+
+        document = GMLDocument(path, gml)
+        document.identity = identity
+        document.hash = h
+
+        if tree is not None:
+            document.parser.tree = json.loads(tree)
+        if georef is not None:
+            document.gml_posinfo = GeoReference.fromlist(json.loads(georef))
+        if extent is not None:
+            extent = json.loads(extent)
+            document.gml_calc = extent['calc']
+            document.gml_corners = extent['corners']
+
+        self.db.execute('UPDATE entries SET used = ? WHERE hash = ?', (time.time(), h))
+
+        return document
+
+    # Size, modification time and ETag columns of a file identity
+    # (see inputidentity). Remote files have an ETag instead of
+    # a modification time.
+    @staticmethod
+    def identitycolumns(identity):
+        if isinstance(identity[1], str):
+            return identity[0], None, identity[1]
+        return identity[0], identity[1], None
+
+    # Record a file of an entry
+    def putfile(self, path, identity, h):
+        self.db.execute('INSERT OR REPLACE INTO files (path, size, mtime, etag, hash) VALUES (?, ?, ?, ?, ?)',
+                        (inputkey(path),) + self.identitycolumns(identity) + (h,))
+
+    # Find cached metadata of an unchanged file. Identity of a local
+    # file is read from the file system if not given.
+    def get(self, path, identity = None):
+
+        if identity is None:
+            st = os.stat(path)
+            identity = (st.st_size, st.st_mtime_ns)
+
+        # Remote files without ETag or size can not be told unchanged
+        if identity[0] is None or identity[1] is None:
+            return None
+
+        row = self.db.execute(
+            'SELECT e.hash, e.gml, e.tree, e.georef, e.extent FROM files f JOIN entries e ON f.hash = e.hash '
+            'WHERE f.path = ? AND f.size = ? AND f.mtime IS ? AND f.etag IS ?',
+            (inputkey(path),) + self.identitycolumns(identity)).fetchone()
+
+        if row is None:
+            return None
+
+        self.counts['hits'] += 1
+        return self.document(path, row, identity)
+
+    # Find cached metadata by GML data read from a changed or new file
+    def getbyhash(self, path, metadata, identity):
+
+        h = self.gmlhash(metadata)
+        row = self.db.execute(
+            'SELECT hash, gml, tree, georef, extent FROM entries WHERE hash = ?', (h,)).fetchone()
+
+        if row is None:
+            self.counts['misses'] += 1
+            return None
+
+        self.counts['hashhits'] += 1
+        self.putfile(path, identity, h)
+
+        return self.document(path, row, identity)
+
+    # Store metadata computed so far. Previously stored values
+    # are kept if the document has not computed them.
+    def put(self, document):
+
+        if document.identity is None:
+            return
+
+        if document.hash is None:
+            document.hash = self.gmlhash(document.parser.datalist)
+
+        values = [ document.parser.datalist, None, None, None ]
+
+        if document.parser.tree is not None:
+            values[1] = json.dumps(document.parser.tree, separators=(',', ':'))
+        if document.gml_posinfo is not None:
+            values[2] = json.dumps(document.gml_posinfo.tolist())
+        if document.gml_calc is not None:
+            values[3] = json.dumps({ 'calc': document.gml_calc, 'corners': document.corners() })
+
+        size = sum([ len(v) for v in values if v is not None ])
+
+        self.db.execute(
+            'INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (hash) DO UPDATE SET '
+            'tree = COALESCE(excluded.tree, tree), georef = COALESCE(excluded.georef, georef), '
+            'extent = COALESCE(excluded.extent, extent), size = MAX(excluded.size, size), used = excluded.used',
+            [ document.hash ] + values + [ size, time.time() ])
+
+        self.putfile(document.path, document.identity, document.hash)
+
+        self.db.commit()
+
+        if self.maxsize is not None:
+            self.evict(self.maxsize)
+
+    # Remove least recently used entries until cache size is at most 'maxsize' bytes
+    def evict(self, maxsize):
+
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= maxsize:
+            return
+
+        for h, size in self.db.execute('SELECT hash, size FROM entries ORDER BY used').fetchall():
+            self.db.execute('DELETE FROM entries WHERE hash = ?', (h,))
+            total -= size
+            if total <= maxsize:
+                break
+
+        self.db.execute('DELETE FROM files WHERE hash NOT IN (SELECT hash FROM entries)')
+        self.db.commit()
+
+    # Forget files. Entries no longer used by any file are removed.
+    # With no paths given, the whole cache is cleared.
+    def invalidate(self, paths = None):
+
+        if paths is None:
+            self.db.execute('DELETE FROM files')
+        else:
+            for path in paths:
+                path = inputkey(path)
+                self.db.execute('DELETE FROM files WHERE path = ? OR path LIKE ?',
+                                (path, path.rstrip(os.sep) + os.sep + '%'))
+
+        self.db.execute('DELETE FROM entries WHERE hash NOT IN (SELECT hash FROM files)')
+        self.db.commit()
+
+    def stats(self):
+
+        stats = dict([ (name, 0) for name in self.counters ])
+        stats.update(self.db.execute('SELECT name, value FROM stats').fetchall())
+
+        for name in self.counters:
+            stats[name] += self.counts[name]
+
+        stats['files'] = self.db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+        stats['entries'], stats['size'] = self.db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+
+        return stats
+
+    def close(self):
+
+        for name in self.counters:
+            self.db.execute('INSERT OR IGNORE INTO stats VALUES (?, 0)', (name,))
+            self.db.execute('UPDATE stats SET value = value + ? WHERE name = ?', (self.counts[name], name))
+            self.counts[name] = 0
+
+        self.db.commit()
+        self.db.close()
+
+################################################################
+#
+# BATCH PROCESSING
+
+# Extract metadata of many files in parallel.
+#
+# Input paths may be files, directories (searched recursively for
+# JPEG2000 files) or glob patterns. Each file gives one record:
+#
+#   {"path": ..., "srs": ..., "extent": {...}, "georeference": [...], "error": null}
+#
+# A failing file gives a record with the error message, and the
+# rest of the run continues.
+
+jp2_suffixes = ('.jp2', '.jpx', '.jpf')
+
+# Names of axisCalculator values in batch records
+extent_fields = ('x_length', 'y_length', 'area', 'diagonal', 'azimuth')
+
+# Batch record extent: lower and upper corners and axisCalculator values
+#
+def batchextent(document):
+
+    extent = dict(zip(extent_fields, document.extent()))
+    corners = document.corners()
+
+    extent['lower'] = None if corners is None else list(corners[0:2])
+    extent['upper'] = None if corners is None else list(corners[2:4])
+
+    return extent
+
+# Iterate over JPEG2000 files in input paths
+#
+def batchpaths(paths):
+
+    import glob
+
+    for path in paths:
+
+        if isremote(path):
+            yield path
+
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(jp2_suffixes):
+                        yield os.path.join(root, name)
+
+        elif glob.has_magic(path):
+            for match in sorted(glob.iglob(path, recursive = True)):
+                if os.path.isfile(match):
+                    yield match
+
+        else:
+            yield path
+
+def newrecord(path):
+
+    return {
+        'path':         path,
+        'srs':          None,
+        'extent':       None,
+        'georeference': None,
+        'error':        None
+    }
+
+def documentrecord(document, record):
+
+    # The tree is needed for srs and extent anyway, so worldfile values
+    # are taken from it instead of another pass over GML data
+    document.index()
+    gml_posinfo = document.georef()
+
+    record['srs'] = document.srs()
+    record['extent'] = batchextent(document)
+    record['georeference'] = list(gml_posinfo.worldfile())
+
+    return record
+
+# Profiler of one file, if profiling is requested
+#
+def recordprofiler(profile, allocations):
+    if not profile:
+        return None
+    return Profiler(allocations = allocations)
+
+# With 'profile', the record gets per-stage counters as 'stats'
+# (see Profiler.stats).
+#
+def batchrecord(path, window = None, maxmemory = scan_maxmemory, cache = None,
+                profile = False, allocations = False):
+
+    record = newrecord(path)
+    profiler = recordprofiler(profile, allocations)
+
+    try:
+        with profiling(profiler):
+            document = read_gml(path, window = window, maxmemory = maxmemory, cache = cache)
+            documentrecord(document, record)
+
+        if cache is not None:
+            cache.put(document)
+
+    except Exception as e:
+        record['error'] = str(e)
+
+    if profiler is not None:
+        record['stats'] = profiler.stats()
+
+    return record
+
+# Process a list of paths. Each worker process opens the cache
+# (see GMLCache) for itself.
+#
+def batchchunk(paths, window = None, maxmemory = scan_maxmemory, cachefile = None, cachesize = None,
+               profile = False, allocations = False):
+
+    cache = None
+    if cachefile is not None:
+        cache = GMLCache(cachefile, cachesize)
+
+    try:
+        return [ batchrecord(path, window, maxmemory, cache, profile, allocations) for path in paths ]
+    finally:
+        if cache is not None:
+            cache.close()
+
+# Group paths into lists of 'chunksize' paths
+#
+def chunked(paths, chunksize):
+
+    chunk = []
+    for path in paths:
+        chunk.append(path)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+
+    if len(chunk) > 0:
+        yield chunk
+
+# Iterate over results of function(chunk, *args) for chunks of paths,
+# in completion order. 'function' returns a list of results per chunk.
+#
+# Chunks of paths are processed in a process pool. At most two chunks
+# per worker are queued at a time, so memory use stays bounded
+# however many paths there are.
+#
+def poolmap(function, paths, workers = None, chunksize = 16, *args):
+
+    import concurrent.futures
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    chunks = chunked(paths, chunksize)
+
+    # Run in this process, no need to start workers
+    if workers == 1:
+        for chunk in chunks:
+            for result in function(chunk, *args):
+                yield result
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+
+        pending = set()
+
+        for chunk in chunks:
+            pending.add(executor.submit(function, chunk, *args))
+
+            if len(pending) < workers * 2:
+                continue
+
+            done, pending = concurrent.futures.wait(pending, return_when = concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                for result in future.result():
+                    yield result
+
+        for future in concurrent.futures.as_completed(pending):
+            for result in future.result():
+                yield result
+
+# Iterate over batch records in completion order, see poolmap
+#
+def batch(paths, workers = None, chunksize = 16, window = None, maxmemory = scan_maxmemory,
+          cachefile = None, cachesize = None, profile = False, allocations = False):
+
+    return poolmap(batchchunk, paths, workers, chunksize,
+                   window, maxmemory, cachefile, cachesize, profile, allocations)
+
+################################################################
+#
+# ASYNCHRONOUS BATCH PROCESSING
+
+# Batch processing for high-latency storage (NFS, SMB, HTTP).
+#
+# Per-file latency dominates there, so reads of header and metadata
+# byte ranges (see readmetadata) of many files are kept in flight at
+# once in a thread pool. GML parsing is CPU work and goes to a small
+# process pool. Records are the same as in batch.
+#
+# At most 'inflight' files are in the pipeline at a time, counting
+# records waiting for reordering. New paths are taken from the input
+# only when a record has been given out, so memory use stays flat
+# however many paths there are.
+
+# Record of GML metadata read by readmetadata
+#
+def metadatarecord(path, metadata, profile = False, allocations = False):
+
+    record = newrecord(path)
+    profiler = recordprofiler(profile, allocations)
+
+    try:
+        with profiling(profiler):
+            documentrecord(GMLDocument(path, metadata), record)
+    except Exception as e:
+        record['error'] = str(e)
+
+    if profiler is not None:
+        record['stats'] = profiler.stats()
+
+    return record
+
+# Asynchronous iterator of batch records, in completion order or in
+# input order if 'ordered' is set. With parsers = 0, parsing is done
+# in the reading threads.
+#
+async def asyncbatch(paths, inflight = 64, parsers = 2, ordered = False,
+                     window = None, maxmemory = scan_maxmemory, profile = False, allocations = False):
+
+    import asyncio
+    import concurrent.futures
+
+    if inflight < 1:
+        raise ValueError("Error: number of files in flight must be at least 1")
+
+    loop = asyncio.get_running_loop()
+
+    readers = concurrent.futures.ThreadPoolExecutor(max_workers = inflight)
+    parsepool = None
+    if parsers > 0:
+        parsepool = concurrent.futures.ProcessPoolExecutor(max_workers = parsers)
+
+    # Returns metadata or a record, and read stage counters
+    def readrecord(path):
+        profiler = recordprofiler(profile, allocations)
+        with profiling(profiler):
+            metadata, identity = readmetadata(path, window, maxmemory)
+        stats = None if profiler is None else profiler.stats()
+        if parsepool is None:
+            return metadatarecord(path, metadata, profile, allocations), stats
+        return metadata, stats
+
+    async def process(path):
+        try:
+            result, stats = await loop.run_in_executor(readers, readrecord, path)
+            if parsepool is None:
+                record = result
+            else:
+                record = await loop.run_in_executor(parsepool, metadatarecord, path, result,
+                                                    profile, allocations)
+        except Exception as e:
+            record = newrecord(path)
+            record['error'] = str(e)
+            return record
+
+        # Add read stage counters to parse stage counters
+        if stats is not None:
+            profiler = Profiler()
+            profiler.merge(stats)
+            profiler.merge(record['stats'])
+            record['stats'] = profiler.stats()
+
+        return record
+
+    paths = iter(paths)
+    pending = {}
+    waiting = {}
+    nextindex = 0
+    count = 0
+
+    try:
+        while True:
+
+            # Fill the pipeline
+            while len(pending) + len(waiting) < inflight:
+                path = next(paths, None)
+                if path is None:
+                    break
+                pending[asyncio.ensure_future(process(path))] = count
+                count += 1
+
+            if len(pending) == 0:
+                break
+
+            done, remaining = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                index = pending.pop(task)
+                if not ordered:
+                    yield task.result()
+                else:
+                    waiting[index] = task.result()
+
+            # Records in input order, as far as they are complete
+            while nextindex in waiting:
+                yield waiting.pop(nextindex)
+                nextindex += 1
+
+    finally:
+        # Pending tasks are finished before the pools are shut down, so
+        # no pool is left with work in flight at interpreter exit
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions = True)
+        readers.shutdown(wait = True, cancel_futures = True)
+        if parsepool is not None:
+            parsepool.shutdown(wait = True, cancel_futures = True)
+
+# Iterate over asynchronous batch records in a new event loop
+#
+def runasyncbatch(paths, inflight = 64, parsers = 2, ordered = False,
+                  window = None, maxmemory = scan_maxmemory, profile = False, allocations = False):
+
+    import asyncio
+
+    loop = asyncio.new_event_loop()
+    records = asyncbatch(paths, inflight, parsers, ordered, window, maxmemory, profile, allocations)
+
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(records.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(records.aclose())
+        loop.close()
+
+################################################################
+#
+# TILE CATALOG
+
+# Spatial index of tile footprints (SQLite R*Tree).
+#
+# Footprints are map coordinate corners of tiles (see mapCorners),
+# grouped by spatial reference system. The reference system is stored
+# as a third R*Tree dimension, so queries within one reference system
+# only visit its tiles. R*Tree stores coordinates as 32-bit floats
+# rounded outwards, so candidates are checked against exact corners.
+
+class TileCatalog(object):
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS srs (
+            id   INTEGER PRIMARY KEY,
+            name TEXT UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS tiles (
+            id     INTEGER PRIMARY KEY,
+            path   TEXT UNIQUE,
+            srs    INTEGER,
+            x_low  REAL,
+            y_low  REAL,
+            x_high REAL,
+            y_high REAL
+        );
+        CREATE VIRTUAL TABLE IF NOT EXISTS footprints USING rtree (
+            id, srs_low, srs_high, x_low, x_high, y_low, y_high
+        );
+    '''
+
+    def __init__(self, path):
+
+        import sqlite3
+
+        self.db = sqlite3.connect(path, timeout = 60)
+        self.db.executescript(self.schema)
+        self.srsids = dict(self.db.execute('SELECT name, id FROM srs').fetchall())
+
+    def srsid(self, srsname, create = False):
+
+        # Names of the same EPSG code in different forms get the same id
+        name = CRSRegistry.canonical(srsname)
+
+        if name not in self.srsids and create:
+            cursor = self.db.execute('INSERT INTO srs (name) VALUES (?)', (name,))
+            self.srsids[name] = cursor.lastrowid
+
+        return self.srsids.get(name)
+
+    def add(self, path, srsname, corners):
+
+        path = inputkey(path)
+        srs = self.srsid(srsname, create = True)
+        x_low, y_low, x_high, y_high = corners
+
+        self.remove(path)
+
+        cursor = self.db.execute('INSERT INTO tiles (path, srs, x_low, y_low, x_high, y_high) VALUES (?, ?, ?, ?, ?, ?)',
+                                 (path, srs, x_low, y_low, x_high, y_high))
+        self.db.execute('INSERT INTO footprints VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (cursor.lastrowid, srs, srs, x_low, x_high, y_low, y_high))
+
+    # Add a batch record, see batchrecord. Returns False if the
+    # record has no footprint.
+    def addrecord(self, record):
+
+        if record['error'] is not None or record['extent'] is None or record['extent']['lower'] is None:
+            return False
+
+        self.add(record['path'], record['srs'], record['extent']['lower'] + record['extent']['upper'])
+        return True
+
+    def remove(self, path):
+
+        path = inputkey(path)
+        row = self.db.execute('SELECT id FROM tiles WHERE path = ?', (path,)).fetchone()
+
+        if row is not None:
+            self.db.execute('DELETE FROM footprints WHERE id = ?', row)
+            self.db.execute('DELETE FROM tiles WHERE id = ?', row)
+
+    # Tiles intersecting a bounding box, as (path, srs, corners) tuples.
+    # Without srsname, tiles of all reference systems are searched, the
+    # box being interpreted in each of them.
+    def query(self, x_low, y_low, x_high, y_high, srsname = None):
+
+        sql = ('SELECT t.path, s.name, t.x_low, t.y_low, t.x_high, t.y_high '
+               'FROM footprints f JOIN tiles t ON t.id = f.id JOIN srs s ON s.id = t.srs '
+               'WHERE f.x_high >= ? AND f.x_low <= ? AND f.y_high >= ? AND f.y_low <= ? '
+               'AND t.x_high >= ? AND t.x_low <= ? AND t.y_high >= ? AND t.y_low <= ?')
+        values = [ x_low, x_high, y_low, y_high ] * 2
+
+        if srsname is not None:
+            srs = self.srsid(srsname)
+            if srs is None:
+                return []
+            sql += ' AND f.srs_low >= ? AND f.srs_high <= ?'
+            values += [ srs, srs ]
+
+        return [ (row[0], row[1], row[2:6]) for row in self.db.execute(sql + ' ORDER BY s.name, t.path', values) ]
+
+    # Tiles covering a point
+    def point(self, x, y, srsname = None):
+        return self.query(x, y, x, y, srsname)
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+################################################################
+#
+# WATCH MODE
+
+# Process new and changed JPEG2000 files in directories as they arrive.
+#
+# Changes are detected with inotify (Linux), or by listing directories
+# every few seconds where inotify is not available. A file is processed
+# once its size and modification time have not changed for 'settle'
+# seconds, so that partially written files are not read.
+#
+# Processed files are recorded in a state file (path, size and
+# modification time). On startup, directories are listed and only files
+# not matching the state are processed. Files removed since are removed
+# from the outputs.
+
+# Sidecar worldfile of an image: first and last letters of the file
+# suffix and 'w', e.g. image.jp2 -> image.j2w, or the given suffix
+# (e.g. 'tfw')
+#
+def worldfilepath(path, suffix = None):
+
+    root, imagesuffix = os.path.splitext(path)
+
+    if suffix is not None:
+        return root + '.' + suffix
+
+    suffix = imagesuffix
+    if len(suffix) < 3:
+        return root + '.wld'
+    return root + suffix[0:2] + suffix[-1] + 'w'
+
+# Write a text file atomically: readers see either the old or the new
+# file, never a partially written one
+#
+@contextlib.contextmanager
+def atomicfile(path):
+
+    import tempfile
+
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, temppath = tempfile.mkstemp(prefix = '.' + name + '.', suffix = '.tmp', dir = directory)
+
+    try:
+        with os.fdopen(fd, 'w') as o:
+            yield o
+        os.replace(temppath, path)
+    except BaseException:
+        os.unlink(temppath)
+        raise
+
+def writeatomic(path, text):
+    with atomicfile(path) as o:
+        o.write(text)
+
+# JPEG2000 files in directories, with file identities: { path: (size, mtime) }
+#
+def listtiles(directories):
+
+    tiles = {}
+
+    for path in batchpaths(directories):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        tiles[path] = (st.st_size, st.st_mtime_ns)
+
+    return tiles
+
+def istile(path):
+    return path.lower().endswith(jp2_suffixes)
+
+# Changes in directory trees via inotify(7), used through ctypes.
+# Raises OSError if inotify is not available.
+#
+class InotifyWatcher(object):
+
+    IN_MODIFY      = 0x00000002
+    IN_ATTRIB      = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM  = 0x00000040
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_DELETE      = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF   = 0x00000800
+    IN_Q_OVERFLOW  = 0x00004000
+    IN_IGNORED     = 0x00008000
+    IN_ISDIR       = 0x40000000
+
+    IN_NONBLOCK    = 0o4000
+    IN_CLOEXEC     = 0o2000000
+
+    mask = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+            IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+    # Event header: watch descriptor, mask, cookie and name length
+    header = struct.Struct('=iIII')
+
+    def __init__(self, directories):
+
+        import ctypes
+        import ctypes.util
+
+        self.ctypes = ctypes
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno = True)
+
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        # Watched directories by watch descriptor
+        self.watches = {}
+
+        for directory in directories:
+            self.addtree(directory)
+
+    def addwatch(self, directory):
+
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.mask)
+        if wd < 0:
+            errno = self.ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), directory)
+
+        self.watches[wd] = directory
+
+    # Watch a directory and its subdirectories. Returns JPEG2000 files
+    # already in them, as they may have been written before the watch.
+    def addtree(self, directory):
+
+        found = []
+
+        for root, dirs, files in os.walk(directory):
+            self.addwatch(root)
+            found += [ os.path.join(root, name) for name in files if istile(name) ]
+
+        return found
+
+    # Wait up to 'timeout' seconds for changes. Returns a list of
+    # (event, path) tuples, event being 'changed', 'removed' or
+    # 'rescan' if events were lost.
+    def events(self, timeout):
+
+        import select
+
+        readable = select.select([ self.fd ], [], [], timeout)[0]
+        if len(readable) == 0:
+            return []
+
+        data = b''
+        while True:
+            try:
+                chunk = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            if len(chunk) == 0:
+                break
+            data += chunk
+
+        events = []
+        offset = 0
+
+        while offset + self.header.size <= len(data):
+            wd, mask, cookie, length = self.header.unpack_from(data, offset)
+            offset += self.header.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\x00'))
+            offset += length
+
+            if mask & self.IN_Q_OVERFLOW:
+                events.append(('rescan', None))
+                continue
+
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+
+            # Moved directory is watched again under its new name, if
+            # it is still in a watched tree
+            if mask & self.IN_MOVE_SELF:
+                self.libc.inotify_rm_watch(self.fd, wd)
+                self.watches.pop(wd, None)
+                continue
+
+            directory = self.watches.get(wd)
+            if directory is None or name == '':
+                continue
+
+            path = os.path.join(directory, name)
+
+            if mask & self.IN_ISDIR:
+                # New or moved in directory: watch it and its files
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    try:
+                        events += [ ('changed', p) for p in self.addtree(path) ]
+                    except OSError:
+                        pass
+                # Moved out directory: all of its files are gone
+                elif mask & self.IN_MOVED_FROM:
+                    events.append(('removed', path))
+                continue
+
+            if not istile(name):
+                continue
+
+            if mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                events.append(('removed', path))
+            else:
+                events.append(('changed', path))
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+# Changes in directory trees by comparing directory listings
+#
+class PollingWatcher(object):
+
+    def __init__(self, directories, interval = 2.0):
+        self.directories = directories
+        self.interval = interval
+        self.tiles = listtiles(directories)
+
+    def events(self, timeout):
+
+        time.sleep(min(timeout, self.interval))
+
+        tiles = listtiles(self.directories)
+        events = [ ('changed', path) for path, identity in tiles.items() if self.tiles.get(path) != identity ]
+        events += [ ('removed', path) for path in self.tiles if path not in tiles ]
+
+        self.tiles = tiles
+        return events
+
+    def close(self):
+        pass
+
+# Watch directories for JPEG2000 files until 'stop' returns True.
+#
+# process(paths) is called with lists of new or changed files, and
+# returns paths processed successfully. remove(paths) is called with
+# lists of removed files. Failed files are tried again when they change.
+#
+# statefile = file of processed files for reconciling on startup
+# settle    = seconds a file must stay unchanged before processing
+# polling   = list directories instead of using inotify
+#
+def watch(directories, process, remove, statefile = None, settle = 2.0,
+          polling = False, interval = 2.0, stop = None):
+
+    directories = [ os.path.abspath(directory) for directory in directories ]
+
+    # Processed files: { path: [size, mtime] }
+    state = {}
+    if statefile is not None and os.path.isfile(statefile):
+        with open(statefile, 'r') as i:
+            state = json.load(i)
+
+    def savestate():
+        if statefile is not None:
+            writeatomic(statefile, json.dumps(state))
+
+    watcher = None
+    if not polling:
+        try:
+            watcher = InotifyWatcher(directories)
+        except OSError as e:
+            Warn("Warning: inotify not available, polling for changes: " + str(e))
+    if watcher is None:
+        watcher = PollingWatcher(directories, interval)
+
+    # Files waiting to settle: { path: (time of last change, identity) }
+    pending = {}
+
+    # Compare directory listings against the state
+    def reconcile():
+        tiles = listtiles(directories)
+        now = time.monotonic()
+
+        for path, identity in tiles.items():
+            if state.get(path) != list(identity):
+                pending[path] = (now, None)
+
+        removed = [ path for path in state if path not in tiles ]
+        for path in removed:
+            del state[path]
+        if len(removed) > 0:
+            remove(removed)
+            savestate()
+
+    reconcile()
+
+    try:
+        while stop is None or not stop():
+
+            removed = []
+
+            for event, path in watcher.events(settle / 2):
+                if event == 'rescan':
+                    reconcile()
+
+                elif event == 'changed':
+                    pending[path] = (time.monotonic(), None)
+
+                elif event == 'removed':
+                    prefix = path.rstrip(os.sep) + os.sep
+                    for p in [ p for p in pending if p == path or p.startswith(prefix) ]:
+                        del pending[p]
+                    for p in [ p for p in state if p == path or p.startswith(prefix) ]:
+                        del state[p]
+                        removed.append(p)
+
+            if len(removed) > 0:
+                remove(removed)
+
+            # Files unchanged for 'settle' seconds
+            now = time.monotonic()
+            ready = {}
+
+            for path, (changed, identity) in list(pending.items()):
+                if now - changed < settle:
+                    continue
+
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    del pending[path]
+                    continue
+
+                current = [ st.st_size, st.st_mtime_ns ]
+                if current != identity:
+                    pending[path] = (now, current)
+                    continue
+
+                del pending[path]
+                if state.get(path) != current:
+                    ready[path] = current
+
+            if len(ready) > 0:
+                for path in process(sorted(ready)):
+                    state[path] = ready[path]
+
+            if len(ready) > 0 or len(removed) > 0:
+                savestate()
+
+    finally:
+        watcher.close()
+        savestate()
+
+################################################################
+#
+# SIDECAR FILES
+
+# Write sidecar files next to images:
+#
+#   worldfile:     image.j2w (see worldfilepath and tfwparse)
+#   .prj:          well-known text of the reference system
+#   .aux.xml:      GDAL auxiliary file with reference system and
+#                  geotransform
+#
+# Sidecars newer than their image are up to date and not written
+# again. Sidecars are written atomically (see writeatomic).
+#
+# Well-known text comes from an EPSG registry (see CRSRegistry). If
+# it is not known, no .prj file is written, and .aux.xml files give
+# the reference system as 'EPSG:<code>'.
+
+# Paths of the requested sidecars of an image
+#
+def sidecarpaths(path, suffix = None, prj = False, aux = False):
+
+    paths = [ worldfilepath(path, suffix) ]
+    if prj:
+        paths.append(os.path.splitext(path)[0] + '.prj')
+    if aux:
+        paths.append(path + '.aux.xml')
+
+    return paths
+
+# Sidecars are up to date if all of them are newer than the image
+#
+def sidecarsuptodate(path, sidecars):
+
+    mtime = os.stat(path).st_mtime_ns
+
+    for sidecar in sidecars:
+        try:
+            if os.stat(sidecar).st_mtime_ns <= mtime:
+                return False
+        except OSError:
+            return False
+
+    return True
+
+# GDAL auxiliary file (.aux.xml) contents. Geotransform is given for
+# pixel corners, worldfile values for pixel centers.
+#
+def auxparse(gml_posinfo, srs):
+
+    from xml.sax.saxutils import escape
+
+    a, d, b, e, c, f = gml_posinfo.worldfile()
+    geotransform = (c - a / 2 - b / 2, a, b, f - d / 2 - e / 2, d, e)
+
+    aux_out = '<PAMDataset>\n'
+    if srs is not None:
+        aux_out += '  <SRS>' + escape(srs) + '</SRS>\n'
+    aux_out += '  <GeoTransform>' + ', '.join([ repr(value) for value in geotransform ]) + '</GeoTransform>\n'
+    aux_out += '</PAMDataset>\n'
+
+    return aux_out
+
+# Write sidecars of one image. Returns ('written' | 'skipped' | 'failed', message)
+#
+def writesidecars(path, suffix = None, prj = False, aux = False, force = False,
+                  registry = None, window = None, maxmemory = scan_maxmemory):
+
+    sidecars = sidecarpaths(path, suffix, prj, aux)
+
+    try:
+        if not force and sidecarsuptodate(path, sidecars):
+            return ('skipped', None)
+
+        document = read_gml(path, window = window, maxmemory = maxmemory)
+        gml_posinfo = document.georef()
+
+        # Well-known text is resolved first, so that no sidecar
+        # is written for a file which fails
+        wkt = None
+        if (prj or aux) and registry is not None and gml_posinfo.srs is not None:
+            definition = registry.get_crs(gml_posinfo.srs)
+            wkt = None if definition is None else definition.wkt
+
+        if prj and wkt is None:
+            return ('failed', "Error: No well-known text for spatial reference system")
+
+        writeatomic(sidecars[0], tfwparse(gml_posinfo))
+
+        if prj:
+            writeatomic(sidecars[1], wkt)
+
+        if aux:
+            srs = wkt
+            if srs is None and gml_posinfo.srs is not None:
+                srs = 'EPSG:' + str(gml_posinfo.srs)
+            writeatomic(sidecars[-1], auxparse(gml_posinfo, srs))
+
+    except Exception as e:
+        return ('failed', str(e))
+
+    return ('written', None)
+
+# Write sidecars of a list of images. Each worker process opens the
+# registry for itself. Returns (path, status, message) tuples.
+#
+def sidecarchunk(paths, suffix = None, prj = False, aux = False, force = False,
+                 registryfile = None, window = None, maxmemory = scan_maxmemory):
+
+    registry = None
+    if registryfile is not None:
+        registry = CRSRegistry(registryfile)
+
+    try:
+        return [ (path,) + writesidecars(path, suffix, prj, aux, force, registry, window, maxmemory)
+                 for path in paths ]
+    finally:
+        if registry is not None:
+            registry.close()
+
+################################################################
+#
+# GML BOX UPDATE
+
+# Replace GML data of JPEG2000 files without rewriting the files.
+#
+# Only the XML box carrying GML data is rewritten (see locategmlbox):
+#
+#   inplace:   new GML data fits in the box. The rest of the box is
+#              padded with spaces, which XML allows after the root element.
+#
+#   relocate:  the top-level box holding the XML box is written anew at
+#              the end of the file, with box lengths fixed, and the old
+#              one is turned into a free box. If the last box of the
+#              file extends to the end of the file (length 0), its
+#              length is written explicitly.
+#
+#   extend:    as relocate, but the top-level box is the last box of the
+#              file already, and is rewritten where it is.
+#
+# Relocated XML boxes are padded with 'relocate_slack' spaces, so that
+# small later updates fit in place.
+#
+# The codestream is never read or copied. Checksums (SHA-256) of all
+# regions of the file not written are compared before and after the
+# update, and GML data is read back. On mismatch, the written bytes are
+# restored and the file is truncated back to its original size.
+
+# Box with a new length: LBox, or XLBox for boxes with an extended header
+#
+def boxlengthfield(box, length):
+
+    if box.headerlength == 16:
+        return (box.offset + 8, struct.pack('>Q', length))
+
+    if length >= 2 ** 32:
+        raise ValueError("Error: JPEG2000 box too long for its length field")
+
+    return (box.offset, struct.pack('>I', length))
+
+relocate_slack = 1024
+
+# SHA-256 of file regions, as a list of hex digests
+#
+def regionchecksums(f, regions, chunksize = scan_chunksize):
+
+    import hashlib
+
+    checksums = []
+
+    for start, end in regions:
+        h = hashlib.sha256()
+        f.seek(start)
+        while start < end:
+            data = f.read(min(chunksize, end - start))
+            if len(data) == 0:
+                break
+            h.update(data)
+            start += len(data)
+        checksums.append(h.hexdigest())
+
+    return checksums
+
+# Regions of [0, size) not covered by writes of (offset, data)
+#
+def untouchedregions(writes, size):
+
+    regions = []
+    offset = 0
+
+    for start, data in sorted(writes):
+        if start > offset:
+            regions.append((offset, min(start, size)))
+        offset = max(offset, start + len(data))
+
+    if offset < size:
+        regions.append((offset, size))
+
+    return regions
+
+# Plan writes replacing GML data of an open file with 'gml' (str).
+# Returns (mode, writes), writes being a list of (offset, data).
+#
+def gmlupdateplan(f, gml):
+
+    size = filesize(f)
+
+    gmlbox = locategmlbox(f)
+    if gmlbox is None:
+        raise ValueError("Error: No GML box found, can't update files with broken box structure")
+
+    payload = gml.encode('utf-8')
+    capacity = gmlbox.end - gmlbox.start
+
+    if len(payload) <= capacity:
+        return ('inplace', [ (gmlbox.start, payload + b' ' * (capacity - len(payload))) ])
+
+    # Top-level box holding the XML box, and the boxes in it
+    chain = gmlbox.parents + (gmlbox,)
+    top = chain[0]
+
+    f.seek(top.offset)
+    data = bytearray(f.read(top.length))
+
+    payload += b' ' * relocate_slack
+    delta = len(payload) - capacity
+    data[gmlbox.start - top.offset:gmlbox.end - top.offset] = payload
+
+    for box in chain:
+        offset, field = boxlengthfield(box, box.length + delta)
+        data[offset - top.offset:offset - top.offset + len(field)] = field
+
+    if top.end == size:
+        return ('extend', [ (top.offset, bytes(data)) ])
+
+    # Old box becomes a free box of the same length. Its length field
+    # is kept: only the last box may have length 0 (to the end of the
+    # file), and the last box is extended above.
+    writes = [ (top.offset + 4, b'free') ]
+
+    # The last box may extend to the end of the file
+    last = None
+    for box in readboxes(f, 0, size):
+        last = box
+    if last is not None and last.offset != top.offset:
+        f.seek(last.offset)
+        if struct.unpack('>I', f.read(4))[0] == 0:
+            if last.length >= 2 ** 32:
+                raise ValueError("Error: Can't relocate GML box after a box of unknown length over 4 GB")
+            writes.append((last.offset, struct.pack('>I', last.length)))
+
+    writes.append((size, bytes(data)))
+
+    return ('relocate', writes)
+
+# Replace GML data of a file with transform(gml), transform being a
+# function of GML data (str) to new GML data.
+#
+# Returns a dictionary: mode ('unchanged', 'inplace', 'relocate' or 'extend'),
+# old and new GML data sizes and number of bytes written. With
+# 'dryrun', nothing is written.
+#
+def updategml(path, transform, dryrun = False, verify = True):
+
+    if isremote(path):
+        raise ValueError("Error: Remote files can't be updated")
+
+    with open(path, 'rb' if dryrun else 'r+b') as f:
+
+        jp2check(f)
+        gml = gmldata(f)
+        newgml = transform(gml)
+
+        result = { 'path': path, 'mode': 'unchanged', 'oldsize': len(gml.encode('utf-8')),
+                   'newsize': len(newgml.encode('utf-8')), 'written': 0 }
+
+        if newgml == gml:
+            return result
+
+        # New GML data must be well-formed
+        from xml.parsers import expat
+        try:
+            expat.ParserCreate().Parse(newgml, True)
+        except expat.ExpatError as e:
+            raise ValueError("Error: Invalid GML data: " + str(e))
+
+        mode, writes = gmlupdateplan(f, newgml)
+        result['mode'] = mode
+        result['written'] = sum([ len(data) for offset, data in writes ])
+
+        if dryrun:
+            return result
+
+        size = filesize(f)
+        regions = untouchedregions(writes, size)
+        checksums = regionchecksums(f, regions) if verify else None
+
+        # Bytes overwritten, for restoring on failure
+        originals = []
+        for offset, data in writes:
+            f.seek(offset)
+            originals.append((offset, f.read(min(len(data), max(size - offset, 0)))))
+
+        try:
+            for offset, data in writes:
+                f.seek(offset)
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+            if verify:
+                if regionchecksums(f, regions) != checksums:
+                    raise ValueError("Error: Checksum mismatch in untouched regions after update")
+                if gmldata(f) != newgml.strip('\x00 \t\r\n'):
+                    raise ValueError("Error: GML data read back differs from written data")
+
+        except BaseException:
+            for offset, data in originals:
+                f.seek(offset)
+                f.write(data)
+            f.truncate(size)
+            f.flush()
+            raise
+
+    return result
+
+# Transforms of GML data for the update command
+
+# Replace all srsName attribute values
+#
+def setsrsname(srsname):
+    from xml.sax.saxutils import quoteattr
+    return lambda gml: re.sub(r'(\bsrsName\s*=\s*)("[^"]*"|\'[^\']*\')',
+                              lambda match: match.group(1) + quoteattr(srsname), gml)
+
+# Replace origin coordinates (gml:pos or gml:coordinates in gml:origin)
+#
+def setorigin(x, y):
+
+    pattern = re.compile(r'(<(?:[\w.-]+:)?origin\b.*?<((?:[\w.-]+:)?(pos|coordinates))\b[^>]*>)([^<]*)(</\2\s*>)', re.DOTALL)
+
+    def replace(match):
+        separator = ',' if match.group(3) == 'coordinates' else ' '
+        return match.group(1) + repr(x) + separator + repr(y) + match.group(5)
+
+    return lambda gml: pattern.sub(replace, gml)
+
+################################################################
+#
+# RENAME
+
+# Rename JPEG2000 files by a format template of metadata fields, e.g.
+# '{srs}_{x_low:.0f}_{y_low:.0f}.jp2'. Fields:
+#
+#   name, suffix:             original file name without suffix, and suffix
+#   srs:                      EPSG code, or the spatial reference system name
+#   x_low, y_low,
+#   x_high, y_high:           map coordinates of corners, see mapCorners
+#   x_length, y_length, area,
+#   diagonal, azimuth:        physical area sizes, see axisCalculator
+#   a, d, b, e, c, f:         worldfile values, see GeoReference
+#   gml[key]:                 text of a GML element or attribute, e.g.
+#                             {gml[gml:fileName]} or {gml[@dimension]}
+#
+# Templates give paths relative to the directory of each file. Path
+# separators in field values are replaced with '_'.
+# Sidecar files (worldfiles, .prj, .aux.xml) are moved with their images.
+#
+# Metadata of all files is read first, and the whole rename plan is
+# checked for collisions before any file is touched. Files are then
+# renamed in two passes: first to temporary names next to them, then to
+# their new names, so that files may take each other's names. A journal
+# of the plan and the passes done allows resuming or rolling back an
+# interrupted run.
+
+# Suffixes of sidecar files of an image, in addition to its worldfile
+rename_sidecars = ('.tfw', '.wld', '.prj')
+
+# Text field value usable in a file name
+#
+def templatetext(value):
+    return re.sub(r'[/\\\x00]', '_', str(value))
+
+# GML element and attribute texts of a document for templates
+#
+class TemplateKeys(object):
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, key):
+        value = self.index.find(key)
+        if value is None:
+            value = self.index.selectone(key)
+        if value is None:
+            raise KeyError(key)
+        return templatetext(value)
+
+# Template fields of a document
+#
+def templatefields(document):
+
+    name, suffix = os.path.splitext(os.path.basename(document.path))
+
+    # Parsed first, so that worldfile values are taken from the tree
+    index = document.index()
+    srsname = document.srs()
+    code = epsgcode(srsname)
+    corners = document.corners()
+    gml_posinfo = document.georef()
+
+    fields = {
+        'name':   name,
+        'suffix': suffix,
+        'srs':    code if code is not None else templatetext(srsname),
+        'gml':    TemplateKeys(index)
+    }
+
+    if corners is not None:
+        fields.update(zip(('x_low', 'y_low', 'x_high', 'y_high'), corners))
+
+    fields.update(zip(extent_fields, document.extent()))
+
+    for field in ('a', 'd', 'b', 'e', 'c', 'f'):
+        fields[field] = getattr(gml_posinfo, field)
+
+    return fields
+
+# New path of a file. Raises ValueError if the template can't be
+# filled in or gives a path outside of the directory of the file.
+#
+def templatepath(path, template, fields):
+
+    try:
+        name = template.format(**fields)
+    except KeyError as e:
+        raise ValueError("Error: No value for template field " + str(e))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Error: Can't format template: " + str(e))
+
+    name = os.path.normpath(name)
+    if name in ('', '.') or os.path.isabs(name) or name.split(os.sep)[0] == '..':
+        raise ValueError("Error: Template gives an invalid file name: " + name)
+
+    return os.path.join(os.path.dirname(path), name)
+
+# New paths of a list of files. Returns (path, newpath, error) tuples.
+#
+def renamechunk(paths, template, window = None, maxmemory = scan_maxmemory):
+
+    results = []
+
+    for path in paths:
+        try:
+            document = read_gml(path, window = window, maxmemory = maxmemory)
+            results.append((path, templatepath(path, template, templatefields(document)), None))
+        except Exception as e:
+            results.append((path, None, str(e)))
+
+    return results
+
+# Existing sidecar files of an image and their new paths, see worldfilepath
+#
+def sidecarmoves(path, newpath):
+
+    root, newroot = os.path.splitext(path)[0], os.path.splitext(newpath)[0]
+
+    candidates = [ (worldfilepath(path), worldfilepath(newpath)), (path + '.aux.xml', newpath + '.aux.xml') ]
+    candidates += [ (root + suffix, newroot + suffix) for suffix in rename_sidecars ]
+
+    moves = []
+    for source, target in candidates:
+        if source not in [ move[0] for move in moves ] and os.path.exists(source):
+            moves.append((source, target))
+
+    return moves
+
+# Temporary name of a file being renamed
+#
+def renametemppath(path):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, '.' + name + '.renaming')
+
+# Rename plan of (path, newpath) pairs of images. Returns moves as
+# (source, temporary, target) tuples, including sidecars, and a list
+# of collisions as (target, [ sources ]) pairs.
+#
+def renameplan(renames):
+
+    moves = []
+    for path, newpath in renames:
+        if os.path.abspath(path) == os.path.abspath(newpath):
+            continue
+        for source, target in [ (path, newpath) ] + sidecarmoves(path, newpath):
+            moves.append((os.path.abspath(source), renametemppath(os.path.abspath(source)), os.path.abspath(target)))
+
+    sources = set([ move[0] for move in moves ])
+    targets = {}
+    for source, temppath, target in moves:
+        targets.setdefault(target, []).append(source)
+
+    collisions = []
+    for target, paths in sorted(targets.items()):
+        # Same target for many files, or an existing file not renamed away
+        if len(paths) > 1 or (target not in sources and os.path.lexists(target)):
+            collisions.append((target, paths))
+
+    for source, temppath, target in moves:
+        if os.path.lexists(temppath):
+            collisions.append((temppath, [ source ]))
+
+    return moves, collisions
+
+# Append a line to a journal file, and make it durable
+#
+def journalwrite(o, entry):
+    o.write(json.dumps(entry) + '\n')
+    o.flush()
+    os.fsync(o.fileno())
+
+# Directories to be created for the targets of moves
+#
+def renamedirectories(moves):
+
+    directories = set()
+
+    for source, temppath, target in moves:
+        directory = os.path.dirname(target)
+        while not os.path.isdir(directory) and directory not in directories:
+            directories.add(directory)
+            directory = os.path.dirname(directory)
+
+    return sorted(directories)
+
+# Read a rename journal. Returns the plan (see renamemain) and the
+# passes done.
+#
+def readjournal(path):
+
+    with open(path, 'r') as i:
+        lines = [ json.loads(line) for line in i if line.strip() != '' ]
+
+    if len(lines) == 0 or 'moves' not in lines[0]:
+        raise ValueError("Error: Not a rename journal: " + path)
+
+    plan = lines[0]
+    plan['moves'] = [ tuple(move) for move in plan['moves'] ]
+    passes = [ line['done'] for line in lines[1:] if 'done' in line ]
+
+    return plan, passes
+
+# Apply moves, continuing from the passes done (see readjournal).
+# Files already moved in an interrupted pass are skipped.
+#
+def applyrenames(journalpath, moves, passes = ()):
+
+    with open(journalpath, 'a') as o:
+
+        if 'temporary' not in passes:
+            for source, temppath, target in moves:
+                if not os.path.lexists(temppath):
+                    os.rename(source, temppath)
+            journalwrite(o, { 'done': 'temporary' })
+
+        if 'target' not in passes:
+            for source, temppath, target in moves:
+                if os.path.lexists(temppath):
+                    if os.path.lexists(target):
+                        raise ValueError("Error: Target file appeared during rename: " + target)
+                    os.makedirs(os.path.dirname(target), exist_ok = True)
+                    os.rename(temppath, target)
+            journalwrite(o, { 'done': 'target' })
+
+# Undo moves of a journal, in reverse order of the passes. Directories
+# created for targets are removed if empty.
+#
+def rollbackrenames(journalpath, moves, passes, directories = ()):
+
+    with open(journalpath, 'a') as o:
+
+        if 'rollback' in passes:
+            return
+
+        # The target pass may have been interrupted
+        if 'temporary' in passes:
+            for source, temppath, target in moves:
+                if not os.path.lexists(temppath) and os.path.lexists(target):
+                    os.rename(target, temppath)
+
+        for source, temppath, target in moves:
+            if os.path.lexists(temppath):
+                os.rename(temppath, source)
+
+        for directory in reversed(directories):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+
+        journalwrite(o, { 'done': 'rollback' })
+
+################################################################
+#
+# SERVE MODE
+
+# Answer metadata queries in a long-running process over HTTP, on a
+# localhost port or on a Unix socket:
+#
+#   GET /info?path=tiles/a.jp2
+#   GET /json?path=tiles/a.jp2&formatting=raw
+#   GET /tfw?path=tiles/a.jp2
+#   GET /xml?path=tiles/a.jp2
+#   GET /crs?path=tiles/a.jp2     EPSG definition, see CRSRegistry
+#   GET /stats                    cache statistics
+#
+# Paths are relative to the root directory of the server, and files
+# outside of it are not served.
+#
+# Documents (GML data, parsed tree, worldfile values) and rendered
+# outputs are kept in a bounded LRU, see DocumentLRU.
+
+serve_formats = ('info', 'json', 'tfw', 'worldfile', 'xml', 'crs')
+
+# Cached document of a file and its rendered outputs by
+# (format, formatting). Size is the length of GML data and outputs.
+#
+class DocumentEntry(object):
+
+    __slots__ = ('key', 'document', 'outputs', 'size', 'lock')
+
+    def __init__(self, key, document):
+        self.key      = key
+        self.document = document
+        self.outputs  = {}
+        self.size     = len(document.parser.datalist)
+        # Documents compute their values on first use, one thread at a time
+        self.lock     = threading.Lock()
+
+# Least recently used documents, keyed by file identity (path, size and
+# modification time). A changed file is read again, and the entry of
+# its previous version is dropped. At most 'maxentries' entries and
+# 'maxsize' bytes (see DocumentEntry) are kept.
+#
+# Files are read outside of the lock, so concurrent queries of different
+# files do not wait for each other.
+#
+class DocumentLRU(object):
+
+    def __init__(self, maxentries = 1024, maxsize = None, window = None, maxmemory = scan_maxmemory):
+
+        import collections
+
+        self.maxentries = maxentries
+        self.maxsize    = maxsize
+        self.window     = window
+        self.maxmemory  = maxmemory
+
+        self.entries = collections.OrderedDict()
+        # Current key of each path
+        self.paths   = {}
+        self.size    = 0
+        self.lock    = threading.Lock()
+
+        self.counts = { 'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0 }
+
+    def entry(self, path):
+
+        st = os.stat(path)
+        key = (path, st.st_size, st.st_mtime_ns)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.counts['hits'] += 1
+                return entry
+            self.counts['misses'] += 1
+
+        document = read_gml(path, window = self.window, maxmemory = self.maxmemory)
+        key = (path,) + tuple(document.identity)
+
+        with self.lock:
+
+            # Read by another thread meanwhile
+            entry = self.entries.get(key)
+            if entry is not None:
+                return entry
+
+            previous = self.paths.get(path)
+            if previous is not None:
+                self.drop(previous)
+                self.counts['invalidations'] += 1
+
+            entry = DocumentEntry(key, document)
+            self.entries[key] = entry
+            self.paths[path] = key
+            self.size += entry.size
+            self.evict()
+
+        return entry
+
+    # Rendered output of a file, see render
+    def output(self, path, outputformat, formatting):
+
+        entry = self.entry(path)
+
+        with entry.lock:
+            output = entry.outputs.get((outputformat, formatting))
+            if output is not None:
+                return output
+
+            # Kept documents are parsed once, and all outputs are
+            # rendered from the same tree
+            entry.document.index()
+            output = render(entry.document, outputformat, formatting)
+            entry.outputs[(outputformat, formatting)] = output
+
+        with self.lock:
+            entry.size += len(output)
+            if self.entries.get(entry.key) is entry:
+                self.size += len(output)
+                self.evict()
+
+        return output
+
+    # Georeference of a file, see GMLDocument.georef
+    def georef(self, path):
+        entry = self.entry(path)
+        with entry.lock:
+            entry.document.index()
+            return entry.document.georef()
+
+    def drop(self, key):
+        entry = self.entries.pop(key)
+        self.size -= entry.size
+        if self.paths.get(key[0]) == key:
+            del self.paths[key[0]]
+
+    # Called with the lock held. The newest entry is always kept.
+    def evict(self):
+        while len(self.entries) > 1 and (len(self.entries) > self.maxentries or
+                                         (self.maxsize is not None and self.size > self.maxsize)):
+            self.drop(next(iter(self.entries)))
+            self.counts['evictions'] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = { 'entries': len(self.entries), 'size': self.size,
+                      'maxentries': self.maxentries, 'maxsize': self.maxsize }
+            stats.update(self.counts)
+        return stats
+
+# Queries of the server. Returns (HTTP status, content type, body).
+#
+class MetadataServer(object):
+
+    def __init__(self, root, documents, registry = None):
+
+        self.root      = os.path.realpath(root)
+        self.documents = documents
+        self.registry  = registry
+        # The registry connection is shared by all threads
+        self.registrylock = threading.Lock()
+
+        self.started = time.time()
+        self.counts  = { 'requests': 0, 'errors': 0 }
+        self.lock    = threading.Lock()
+
+    # Local path of a query path, or None if it is outside of the root directory
+    def localpath(self, path):
+        path = os.path.realpath(os.path.join(self.root, path))
+        if os.path.commonpath([ self.root, path ]) != self.root:
+            return None
+        return path
+
+    def stats(self):
+        with self.lock:
+            stats = { 'uptime': time.time() - self.started }
+            stats.update(self.counts)
+        stats['documents'] = self.documents.stats()
+        if self.registry is not None:
+            info = self.registry.get_crs.cache_info()
+            stats['registry'] = { 'hits': info.hits, 'misses': info.misses, 'entries': info.currsize }
+        return stats
+
+    def crs(self, path):
+
+        if self.registry is None:
+            return (404, "Error: No EPSG registry given")
+
+        gml_posinfo = self.documents.georef(path)
+        if gml_posinfo.srs is None:
+            return (404, "Error: Not a valid ESPG number found")
+
+        with self.registrylock:
+            definition = self.registry.get_crs(gml_posinfo.srs)
+        if definition is None:
+            return (404, "Error: Unknown EPSG code " + str(gml_posinfo.srs))
+
+        return (200, json.dumps(definition.todict()))
+
+    def query(self, name, parameters):
+
+        with self.lock:
+            self.counts['requests'] += 1
+
+        status, content_type, body = self.answer(name, parameters)
+
+        if status != 200:
+            with self.lock:
+                self.counts['errors'] += 1
+
+        return (status, content_type, body)
+
+    def answer(self, name, parameters):
+
+        if name == 'stats':
+            return (200, 'application/json', json.dumps(self.stats()))
+
+        if name not in serve_formats:
+            return (404, 'text/plain', "Error: Unknown query " + name)
+
+        formatting = parameters.get('formatting', 'pretty')
+        if formatting not in ('pretty', 'raw'):
+            return (400, 'text/plain', "Error: Undefined formatting")
+
+        if 'path' not in parameters:
+            return (400, 'text/plain', "Error: No input file specified")
+
+        path = self.localpath(parameters['path'])
+        if path is None:
+            return (403, 'text/plain', "Error: Input file outside of root directory")
+
+        content_type = 'application/json' if name in ('json', 'crs') else 'application/xml' if name == 'xml' else 'text/plain'
+
+        try:
+            if name == 'crs':
+                status, body = self.crs(path)
+                return (status, content_type if status == 200 else 'text/plain', body)
+
+            return (200, content_type, self.documents.output(path, name, formatting))
+
+        except FileNotFoundError:
+            return (404, 'text/plain', "Error: No such file")
+        except Exception as e:
+            return (422, 'text/plain', str(e))
+
+# HTTP request handler of a MetadataServer. Connections are kept alive
+# for many requests.
+#
+def servehandler(server):
+
+    import http.server
+    import urllib.parse
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+
+            url = urllib.parse.urlsplit(self.path)
+            parameters = dict(urllib.parse.parse_qsl(url.query))
+
+            status, content_type, body = server.query(url.path.strip('/'), parameters)
+            body = body.encode('utf-8')
+
+            self.send_response(status)
+            self.send_header('Content-Type', content_type + '; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        # Requests are not logged. Unix socket clients have no address.
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+# HTTP server on a Unix socket, or on a TCP port if 'socketpath' is None.
+# Each connection is handled in its own thread.
+#
+def httpserver(handler, socketpath = None, host = '127.0.0.1', port = 8080):
+
+    import socket
+    import socketserver
+    import http.server
+
+    # Connections waiting to be accepted. The default of 5 refuses
+    # clients which connect at the same time.
+    class TCPHTTPServer(http.server.ThreadingHTTPServer):
+        request_queue_size = socket.SOMAXCONN
+
+    if socketpath is None:
+        return TCPHTTPServer((host, port), handler)
+
+    # Remove a socket left by a server which is not running
+    if os.path.exists(socketpath):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socketpath)
+        except ConnectionRefusedError:
+            os.unlink(socketpath)
+        else:
+            raise ValueError("Error: Socket is in use: " + socketpath)
+        finally:
+            probe.close()
+
+    class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+        request_queue_size = socket.SOMAXCONN
+
+    return UnixHTTPServer(socketpath, handler)
+
+################################################################
+#
+# INPUT ARGUMENTS
+
+output_formats = ('json', 'xml', 'tfw', 'worldfile', 'info', 'boxes')
+
+# Options for files with broken box structure, see jp2scan
+#
+def addscanarguments(argparser):
+    argparser.add_argument('--scan-window', help = 'Scan only the last N megabytes of files with broken box structure', type = int, dest = 'scanwindow')
+    argparser.add_argument('--scan-memory', help = 'Memory ceiling in megabytes for scanning files with broken box structure (Default: 16)', type = int, default = 16, dest = 'scanmemory')
+
+# Scan limits are given in megabytes
+#
+def scanlimits(args):
+
+    if args.scanwindow is not None:
+        args.scanwindow *= 1024 * 1024
+
+    args.scanmemory *= 1024 * 1024
+
+# Options for the metadata cache, see GMLCache
+#
+def addcachearguments(argparser):
+    argparser.add_argument('--cache', help = 'Metadata cache file (SQLite)', dest = 'cachefile')
+    argparser.add_argument('--cache-size', help = 'Maximum metadata cache size in megabytes', type = int, dest = 'cachesize')
+
+def cachelimits(args):
+    if args.cachesize is not None:
+        args.cachesize *= 1024 * 1024
+
+# Options for per-stage profiling, see Profiler
+#
+def addprofilearguments(argparser):
+    argparser.add_argument('--profile', help = 'Write per-stage timings and counters to standard error', action = 'store_true', dest = 'profile')
+    argparser.add_argument('--stats-json', help = 'Write per-stage timings and counters as JSON to a file', dest = 'statsfile')
+    argparser.add_argument('--profile-allocations', help = 'Count memory allocations of each stage (slow)', action = 'store_true', dest = 'allocations')
+
+def profilerequested(args):
+    return args.profile or args.statsfile is not None
+
+# Options for place names of tiles, see Gazetteer
+#
+def addgazetteerarguments(argparser):
+    argparser.add_argument('--gazetteer', help = 'Add nearest place names from a gazetteer index, see: gmlparser.py gazetteer (requires NumPy)', dest = 'gazetteer')
+    argparser.add_argument('--max-distance', help = 'Maximum distance of places from tile centres in kilometers (Default: 100)', type = float, default = 100.0, dest = 'maxdistance')
+    argparser.add_argument('--registry', help = 'EPSG registry file (SQLite) for map projections, see: gmlparser.py epsg', dest = 'registry')
+
+def loadregistry(args):
+    if args.registry is None:
+        return None
+    return CRSRegistry(args.registry)
+
+def loadgazetteer(args):
+    if args.gazetteer is None:
+        return None
+    return Gazetteer.load(args.gazetteer)
+
+def argumentparser():
+
+    argparser = argparse.ArgumentParser(epilog = 'Commands: ' + ' | '.join(commands) + ' (see: gmlparser.py <command> -h)')
+
+    argparser.add_argument('-i', '--input', help = 'Input JPEG2000 image file or HTTP URL', nargs = '?', dest = 'inputfile')
+    argparser.add_argument('-f', '--dataformat', help = 'Output format (Default: xml; Available: xml | json | [tfw|worldfile] | info | boxes)', nargs = '?', dest = 'outputformat')
+    argparser.add_argument('--box', help = 'Use this metadata box instead of the GML box (see: -f boxes)', type = int, dest = 'box')
+    argparser.add_argument('-o', '--output', help = 'Output file name', nargs = '?', dest = 'outputfile')
+    argparser.add_argument('-l', '--formatting', help = 'Data formatting (Default: raw; Available: raw, pretty)', nargs = '?', dest = 'formatting')
+    addscanarguments(argparser)
+    addcachearguments(argparser)
+    addprofilearguments(argparser)
+    addgazetteerarguments(argparser)
+
+    return argparser
+
+def batchargumentparser():
+
+    argparser = argparse.ArgumentParser(prog = 'gmlparser.py batch', description = 'Extract metadata of many JPEG2000 files as JSON Lines')
+
+    argparser.add_argument('inputs', help = 'Input files, directories, glob patterns or HTTP URLs', nargs = '*')
+    argparser.add_argument('--stdin', help = 'Read input file names from standard input, one per line', action = 'store_true', dest = 'stdin')
+    argparser.add_argument('-o', '--output', help = 'Output file name (Default: standard output)', dest = 'outputfile')
+    argparser.add_argument('-w', '--workers', help = 'Number of worker processes (Default: number of CPUs)', type = int, dest = 'workers')
+    argparser.add_argument('-c', '--chunksize', help = 'Number of files per worker task (Default: 16)', type = int, default = 16, dest = 'chunksize')
+    argparser.add_argument('--async', help = 'Overlap reads of many files, for network storage', action = 'store_true', dest = 'asyncio')
+    argparser.add_argument('--inflight', help = 'Number of files read at a time with --async (Default: 64)', type = int, default = 64, dest = 'inflight')
+    argparser.add_argument('--parsers', help = 'Number of parser processes with --async (Default: 2)', type = int, default = 2, dest = 'parsers')
+    argparser.add_argument('--ordered', help = 'Write records in input order with --async', action = 'store_true', dest = 'ordered')
+    argparser.add_argument('--wgs84', help = 'Add footprints of tiles in WGS 84 longitudes and latitudes (requires NumPy)', action = 'store_true', dest = 'wgs84')
+    addscanarguments(argparser)
+    addcachearguments(argparser)
+    addprofilearguments(argparser)
+    addgazetteerarguments(argparser)
+
+    return argparser
+
+def epsgargumentparser():
+
+    argparser = argparse.ArgumentParser(prog = 'gmlparser.py epsg', description = 'Manage local EPSG registry')
+
+    argparser.add_argument('registry', help = 'EPSG registry file (SQLite)')
+    argparser.add_argument('action', help = 'import: import EPSG GML definitions (<code>.xml) and well-known text (<code>.prj) from given directories | get: print definitions of given EPSG codes | list: print known EPSG codes', choices = ('import', 'get', 'list'))
+    argparser.add_argument('arguments', help = 'Directories or EPSG codes', nargs = '*')
+    argparser.add_argument('--fetch', help = 'Download missing definitions from this URL (Default: http://epsg.io/)', nargs = '?', const = 'http://epsg.io/', dest = 'fetchurl')
+
+    return argparser
+
+def gazetteerargumentparser():
+
+    argparser = argparse.ArgumentParser(prog = 'gmlparser.py gazetteer', description = 'Build and query place name indexes (requires NumPy)')
+    subparsers = argparser.add_subparsers(dest = 'action', required = True)
+
+    build = subparsers.add_parser('build', help = 'Build an index from a GeoNames TSV file, or a TSV file of name, latitude and longitude')
+    build.add_argument('places', help = 'Places file (TSV)')
+    build.add_argument('gazetteer', help = 'Index file')
+    build.add_argument('--feature-class', help = 'GeoNames feature classes to include (Default: P)', nargs = '+', default = [ 'P' ], dest = 'featureclasses')
+    build.add_argument('--min-population', help = 'Minimum population of GeoNames places (Default: 0)', type = int, default = 0, dest = 'minpopulation')
+    build.add_argument('--cell-size', help = 'Grid cell size in kilometers (Default: 10)', type = float, default = 10.0, dest = 'cellsize')
+
+    query = subparsers.add_parser('query', help = 'Find the nearest place of a point')
+    query.add_argument('gazetteer', help = 'Index file')
+    query.add_argument('lat', help = 'Latitude in degrees', type = float)
+    query.add_argument('lon', help = 'Longitude in degrees', type = float)
+    query.add_argument('--max-distance', help = 'Maximum distance in kilometers (Default: unlimited)', type = float, dest = 'maxdistance')
+
+    return argparser
+
+def summaryargumentparser():
+
+    argparser = argparse.ArgumentParser(prog = 'gmlparser.py summary', description = 'Summarize tile catalogs from batch records (requires NumPy)')
+
+    argparser.add_argument('inputs', help = 'JSON Lines files written by batch command (Default: standard input)', nargs = '*')
+
+    return argparser
+
+def catalogargumentparser():
+
+    argparser = argparse.ArgumentParser(prog = 'gmlparser.py catalog', description = 'Spatial index of tile footprints')
+    subparsers = argparser.add_subparsers(dest = 'action', required = True)
+
+    build = subparsers.add_parser('build', help = 'Add or update tiles in catalog')
+    build.add_argument('catalog', help = 'Catalog file (SQLite)')
+    build.add_argument('inputs', help = 'Input files, directories or glob patterns', nargs = '*')
+    build.add_argument('--records', help = 'Add tiles from JSON Lines files written by batch command', nargs = '+', default = [], dest = 'records')
+    build.add_argument('-w', '--workers', help = 'Number of worker processes (Default: number of CPUs)', type = int, dest = 'workers')
+    build.add_argument('-c', '--chunksize', help = 'Number of files per worker task (Default: 16)', type = int, default = 16, dest = 'chunksize')
+    addscanarguments(build)
+    addcachearguments(build)
+
+    query = subparsers.add_parser('query', help = 'Find tiles covering a bounding box or a point')
+    query.add_argument('catalog', help = 'Catalog file (SQLite)')
+    query.add_argument('--bbox', help = 'Bounding box in map units', nargs = 4, type = float, metavar = ('X_LOW', 'Y_LOW', 'X_HIGH', 'Y_HIGH'), dest = 'bbox')
+    query.add_argument('--point', help = 'Point in map units', nargs = 2, type = float, metavar = ('X', 'Y'), dest = 'point')
+    query.add_argument('--srs', help = 'Spatial reference system, e.g. EPSG:3067 (Default: all)', dest = 'srs')
+
+    remove = subparsers.add_parser('remove', help = 'Remove tiles from catalog')
+    remove.add_argument('catalog', help = 'Catalog file (SQLite)')
+    remove.add_argument('paths', help = 'Tile files', nargs = '+')
+
+    return argparser
+
+def sidecarsargumentparser():
+
+    argparser = argparse.ArgumentParser(prog = 'gmlparser.py sidecars', description = 'Write worldfile sidecars next to JPEG2000 files')
+
+    argparser.add_argument('inputs', help = 'Input files, directories or glob patterns', nargs = '+')
+    argparser.add_argument('--suffix', help = 'Worldfile suffix, e.g. tfw (Default: j2w for .jp2 files)', dest = 'suffix')
+    argparser.add_argument('--prj', help = 'Write .prj files (requires --registry with well-known text)', action = 'store_true', dest = 'prj')
+    argparser.add_argument('--aux', help = 'Write GDAL .aux.xml files', action = 'store_true', dest = 'aux')
+    argparser.add_argument('--registry', help = 'EPSG registry file (SQLite), see: gmlparser.py epsg', dest = 'registry')
+    argparser.add_argument('--force', help = 'Write sidecars even if up to date', action = 'store_true', dest = 'force')
+    argparser.add_argument('-w', '--workers', help = 'Number of worker processes (Default: number of CPUs)', type = int, dest = 'workers')
+    argparser.add_argument('-c', '--chunksize', help = 'Number of files per worker task (Default: 16)', type = int, default = 16, dest = 'chunksize')
+    addscanarguments(argparser)
+
+    return argparser
+
+def updateargumentparser():
+
+    argparser = argparse.ArgumentParser(prog = 'gmlparser.py update', description = 'Replace GML data of JPEG2000 files in place')
+
+    argparser.add_argument('inputs', help = 'Input files, directories or glob patterns', nargs = '+')
+    argparser.add_argument('--xml', help = 'Replace GML data with contents of this file', dest = 'xmlfile')
+    argparser.add_argument('--srs', help = 'Set all srsName attributes, e.g. urn:ogc:def:crs:EPSG::3067', dest = 'srs')
+    argparser.add_argument('--origin', help = 'Set origin coordinates of the grid', nargs = 2, type = float, metavar = ('X', 'Y'), dest = 'origin')
+    argparser.add_argument('--replace', help = 'Replace text in GML data (may be given many times)', nargs = 2, action = 'append', default = [], metavar = ('OLD', 'NEW'), dest = 'replace')
+    argparser.add_argument('-n', '--dry-run', help = 'Only show what would be done', action = 'store_true', dest = 'dryrun')
+    argparser.add_argument('--no-verify', help = 'Do not verify checksums of untouched regions (faster for large files)', action = 'store_false', dest = 'verify')
+
+    return argparser
+
+def watchargumentparser():
+
+    argparser = argparse.ArgumentParser(prog = 'gmlparser.py watch', description = 'Process new and changed JPEG2000 files in directories')
+
+    argparser.add_argument('directories', help = 'Directories to watch', nargs = '+')
+    argparser.add_argument('--state', help = 'State file of processed files, for resuming', dest = 'statefile')
+    argparser.add_argument('--worldfile', help = 'Write worldfile sidecars (e.g. image.j2w)', action = 'store_true', dest = 'worldfile')
+    argparser.add_argument('--catalog', help = 'Update tile catalog file (SQLite)', dest = 'catalog')
+    argparser.add_argument('-o', '--output', help = 'Append batch records to a JSON Lines file', dest = 'outputfile')
+    argparser.add_argument('--settle', help = 'Seconds a file must stay unchanged before processing (Default: 2)', type = float, default = 2.0, dest = 'settle')
+    argparser.add_argument('--poll', help = 'List directories for changes instead of using inotify', action = 'store_true', dest = 'polling')
+    argparser.add_argument('--interval', help = 'Seconds between directory listings with --poll (Default: 2)', type = float, default = 2.0, dest = 'interval')
+    argparser.add_argument('-w', '--workers', help = 'Number of worker processes (Default: 1)', type = int, default = 1, dest = 'workers')
+    addscanarguments(argparser)
+    addcachearguments(argparser)
+
+    return argparser
+
+def renameargumentparser():
+
+    argparser = argparse.ArgumentParser(prog = 'gmlparser.py rename', description = 'Rename JPEG2000 files by a template of metadata fields')
+
+    argparser.add_argument('inputs', help = 'Input files, directories or glob patterns', nargs = '*')
+    argparser.add_argument('-t', '--template', help = 'New file name, e.g. {srs}_{x_low:.0f}_{y_low:.0f}.jp2 (fields: name, suffix, srs, x_low, y_low, x_high, y_high, x_length, y_length, area, diagonal, azimuth, a, d, b, e, c, f, gml[key])', dest = 'template')
+    argparser.add_argument('--journal', help = 'Journal file of the rename (Default: rename-journal.jsonl)', default = 'rename-journal.jsonl', dest = 'journal')
+    argparser.add_argument('--resume', help = 'Finish an interrupted rename of the journal', action = 'store_true', dest = 'resume')
+    argparser.add_argument('--rollback', help = 'Undo the rename of the journal', action = 'store_true', dest = 'rollback')
+    argparser.add_argument('-n', '--dry-run', help = 'Only show what would be done', action = 'store_true', dest = 'dryrun')
+    argparser.add_argument('-w', '--workers', help = 'Number of worker processes (Default: number of CPUs)', type = int, dest = 'workers')
+    argparser.add_argument('-c', '--chunksize', help = 'Number of files per worker task (Default: 16)', type = int, default = 16, dest = 'chunksize')
+    addscanarguments(argparser)
+
+    return argparser
+
+def serveargumentparser():
+
+    argparser = argparse.ArgumentParser(prog = 'gmlparser.py serve', description = 'Answer metadata queries over HTTP from a long-running process')
+
+    argparser.add_argument('--socket', help = 'Listen on this Unix socket instead of a TCP port', dest = 'socketpath')
+    argparser.add_argument('--host', help = 'Address to listen on (Default: 127.0.0.1)', default = '127.0.0.1', dest = 'host')
+    argparser.add_argument('-p', '--port', help = 'TCP port to listen on (Default: 8080)', type = int, default = 8080, dest = 'port')
+    argparser.add_argument('--root', help = 'Directory of served files (Default: current directory)', default = '.', dest = 'root')
+    argparser.add_argument('--entries', help = 'Maximum number of cached files (Default: 1024)', type = int, default = 1024, dest = 'entries')
+    argparser.add_argument('--memory', help = 'Maximum size of cached GML data and outputs in megabytes (Default: 256)', type = int, default = 256, dest = 'memory')
+    argparser.add_argument('--registry', help = 'EPSG registry file (SQLite) for crs queries, see: gmlparser.py epsg', dest = 'registry')
+    addscanarguments(argparser)
+
+    return argparser
+
+def cacheargumentparser():
+
+    argparser = argparse.ArgumentParser(prog = 'gmlparser.py cache', description = 'Manage metadata cache')
+
+    argparser.add_argument('cachefile', help = 'Metadata cache file (SQLite)')
+    argparser.add_argument('action', help = 'stats: print cache statistics | invalidate: forget given files and directories, or all files if none given | evict: shrink cache to given size', choices = ('stats', 'invalidate', 'evict'))
+    argparser.add_argument('paths', help = 'Files or directories to invalidate', nargs = '*')
+    argparser.add_argument('--cache-size', help = 'Cache size in megabytes for evict', type = int, dest = 'cachesize')
+
+    return argparser
+
+################################################################
+#
+# OUTPUT WRITING
+
+def render(document, outputformat, formatting, gazetteer = None, maxdistance = 100.0, registry = None):
+
+    if outputformat == 'xml':
+        return document.to_xml(formatting)
+
+    elif outputformat == 'json':
+        return document.to_json(formatting)
+
+    elif outputformat == 'tfw' or outputformat == 'worldfile':
+        return document.to_worldfile()
+
+    elif outputformat == 'info':
+        return document.to_info(gazetteer, maxdistance, registry)
+
+    elif outputformat == 'boxes':
+        return document.to_boxes(formatting)
+
+    raise ValueError("Error: invalid data format")
+
+# Stage names of profiler stats in processing order
+#
+def profileorder(stages):
+    return sorted(stages, key = lambda name: (profile_stages.index(name) if name in profile_stages else len(profile_stages), name))
+
+# Table of per-stage counters of one file, see Profiler.stats
+#
+def profiletable(stats):
+
+    lines = [ '{:<8}'.format('stage') + ''.join([ '{:>12}'.format(c) for c in profile_counters ]) ]
+
+    for name in profileorder(stats):
+        values = stats[name]
+        lines.append('{:<8}'.format(name) + ''.join([
+            '{:>12.6f}'.format(values[c]) if c == 'seconds' else '{:>12d}'.format(int(values[c]))
+            for c in profile_counters ]))
+
+    return '\n'.join(lines) + '\n'
+
+# Table of counter percentiles over files, see ProfileSummary
+#
+def percentiletable(files, percentiles):
+
+    columns = ('p50', 'p90', 'p99', 'max', 'total')
+    lines = [ 'Files: ' + str(files),
+              '{:<8}{:<12}'.format('stage', 'counter') + ''.join([ '{:>14}'.format(c) for c in columns ]) ]
+
+    for name in profileorder(percentiles):
+        for counter in profile_counters:
+            summary = percentiles[name].get(counter)
+            if summary is None or counter == 'calls' or summary['total'] == 0:
+                continue
+            valueformat = '{:>14.6f}' if counter == 'seconds' else '{:>14d}'
+            lines.append('{:<8}{:<12}'.format(name, counter) + ''.join([
+                valueformat.format(summary[c] if counter == 'seconds' else int(summary[c])) for c in columns ]))
+
+    return '\n'.join(lines) + '\n'
+
+# Write profiling results as requested with --profile and --stats-json
+#
+def writeprofile(args, results, table):
+
+    if args.profile:
+        sys.stderr.write(table)
+
+    if args.statsfile is not None:
+        with open(args.statsfile, 'w') as o:
+            json.dump(results, o, indent=2, sort_keys=True)
+
+def batchmain(argv):
+
+    args = batchargumentparser().parse_args(argv)
+    scanlimits(args)
+    cachelimits(args)
+    profile = profilerequested(args)
+
+    paths = batchpaths(args.inputs)
+
+    if args.stdin:
+        stdinpaths = ( line.rstrip('\n') for line in sys.stdin if line.strip() != '' )
+        paths = itertools.chain(paths, stdinpaths)
+
+    if args.outputfile is None:
+        o = sys.stdout
+    else:
+        o = open(args.outputfile, 'w')
+
+    gazetteer = loadgazetteer(args)
+
+    if args.asyncio:
+        if args.cachefile is not None:
+            raise ValueError("Error: metadata cache can't be used with --async")
+        records = runasyncbatch(paths, args.inflight, args.parsers, args.ordered,
+                                args.scanwindow, args.scanmemory, profile, args.allocations)
+    else:
+        records = batch(paths, args.workers, args.chunksize, args.scanwindow, args.scanmemory,
+                        args.cachefile, args.cachesize, profile, args.allocations)
+
+    registry = loadregistry(args)
+
+    if args.wgs84:
+        records = wgs84records(records, registry)
+    if gazetteer is not None:
+        records = placerecords(records, gazetteer, args.maxdistance, registry)
+
+    failed = 0
+    summary = ProfileSummary()
+
+    try:
+        for record in records:
+            if record['error'] is not None:
+                failed += 1
+            stats = record.pop('stats', None)
+            if stats is not None:
+                summary.add(stats)
+            o.write(json.dumps(record) + '\n')
+            o.flush()
+    finally:
+        if o is not sys.stdout:
+            o.close()
+
+    if profile:
+        percentiles = summary.percentiles()
+        writeprofile(args, { 'files': summary.files, 'stages': percentiles },
+                     percentiletable(summary.files, percentiles))
+
+    return 1 if failed > 0 else 0
+
+# Total area and union bounding box of batch records, grouped by
+# spatial reference system
+#
+def summarymain(argv):
+
+    import numpy
+
+    args = summaryargumentparser().parse_args(argv)
+
+    # Corners of each spatial reference system as flat arrays of
+    # x_low, y_low, x_high, y_high values
+    corners = {}
+    nan = [ float('nan') ] * 4
+
+    def records():
+        if len(args.inputs) == 0:
+            for line in sys.stdin:
+                yield line
+        for name in args.inputs:
+            with open(name, 'r') as i:
+                for line in i:
+                    yield line
+
+    for line in records():
+        if line.strip() == '':
+            continue
+
+        record = json.loads(line)
+        if record['error'] is not None:
+            continue
+
+        values = corners.setdefault(CRSRegistry.canonical(record['srs']), array.array('d'))
+        extent = record['extent']
+
+        if extent is None or extent['lower'] is None:
+            values.extend(nan)
+        else:
+            values.extend(extent['lower'] + extent['upper'])
+
+    summary = {}
+    for srs, values in corners.items():
+        values = numpy.frombuffer(values, dtype = float).reshape(-1, 4)
+        summary[str(srs)] = axisStatistics(values[:, 0:2], values[:, 2:4])
+
+    print(json.dumps(summary, indent=2, sort_keys=True))
+
+    return 0
+
+def gazetteermain(argv):
+
+    args = gazetteerargumentparser().parse_args(argv)
+
+    if args.action == 'build':
+        gazetteer = Gazetteer.fromtsv(args.places, args.featureclasses, args.minpopulation, args.cellsize)
+        gazetteer.save(args.gazetteer)
+        print(str(len(gazetteer.cells)) + ' places indexed')
+
+    elif args.action == 'query':
+        gazetteer = Gazetteer.load(args.gazetteer)
+        found, distances = gazetteer.nearest([ args.lat ], [ args.lon ], args.maxdistance)
+        if found[0] < 0:
+            print('No place found')
+            return 1
+        print(json.dumps(gazetteer.place(found[0], distances[0])))
+
+    return 0
+
+def catalogmain(argv):
+
+    args = catalogargumentparser().parse_args(argv)
+    catalog = TileCatalog(args.catalog)
+
+    try:
+        if args.action == 'build':
+            scanlimits(args)
+            cachelimits(args)
+
+            added = 0
+            failed = 0
+
+            def records():
+                for name in args.records:
+                    with open(name, 'r') as i:
+                        for line in i:
+                            if line.strip() != '':
+                                yield json.loads(line)
+                for record in batch(batchpaths(args.inputs), args.workers, args.chunksize,
+                                    args.scanwindow, args.scanmemory, args.cachefile, args.cachesize):
+                    yield record
+
+            for record in records():
+                if catalog.addrecord(record):
+                    added += 1
+                else:
+                    failed += 1
+                    Warn("Warning: No footprint for " + record['path'])
+
+            print(str(added) + ' tiles added, ' + str(failed) + ' failed')
+
+        elif args.action == 'query':
+            if args.bbox is not None:
+                tiles = catalog.query(*args.bbox, srsname = args.srs)
+            elif args.point is not None:
+                tiles = catalog.point(*args.point, srsname = args.srs)
+            else:
+                raise ValueError("Error: No bounding box or point specified")
+
+            for path, srs, corners in tiles:
+                print(json.dumps({ 'path': path, 'srs': srs, 'lower': list(corners[0:2]), 'upper': list(corners[2:4]) }))
+
+        elif args.action == 'remove':
+            for path in args.paths:
+                catalog.remove(path)
+
+    finally:
+        catalog.close()
+
+    return 0
+
+# Exits with status 1 if any file failed
+#
+def sidecarsmain(argv):
+
+    argparser = sidecarsargumentparser()
+    args = argparser.parse_args(argv)
+    scanlimits(args)
+
+    if args.prj and args.registry is None:
+        argparser.error("--prj requires --registry")
+
+    counts = { 'written': 0, 'skipped': 0, 'failed': 0 }
+
+    for path, status, message in poolmap(sidecarchunk, batchpaths(args.inputs), args.workers, args.chunksize,
+                                         args.suffix, args.prj, args.aux, args.force, args.registry,
+                                         args.scanwindow, args.scanmemory):
+        counts[status] += 1
+        if status == 'failed':
+            Warn("Warning: " + path + ": " + message)
+
+    print(str(counts['written']) + ' written, ' + str(counts['skipped']) + ' skipped, ' + str(counts['failed']) + ' failed')
+
+    return 1 if counts['failed'] > 0 else 0
+
+# Exits with status 1 if any file failed
+#
+def updatemain(argv):
+
+    args = updateargumentparser().parse_args(argv)
+
+    transforms = []
+
+    if args.xmlfile is not None:
+        with open(args.xmlfile, 'r', encoding = 'utf-8') as i:
+            newgml = i.read()
+        transforms.append(lambda gml: newgml)
+
+    if args.srs is not None:
+        transforms.append(setsrsname(args.srs))
+
+    if args.origin is not None:
+        transforms.append(setorigin(*args.origin))
+
+    for old, new in args.replace:
+        transforms.append(lambda gml, old = old, new = new: gml.replace(old, new))
+
+    if len(transforms) == 0:
+        raise ValueError("Error: Nothing to update")
+
+    def transform(gml):
+        for function in transforms:
+            gml = function(gml)
+        return gml
+
+    counts = { 'unchanged': 0, 'inplace': 0, 'relocate': 0, 'extend': 0, 'failed': 0 }
+
+    for path in batchpaths(args.inputs):
+        try:
+            result = updategml(path, transform, args.dryrun, args.verify)
+        except Exception as e:
+            counts['failed'] += 1
+            Warn("Warning: " + path + ": " + str(e))
+            continue
+
+        counts[result['mode']] += 1
+        print(path + ': ' + result['mode'] + ' (' + str(result['oldsize']) + ' -> ' +
+              str(result['newsize']) + ' bytes, ' + str(result['written']) + ' bytes written)')
+
+    print(str(counts['inplace']) + ' updated in place, ' + str(counts['relocate'] + counts['extend']) + ' relocated, ' +
+          str(counts['unchanged']) + ' unchanged, ' + str(counts['failed']) + ' failed' +
+          (' (dry run)' if args.dryrun else ''))
+
+    return 1 if counts['failed'] > 0 else 0
+
+def watchmain(argv):
+
+    args = watchargumentparser().parse_args(argv)
+    scanlimits(args)
+    cachelimits(args)
+
+    catalog = None
+    if args.catalog is not None:
+        catalog = TileCatalog(args.catalog)
+
+    cache = None
+    if args.cachefile is not None:
+        cache = GMLCache(args.cachefile, args.cachesize)
+
+    o = None
+    if args.outputfile is not None:
+        o = open(args.outputfile, 'a')
+
+    def process(paths):
+
+        processed = []
+
+        for record in batch(paths, args.workers, 16, args.scanwindow, args.scanmemory,
+                            args.cachefile, args.cachesize):
+
+            path = record['path']
+
+            if o is not None:
+                o.write(json.dumps(record) + '\n')
+                o.flush()
+
+            if record['error'] is not None:
+                Warn("Warning: " + path + ": " + record['error'])
+                continue
+
+            if args.worldfile:
+                writeatomic(worldfilepath(path), tfwparse(GeoReference(*record['georeference'])))
+
+            if catalog is not None and not catalog.addrecord(record):
+                Warn("Warning: No footprint for " + path)
+
+            processed.append(path)
+
+        if catalog is not None:
+            catalog.commit()
+
+        return processed
+
+    def remove(paths):
+
+        for path in paths:
+            if args.worldfile and os.path.isfile(worldfilepath(path)):
+                os.unlink(worldfilepath(path))
+            if catalog is not None:
+                catalog.remove(path)
+
+        if catalog is not None:
+            catalog.commit()
+        if cache is not None:
+            cache.invalidate(paths)
+
+    # Stop cleanly on termination as on interrupt
+    import signal
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        watch(args.directories, process, remove, args.statefile, args.settle,
+              args.polling, args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if catalog is not None:
+            catalog.close()
+        if cache is not None:
+            cache.close()
+        if o is not None:
+            o.close()
+
+    return 0
+
+# Exits with status 1 if any file failed or names collide
+#
+def renamemain(argv):
+
+    args = renameargumentparser().parse_args(argv)
+    scanlimits(args)
+
+    # Journal: the plan as the first line, then passes done, see applyrenames
+    if args.resume or args.rollback:
+        plan, passes = readjournal(args.journal)
+        if 'rollback' in passes:
+            raise ValueError("Error: Rename has been rolled back: " + args.journal)
+        if args.rollback:
+            rollbackrenames(args.journal, plan['moves'], passes, plan.get('directories', []))
+            print(str(len(plan['moves'])) + ' files restored')
+        else:
+            applyrenames(args.journal, plan['moves'], passes)
+            print(str(len(plan['moves'])) + ' files renamed')
+        return 0
+
+    if args.template is None:
+        raise ValueError("Error: No template specified")
+
+    if os.path.lexists(args.journal) and not args.dryrun:
+        raise ValueError("Error: Journal file exists, resume, roll back or remove it: " + args.journal)
+
+    renames = []
+    failed = 0
+
+    for path, newpath, error in poolmap(renamechunk, batchpaths(args.inputs), args.workers, args.chunksize,
+                                        args.template, args.scanwindow, args.scanmemory):
+        if error is not None:
+            Warn("Warning: " + path + ": " + error)
+            failed += 1
+        else:
+            renames.append((path, newpath))
+
+    moves, collisions = renameplan(renames)
+
+    if len(collisions) > 0:
+        for target, sources in collisions:
+            Warn("Warning: " + target + " is taken: " + ', '.join(sources))
+        raise ValueError("Error: " + str(len(collisions)) + " name collisions, nothing renamed")
+
+    if args.dryrun:
+        for source, temppath, target in moves:
+            print(source + ' -> ' + target)
+        return 1 if failed > 0 else 0
+
+    with atomicfile(args.journal) as o:
+        journalwrite(o, { 'template': args.template, 'moves': moves, 'directories': renamedirectories(moves) })
+
+    applyrenames(args.journal, moves)
+
+    images = len([ path for path, newpath in renames if os.path.abspath(path) != os.path.abspath(newpath) ])
+    print(str(images) + ' files renamed, ' + str(len(moves) - images) + ' sidecars moved, ' + str(failed) + ' failed')
+
+    return 1 if failed > 0 else 0
+
+def servemain(argv):
+
+    args = serveargumentparser().parse_args(argv)
+    scanlimits(args)
+
+    if not os.path.isdir(args.root):
+        raise ValueError("Error: Not a directory: " + args.root)
+
+    registry = None
+    if args.registry is not None:
+        registry = CRSRegistry(args.registry)
+
+    documents = DocumentLRU(args.entries, args.memory * 1024 * 1024, args.scanwindow, args.scanmemory)
+    server = httpserver(servehandler(MetadataServer(args.root, documents, registry)),
+                        args.socketpath, args.host, args.port)
+
+    # Stop cleanly on termination as on interrupt
+    import signal
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socketpath is not None:
+            os.unlink(args.socketpath)
+        if registry is not None:
+            registry.close()
+
+    return 0
+
+def cachemain(argv):
+
+    args = cacheargumentparser().parse_args(argv)
+    cachelimits(args)
+
+    cache = GMLCache(args.cachefile)
+
+    try:
+        if args.action == 'invalidate':
+            cache.invalidate(args.paths if len(args.paths) > 0 else None)
+
+        elif args.action == 'evict':
+            if args.cachesize is None:
+                raise ValueError("Error: No cache size specified")
+            cache.evict(args.cachesize)
+
+        print(json.dumps(cache.stats(), indent=2, sort_keys=True))
+
+    finally:
+        cache.close()
+
+    return 0
+
+def epsgmain(argv):
+
+    args = epsgargumentparser().parse_args(argv)
+
+    registry = CRSRegistry(args.registry, fetchurl = args.fetchurl)
+
+    try:
+        if args.action == 'import':
+            for directory in args.arguments:
+                print(str(registry.importdir(directory)) + ' files imported from ' + directory)
+
+        elif args.action == 'get':
+            for code in args.arguments:
+                definition = registry.get_crs(int(code))
+                if definition is None:
+                    Warn("Warning: Unknown EPSG code " + code)
+                    continue
+                print(json.dumps(definition.todict(), indent=2, sort_keys=True))
+
+        elif args.action == 'list':
+            for code in registry.codes():
+                print(code)
+
+    finally:
+        registry.close()
+
+    return 0
+
+# Commands given as the first argument
+#
+commands = {
+    'batch':     batchmain,
+    'cache':     cachemain,
+    'catalog':   catalogmain,
+    'epsg':      epsgmain,
+    'gazetteer': gazetteermain,
+    'rename':    renamemain,
+    'serve':     servemain,
+    'sidecars':  sidecarsmain,
+    'summary':   summarymain,
+    'update':    updatemain,
+    'watch':     watchmain
+}
+
+def main(argv = None):
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if len(argv) > 0 and argv[0] in commands:
+        return commands[argv[0]](argv[1:])
+
+    argparser = argumentparser()
+
+    if not len(argv) > 0:
+        argparser.print_help()
+        return 0
+
+    args = argparser.parse_args(argv)
+
+    # Formatting defaults to pretty format
+    #
+    if args.formatting is None:
+        args.formatting = 'pretty'
+
+    scanlimits(args)
+    cachelimits(args)
+
+    if args.inputfile is None:
+        raise ValueError("Error: No input file specified")
+
+    if not args.inputfile.endswith('.jp2'):
+        Warn("Warning: Not a valid JPEG2000 file suffix")
+
+    if args.outputformat is None:
+        raise ValueError("Error: No output format or file specified")
+
+    elif args.outputformat not in output_formats:
+        raise ValueError("Error: Not a valid output format")
+
+    cache = None
+    if args.cachefile is not None:
+        cache = GMLCache(args.cachefile, args.cachesize)
+
+    gazetteer = loadgazetteer(args)
+    registry = loadregistry(args)
+    profiler = recordprofiler(profilerequested(args), args.allocations)
+
+    # JSON is written in chunks as it is converted, see GMLJSONConverter
+    output = None
+
+    try:
+        with profiling(profiler):
+            if args.box is None:
+                document = read_gml(args.inputfile, window = args.scanwindow, maxmemory = args.scanmemory, cache = cache)
+            else:
+                document = BoxTable.read(args.inputfile).document(args.box)
+
+            if args.outputformat != 'json':
+                output = render(document, args.outputformat, args.formatting, gazetteer, args.maxdistance, registry)
+            elif args.outputfile is None:
+                document.write_json(sys.stdout, args.formatting)
+                sys.stdout.write('\n')
+            else:
+                with atomicfile(args.outputfile) as o:
+                    document.write_json(o, args.formatting)
+
+        if cache is not None:
+            cache.put(document)
+
+    finally:
+        if cache is not None:
+            cache.close()
+
+    if profiler is not None:
+        stats = profiler.stats()
+        writeprofile(args, { 'stages': stats }, profiletable(stats))
+
+    if output is None:
+        pass
+    elif args.outputfile is None:
+        print(output)
     else:
-        raise ValueError("Error: invalid data format")
+        writeatomic(args.outputfile, output)
+
+    return 0
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+
+    # Output closed early by the reader, e.g. head. Standard output is
+    # pointed to /dev/null, so that flushing it at exit does not fail too.
+    except BrokenPipeError:
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# Batch processing, in worker processes and asynchronously
+
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+
+import gmlbench
+from gmlparser import batch, runasyncbatch
+
+def path(record):
+    return record['path']
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = []
+
+        for i in range(12):
+            path = os.path.join(self.directory, 'tile_{:02d}.jp2'.format(i))
+            gmlbench.writejp2(path, gmlbench.gmldocument(members = 1 + i % 3, x_low = 380000 + i * 6000),
+                              position = 'before' if i % 2 else 'after')
+            self.paths.append(path)
+
+        # Not a JPEG2000 file, and a missing file
+        with open(os.path.join(self.directory, 'broken.jp2'), 'wb') as o:
+            o.write(b'not a JPEG2000 file')
+        self.paths.insert(3, os.path.join(self.directory, 'broken.jp2'))
+        self.paths.insert(7, os.path.join(self.directory, 'missing.jp2'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check(self, records):
+        self.assertEqual(sorted([ record['path'] for record in records ]), sorted(self.paths))
+        for record in records:
+            name = os.path.basename(record['path'])
+            if name in ('broken.jp2', 'missing.jp2'):
+                self.assertIsNotNone(record['error'])
+                self.assertIsNone(record['georeference'])
+            else:
+                self.assertIsNone(record['error'])
+                i = int(name[5:7])
+                self.assertEqual(record['georeference'][4], 380000 + i * 6000 + 0.25)
+                self.assertEqual(record['srs'], 'urn:ogc:def:crs:EPSG::3067')
+
+    # Ordered and unordered records are the same, with and without parser processes
+    def test_async(self):
+        expected = None
+        for parsers in (0, 2):
+            ordered = list(runasyncbatch(self.paths, inflight = 4, parsers = parsers, ordered = True))
+            unordered = list(runasyncbatch(self.paths, inflight = 4, parsers = parsers, ordered = False))
+
+            self.assertEqual([ record['path'] for record in ordered ], self.paths)
+            self.check(ordered)
+            self.check(unordered)
+
+            self.assertEqual(sorted(unordered, key = path), sorted(ordered, key = path))
+
+            if expected is None:
+                expected = ordered
+            self.assertEqual(ordered, expected)
+
+    # Records of worker processes are the same as asynchronous ones
+    def test_workers(self):
+        records = list(batch(self.paths, workers = 2, chunksize = 3))
+        self.check(records)
+        self.assertEqual(sorted(records, key = path), sorted(runasyncbatch(self.paths, parsers = 0), key = path))
+
+    # Stopping early leaves no work running
+    def test_close(self):
+        records = runasyncbatch(self.paths, inflight = 2, parsers = 1)
+        next(records)
+        records.close()
+
+if __name__ == '__main__':
+    unittest.main()
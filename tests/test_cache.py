@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# On-disk metadata cache
+
+import os
+import os.path
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+
+import gmlbench
+from gmlparser import GMLCache, read_gml, updategml
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'tile.jp2')
+        gmlbench.writejp2(self.path, gmlbench.gmldocument())
+        self.cachefile = os.path.join(self.directory, 'cache.db')
+        self.cache = GMLCache(self.cachefile)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.directory)
+
+    # Read a file through the cache, and store what was computed
+    def read(self):
+        document = read_gml(self.path, cache = self.cache)
+        document.to_info()
+        self.cache.put(document)
+        return document
+
+    def counts(self):
+        return dict([ (name, self.cache.counts[name]) for name in GMLCache.counters ])
+
+    def test_hit(self):
+        self.read()
+        self.assertEqual(self.counts(), { 'hits': 0, 'hashhits': 0, 'misses': 1 })
+
+        document = self.read()
+        self.assertEqual(self.counts(), { 'hits': 1, 'hashhits': 0, 'misses': 1 })
+
+        # Cached values are used without parsing GML data again
+        self.assertIsNotNone(document.gml_posinfo)
+        self.assertEqual(document.parser.parsecount, 0)
+        self.assertEqual(document.georef().c, 380000.25)
+
+    # Touched file with the same GML data is found by hash
+    def test_touched(self):
+        self.read()
+        st = os.stat(self.path)
+        os.utime(self.path, ns = (st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        self.read()
+        self.assertEqual(self.counts(), { 'hits': 0, 'hashhits': 1, 'misses': 1 })
+
+    # Changed GML data is read again
+    def test_changed(self):
+        self.read()
+        st = os.stat(self.path)
+        updategml(self.path, lambda gml: gml.replace('380000.25 6675999.75', '380100.25 6675999.75'))
+        os.utime(self.path, ns = (st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        document = self.read()
+        self.assertEqual(self.counts(), { 'hits': 0, 'hashhits': 0, 'misses': 2 })
+        self.assertEqual(document.georef().c, 380100.25)
+
+    def test_invalidate(self):
+        self.read()
+        self.cache.invalidate([ self.directory ])
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        self.read()
+        self.assertEqual(self.counts(), { 'hits': 0, 'hashhits': 0, 'misses': 2 })
+
+    # Caches of other schema versions are cleared
+    def test_version(self):
+        self.read()
+        self.cache.close()
+        db = sqlite3.connect(self.cachefile)
+        db.execute('PRAGMA user_version = 1')
+        db.commit()
+        db.close()
+        self.cache = GMLCache(self.cachefile)
+        self.assertEqual(self.cache.stats()['files'], 0)
+        self.read()
+        self.assertEqual(self.counts(), { 'hits': 0, 'hashhits': 0, 'misses': 1 })
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+# Tile catalog: R*Tree build and queries
+
+import contextlib
+import io
+import json
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+
+import gmlbench
+from gmlparser import TileCatalog, catalogmain
+
+script = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'gmlparser.py')
+
+# Batch record of a tile of 1000 x 1000 map units
+def record(path, srs, x, y):
+    return { 'path': path, 'srs': srs, 'error': None, 'georeference': None,
+             'extent': { 'lower': [ x, y ], 'upper': [ x + 1000, y + 1000 ] } }
+
+class CatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.catalogfile = os.path.join(self.directory, 'tiles.db')
+
+        # 4 x 4 tiles in TM35FIN, and one tile in ETRS-GK25FIN
+        # (named in another form) at the same coordinates
+        self.records = os.path.join(self.directory, 'records.jsonl')
+        with open(self.records, 'w') as o:
+            for i in range(4):
+                for j in range(4):
+                    o.write(json.dumps(record('/tiles/tm35_{}_{}.jp2'.format(i, j), 'urn:ogc:def:crs:EPSG::3067',
+                                              380000 + i * 1000, 6670000 + j * 1000)) + '\n')
+            o.write(json.dumps(record('/tiles/gk25.jp2', 'http://www.opengis.net/def/crs/EPSG/0/3879',
+                                      380000, 6670000)) + '\n')
+            o.write(json.dumps(dict(record('/tiles/bad.jp2', None, 0, 0), error = 'Error', extent = None)) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def main(self, argv):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            status = catalogmain(argv)
+        return status, output.getvalue().splitlines()
+
+    def query(self, *argv):
+        status, lines = self.main([ 'query', self.catalogfile ] + list(argv))
+        self.assertEqual(status, 0)
+        return [ (tile['path'], tile['srs']) for tile in map(json.loads, lines) ]
+
+    def build(self):
+        with self.assertWarns(UserWarning):
+            status, lines = self.main([ 'build', self.catalogfile, '--records', self.records ])
+        self.assertEqual(lines, [ '17 tiles added, 1 failed' ])
+
+    def test_build(self):
+        self.build()
+        catalog = TileCatalog(self.catalogfile)
+        try:
+            self.assertEqual(catalog.db.execute('SELECT COUNT(*) FROM footprints').fetchone()[0], 17)
+            self.assertEqual(sorted(catalog.srsids), [ 'EPSG:3067', 'EPSG:3879' ])
+        finally:
+            catalog.close()
+
+        # Building again replaces tiles
+        self.build()
+        self.assertEqual(len(self.query('--bbox', '0', '0', '1e7', '1e7')), 17)
+
+    def test_point(self):
+        self.build()
+        self.assertEqual(self.query('--point', '381500', '6672500', '--srs', 'EPSG:3067'),
+                         [ ('/tiles/tm35_1_2.jp2', 'EPSG:3067') ])
+
+        # Points on tile edges are in all tiles sharing the edge
+        self.assertEqual(len(self.query('--point', '381000', '6672000', '--srs', 'EPSG:3067')), 4)
+
+        self.assertEqual(self.query('--point', '390000', '6672500', '--srs', 'EPSG:3067'), [])
+
+    def test_bbox(self):
+        self.build()
+        tiles = self.query('--bbox', '380500', '6670500', '381500', '6670600', '--srs', 'EPSG:3067')
+        self.assertEqual(tiles, [ ('/tiles/tm35_0_0.jp2', 'EPSG:3067'), ('/tiles/tm35_1_0.jp2', 'EPSG:3067') ])
+
+    # --srs selects tiles of one reference system, named in any form.
+    # Without it, the box is taken in each reference system.
+    def test_srs(self):
+        self.build()
+        point = [ '--point', '380500', '6670500' ]
+        self.assertEqual(self.query(*point), [ ('/tiles/tm35_0_0.jp2', 'EPSG:3067'), ('/tiles/gk25.jp2', 'EPSG:3879') ])
+        for srsname in ('EPSG:3879', 'urn:ogc:def:crs:EPSG::3879', 'http://www.opengis.net/def/crs/EPSG/0/3879'):
+            self.assertEqual(self.query(*(point + [ '--srs', srsname ])), [ ('/tiles/gk25.jp2', 'EPSG:3879') ])
+        self.assertEqual(self.query(*(point + [ '--srs', 'EPSG:3067' ])), [ ('/tiles/tm35_0_0.jp2', 'EPSG:3067') ])
+        self.assertEqual(self.query(*(point + [ '--srs', 'EPSG:4326' ])), [])
+
+    # Tiles of JPEG2000 files
+    def test_build_files(self):
+        path = os.path.join(self.directory, 'tile.jp2')
+        gmlbench.writejp2(path, gmlbench.gmldocument())
+        self.main([ 'build', self.catalogfile, path, '-w', '1' ])
+        self.assertEqual(self.query('--point', '381000', '6671000'), [ (path, 'EPSG:3067') ])
+
+    # Output closed by the reader
+    def test_broken_pipe(self):
+        with open(self.records, 'w') as o:
+            for i in range(5000):
+                o.write(json.dumps(record('/tiles/{}.jp2'.format(i), 'EPSG:3067', i * 1000, 0)) + '\n')
+        self.main([ 'build', self.catalogfile, '--records', self.records ])
+
+        process = subprocess.Popen([ sys.executable, script, 'catalog', 'query', self.catalogfile,
+                                     '--bbox', '0', '0', '1e7', '1e7' ],
+                                   stdout = subprocess.PIPE, stderr = subprocess.PIPE, bufsize = 0)
+        process.stdout.read(1)
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.wait()
+        self.assertNotIn(b'Traceback', stderr)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+# Output formats of a GML document
+
+import os.path
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+
+from gmlparser import GMLDocument, Profiler, documentrecord, newrecord, profiling, templatefields
+
+gml = '''<?xml version="1.0" encoding="UTF-8"?>
+<gml:FeatureCollection xmlns:gml="http://www.opengis.net/gml">
+  <gml:boundedBy>
+    <gml:Envelope srsName="urn:ogc:def:crs:EPSG::3067">
+      <gml:lowerCorner>380000 6670000</gml:lowerCorner>
+      <gml:upperCorner>386000 6676000</gml:upperCorner>
+    </gml:Envelope>
+  </gml:boundedBy>
+  <gml:featureMember>
+    <gml:RectifiedGridCoverage dimension="2" gml:id="RGC0001">
+      <gml:rectifiedGridDomain>
+        <gml:RectifiedGrid dimension="2">
+          <gml:limits>
+            <gml:GridEnvelope>
+              <gml:low>0 0</gml:low>
+              <gml:high>11999 11999</gml:high>
+            </gml:GridEnvelope>
+          </gml:limits>
+          <gml:axisName>x</gml:axisName>
+          <gml:axisName>y</gml:axisName>
+          <gml:origin>
+            <gml:Point gml:id="P0001" srsName="urn:ogc:def:crs:EPSG::3067">
+              <gml:pos>380000.25 6675999.75</gml:pos>
+            </gml:Point>
+          </gml:origin>
+          <gml:offsetVector srsName="urn:ogc:def:crs:EPSG::3067">0.5 0</gml:offsetVector>
+          <gml:offsetVector srsName="urn:ogc:def:crs:EPSG::3067">0 -0.5</gml:offsetVector>
+        </gml:RectifiedGrid>
+      </gml:rectifiedGridDomain>
+      <gml:rangeSet>
+        <gml:File>
+          <gml:fileName>gmljp2://codestream/0</gml:fileName>
+          <gml:fileStructure>Record Interleaved</gml:fileStructure>
+        </gml:File>
+      </gml:rangeSet>
+    </gml:RectifiedGridCoverage>
+  </gml:featureMember>
+</gml:FeatureCollection>
+'''
+
+class ParseCountTest(unittest.TestCase):
+
+    # GML data is parsed once for all output formats
+    def test_single_parse(self):
+        document = GMLDocument('image.jp2', gml)
+        for formatting in ('raw', 'pretty'):
+            document.to_xml(formatting)
+            document.to_json(formatting)
+        document.to_info()
+        document.to_worldfile()
+        self.assertEqual(document.parser.parsecount, 1)
+
+    # Worldfile values are extracted without parsing
+    def test_worldfile_without_parse(self):
+        document = GMLDocument('image.jp2', gml)
+        self.assertEqual(document.to_worldfile().split(), [ '0.5', '0.0', '0.0', '-0.5', '380000.25', '6675999.75' ])
+        self.assertEqual(document.parser.parsecount, 0)
+
+class TraversalTest(unittest.TestCase):
+
+    # Stages passing over GML data, and the number of passes
+    def traversals(self, function):
+        document = GMLDocument('image.jp2', gml)
+        profiler = Profiler()
+        with profiling(profiler):
+            function(document)
+        return dict([ (stage, counters['traversals']) for stage, counters in profiler.stats().items()
+                      if stage in ('stream', 'parse', 'json') and counters['traversals'] > 0 ])
+
+    # A batch record takes a single parse
+    def test_batch_record(self):
+        self.assertEqual(self.traversals(lambda document: documentrecord(document, newrecord(document.path))),
+                         { 'parse': 1 })
+
+    def test_template_fields(self):
+        self.assertEqual(self.traversals(templatefields), { 'parse': 1 })
+
+    # Worldfile values alone take a single stream pass
+    def test_worldfile(self):
+        self.assertEqual(self.traversals(lambda document: document.to_worldfile()), { 'stream': 1 })
+
+class GeoReferenceTest(unittest.TestCase):
+
+    # Envelope in another reference system after the grid. Sorted by
+    # name, boundedBy would come before featureMember.
+    envelope = gml[gml.index('  <gml:boundedBy>'):gml.index('  <gml:featureMember>')]
+    reordered = gml.replace(envelope, '').replace(
+        '</gml:FeatureCollection>', envelope.replace('EPSG::3067', 'EPSG::3879') + '</gml:FeatureCollection>')
+
+    # srsName is the first one in document order, whether
+    # the tree has been parsed or not
+    def test_srs_document_order(self):
+        streamed = GMLDocument('image.jp2', self.reordered)
+        parsed = GMLDocument('image.jp2', self.reordered)
+        parsed.tree()
+        self.assertEqual(streamed.georef().srs, 3067)
+        self.assertEqual(parsed.georef().srs, 3067)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+# Nearest place names from a gazetteer index
+
+import contextlib
+import io
+import json
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+
+import numpy
+
+from gmlparser import Gazetteer, gazetteermain
+
+# GeoNames TSV columns: geonameid, name, asciiname, alternatenames,
+# latitude, longitude, feature class, feature code, country code,
+# cc2, admin1-4, population
+places = [
+    ('Helsinki',  60.16952, 24.93545, 'P', 'FI', 658864),
+    ('Espoo',     60.2052,  24.6522,  'P', 'FI', 269802),
+    ('Tampere',   61.49911, 23.78712, 'P', 'FI', 244223),
+    ('Tallinn',   59.43696, 24.75353, 'P', 'EE', 394024),
+    ('Nuuksio',   60.3,     24.5,     'L', 'FI', 0),
+    ('Kylä',      60.5,     25.5,     'P', 'FI', 10),
+]
+
+class GazetteerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.tsv = os.path.join(self.directory, 'places.txt')
+        with open(self.tsv, 'w', encoding = 'utf-8') as o:
+            for i, (name, lat, lon, featureclass, country, population) in enumerate(places):
+                o.write('\t'.join([ str(i), name, name, '', str(lat), str(lon), featureclass, 'PPL', country,
+                                    '', '', '', '', '', str(population), '', '', 'Europe/Helsinki', '' ]) + '\n')
+        self.index = os.path.join(self.directory, 'places.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def build(self, *argv):
+        with contextlib.redirect_stdout(io.StringIO()):
+            gazetteermain([ 'build' ] + list(argv) + [ self.tsv, self.index ])
+        return Gazetteer.load(self.index)
+
+    def query(self, *argv):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            status = gazetteermain([ 'query' ] + list(argv))
+        return status, output.getvalue().strip()
+
+    # Saved arrays are loaded memory mapped
+    def test_load(self):
+        gazetteer = self.build()
+        self.assertEqual(len(gazetteer.cells), 5)
+        self.assertIsInstance(gazetteer.vectors, numpy.memmap)
+        names = sorted([ gazetteer.name(i) for i in range(len(gazetteer.cells)) ])
+        self.assertEqual(names, [ 'Espoo', 'Helsinki', 'Kylä', 'Tallinn', 'Tampere' ])
+
+    def test_nearest(self):
+        gazetteer = self.build('--cell-size', '5')
+        found, distances = gazetteer.nearest([ 60.17, 61.5, 59.44, 70.0 ], [ 24.94, 23.8, 24.75, 25.0 ], maxdistance = 100)
+        self.assertEqual([ gazetteer.name(i) for i in found[:3] ], [ 'Helsinki', 'Tampere', 'Tallinn' ])
+        self.assertTrue(numpy.all(distances[:3] < 1))
+        self.assertEqual(found[3], -1)
+        self.assertTrue(numpy.isnan(distances[3]))
+
+        place = gazetteer.place(found[0], distances[0])
+        self.assertEqual((place['country'], place['population']), ('FI', 658864))
+
+    # Between Helsinki and Tallinn, 80 km from Helsinki
+    def test_max_distance(self):
+        self.build()
+        status, output = self.query(self.index, '59.45', '24.9')
+        self.assertEqual((status, json.loads(output)['name']), (0, 'Tallinn'))
+
+        status, output = self.query('--max-distance', '50', self.index, '59.9', '24.95')
+        self.assertEqual((status, json.loads(output)['name']), (0, 'Helsinki'))
+
+        status, output = self.query('--max-distance', '20', self.index, '59.9', '24.95')
+        self.assertEqual((status, output), (1, 'No place found'))
+
+    def test_min_population(self):
+        gazetteer = self.build('--min-population', '100000')
+        found, distances = gazetteer.nearest([ 60.5 ], [ 25.5 ], maxdistance = 1000)
+        self.assertEqual(gazetteer.name(found[0]), 'Helsinki')
+
+if __name__ == '__main__':
+    unittest.main()
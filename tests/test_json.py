@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+# JSON streamed from GML data is identical to JSON of the parsed tree
+
+import io
+import json
+import os.path
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+
+import xmltodict
+
+import gmlbench
+from gmlparser import GMLJSONConverter, gmljson
+
+documents = [
+    # Attributes, repeated elements and text with attributes
+    gmlbench.gmldocument(members = 3).decode('utf-8'),
+    gmlbench.gmldocument(coordinates = True).decode('utf-8'),
+    '<a/>',
+    '<a>text</a>',
+    '<a x="1"/>',
+    '<a x="1">text</a>',
+    '<a><b>1</b><b>2</b><c/><b x="3"/></a>',
+    '<a><b/><b/></a>',
+    '<a> <b>  spaced  </b> tail <c>x</c> more </a>',
+    '<a z="1" a="2"><z>1</z><a>2</a><m/></a>',
+    # Non-ASCII text and attributes, escapes
+    '<a name="Hämeenlinna ©">Åland — “quoted” \\ "x" &amp; &lt;tag&gt;</a>',
+    '<a><b>\U0001F30D</b><b>\t\n</b></a>',
+    '<?xml version="1.0" encoding="UTF-8"?>\n<gml:a xmlns:gml="http://www.opengis.net/gml"><gml:b gml:id="x">1</gml:b></gml:a>',
+]
+
+class StreamingJSONTest(unittest.TestCase):
+
+    def stream(self, data, pretty):
+        o = io.StringIO()
+        gmljson(data, o, pretty)
+        return o.getvalue()
+
+    def test_raw(self):
+        for data in documents:
+            with self.subTest(data = data[:40]):
+                self.assertEqual(self.stream(data, False),
+                                 json.dumps(xmltodict.parse(data), separators=(',', ':')))
+
+    def test_pretty(self):
+        for data in documents:
+            with self.subTest(data = data[:40]):
+                self.assertEqual(self.stream(data, True),
+                                 json.dumps(xmltodict.parse(data), indent=2, sort_keys=True))
+
+    # chunks() gives the same output in chunks of any size
+    def test_chunks(self):
+        from xml.parsers import expat
+        data = documents[0]
+        for chunksize in (1, 7, 4096):
+            converter = GMLJSONConverter(pretty = True)
+            parser = expat.ParserCreate('utf-8')
+            parser.ordered_attributes = True
+            parser.buffer_text = True
+            parser.StartElementHandler = converter.start
+            parser.EndElementHandler = converter.end
+            parser.CharacterDataHandler = converter.characters
+            parser.Parse(data.encode('utf-8'), True)
+            chunks = list(converter.chunks(chunksize))
+            self.assertTrue(all([ len(chunk) <= chunksize for chunk in chunks ]))
+            self.assertEqual(''.join(chunks), json.dumps(xmltodict.parse(data), indent=2, sort_keys=True))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+# Accuracy of Transverse Mercator projections against reference points
+
+import os.path
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+
+import numpy
+
+from gmlparser import TransverseMercator, builtinprojection, geographicpoints
+
+# Tolerances: 1 cm in map coordinates, about 1 mm in degrees
+map_tolerance = 0.01
+degree_tolerance = 1e-8
+
+class TransverseMercatorTest(unittest.TestCase):
+
+    # OSGB 1936 / British National Grid, IOGP Guidance Note 7-2 example
+    def test_british_national_grid(self):
+        projection = TransverseMercator(6377563.396, 299.3249646, 49, -2, 0.9996012717, 400000, -100000)
+        easting, northing = projection.forward(50.5, 0.5)
+        self.assertAlmostEqual(float(easting), 577274.99, delta = map_tolerance)
+        self.assertAlmostEqual(float(northing), 69740.50, delta = map_tolerance)
+
+    # ETRS89 / ETRS-TM35FIN, on the central meridian
+    def test_tm35fin(self):
+        projection = builtinprojection(3067)
+        easting, northing = projection.forward(60, 27)
+        self.assertAlmostEqual(float(easting), 500000, delta = map_tolerance)
+        self.assertAlmostEqual(float(northing), 6651411.19, delta = map_tolerance)
+
+    # Inverse of forward is the identity, up to 3 degrees off the central meridian
+    def test_round_trip(self):
+        lat, lon = numpy.meshgrid(numpy.linspace(-80, 80, 33), numpy.linspace(24, 30, 13))
+        for code in (3067, 32635, 32735, 3879):
+            projection = builtinprojection(code)
+            meridian = projection.longitude0
+            latback, lonback = projection.inverse(*projection.forward(lat, lon - 27 + meridian))
+            self.assertLess(numpy.max(numpy.abs(latback - lat)), degree_tolerance)
+            self.assertLess(numpy.max(numpy.abs(lonback - (lon - 27 + meridian))), degree_tolerance)
+
+    # Map coordinates in the axis order of each reference system name
+    def test_geographic_points(self):
+        easting, northing = builtinprojection(3067).forward(60, 27)
+        lat, lon = geographicpoints(
+            [ 'urn:ogc:def:crs:EPSG::3067', 'urn:ogc:def:crs:EPSG::5048', 'urn:ogc:def:crs:EPSG::1' ],
+            [ (easting, northing), (northing, easting), (0, 0) ])
+        numpy.testing.assert_allclose(lat[:2], [ 60, 60 ], atol = degree_tolerance)
+        numpy.testing.assert_allclose(lon[:2], [ 27, 27 ], atol = degree_tolerance)
+        self.assertTrue(numpy.isnan(lat[2]) and numpy.isnan(lon[2]))
+
+if __name__ == '__main__':
+    unittest.main()
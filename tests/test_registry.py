@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+# EPSG registry, offline
+
+import contextlib
+import io
+import json
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+
+from gmlparser import CRSRegistry, summarymain
+
+epsgdirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'epsg')
+
+srsnames = [
+    'urn:ogc:def:crs:EPSG::3067',
+    'urn:ogc:def:crs:EPSG:6.18:3067',
+    'http://www.opengis.net/def/crs/EPSG/0/3067',
+    'EPSG:3067',
+]
+
+class RegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'epsg.db')
+
+        registry = CRSRegistry(self.path)
+        self.assertEqual(registry.importdir(epsgdirectory), 2)
+        registry.close()
+
+        self.registry = CRSRegistry(self.path)
+
+    def tearDown(self):
+        self.registry.close()
+        shutil.rmtree(self.directory)
+
+    def test_resolve(self):
+        for srsname in srsnames:
+            with self.subTest(srsname = srsname):
+                definition = self.registry.resolve(srsname)
+                self.assertEqual(definition.code, 3067)
+                self.assertEqual(definition.name, 'ETRS89 / TM35FIN(E,N)')
+                self.assertEqual(definition.method, 9807)
+                self.assertTrue(definition.wkt.startswith('PROJCS'))
+
+        # Names of the same code share a cached definition
+        info = self.registry.get_crs.cache_info()
+        self.assertEqual((info.misses, info.hits), (1, len(srsnames) - 1))
+
+    def test_unknown(self):
+        self.assertIsNone(self.registry.resolve('EPSG:4326'))
+        self.assertIsNone(self.registry.resolve('urn:ogc:def:crs:OGC:1.3:CRS84'))
+        self.assertIsNone(self.registry.resolve(None))
+
+    def test_canonical(self):
+        for srsname in srsnames:
+            self.assertEqual(CRSRegistry.canonical(srsname), 'EPSG:3067')
+        self.assertEqual(CRSRegistry.canonical('LOCAL'), 'LOCAL')
+        self.assertIsNone(CRSRegistry.canonical(None))
+
+    # Summaries are keyed by canonical names
+    def test_summary(self):
+        records = os.path.join(self.directory, 'records.jsonl')
+        with open(records, 'w') as o:
+            for i, srsname in enumerate(srsnames):
+                o.write(json.dumps({ 'path': str(i), 'srs': srsname, 'error': None,
+                                     'extent': { 'lower': [ i * 1000, 0 ], 'upper': [ i * 1000 + 1000, 1000 ] } }) + '\n')
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            summarymain([ records ])
+
+        self.assertEqual(list(json.loads(output.getvalue())), [ 'EPSG:3067' ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# Reading remote files with HTTP range requests from a local server
+
+import http.server
+import os.path
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+
+import gmlbench
+import gmlparser
+
+# Files of a directory over HTTP. Range requests are answered unless
+# the server is told to ignore them. Bytes sent are counted.
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+
+        path = os.path.join(self.server.directory, self.path.lstrip('/'))
+        size = os.path.getsize(path)
+
+        match = re.match(r'bytes=(\d+)-(\d+)$', self.headers.get('Range', ''))
+        start, end = 0, size - 1
+
+        if match is not None and not self.server.ignorerange:
+            start, end = int(match.group(1)), min(int(match.group(2)), size - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, size))
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Length', str(end + 1 - start))
+        self.send_header('ETag', '"' + str(os.stat(path).st_mtime_ns) + '"')
+        self.end_headers()
+
+        try:
+            with open(path, 'rb') as f:
+                f.seek(start)
+                remaining = end + 1 - start
+                while remaining > 0:
+                    data = f.read(min(remaining, 64 * 1024))
+                    self.wfile.write(data)
+                    self.server.sent += len(data)
+                    remaining -= len(data)
+        except OSError:
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+class RemoteTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+        gmlbench.writejp2(os.path.join(self.directory, 'tile.jp2'), gmlbench.gmldocument(),
+                          codestream = 64 * 1024 ** 2)
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+        self.server.daemon_threads = True
+        self.server.directory = self.directory
+        self.server.ignorerange = False
+        self.server.sent = 0
+
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        self.url = 'http://127.0.0.1:{}/tile.jp2'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        gmlparser.remotepool().close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    # Only the header and metadata are transferred
+    def test_range_requests(self):
+        document = gmlparser.read_gml(self.url)
+        self.assertEqual(document.to_worldfile().split(), [ '0.5', '0.0', '0.0', '-0.5', '380000.25', '6675999.75' ])
+        self.assertEqual(document.identity[0], os.path.getsize(os.path.join(self.directory, 'tile.jp2')))
+        self.assertLess(self.server.sent, 64 * 1024)
+
+    # The whole file is not read from servers ignoring Range
+    def test_range_ignored(self):
+        self.server.ignorerange = True
+        with self.assertRaises(ValueError):
+            gmlparser.read_gml(self.url)
+        self.assertLess(self.server.sent, 16 * 1024 ** 2)
+
+if __name__ == '__main__':
+    unittest.main()
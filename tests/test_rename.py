@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+# Renaming tiles from their GML data, with sidecars and a journal
+
+import contextlib
+import io
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+
+import gmlbench
+from gmlparser import readjournal, renamemain, renameplan
+
+class RenameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.journal = os.path.join(self.directory, 'rename.jsonl')
+
+        # Two tiles of 6 km side by side, the first one with sidecars
+        self.tiles = []
+        for num, x_low in enumerate((380000, 386000)):
+            path = os.path.join(self.directory, 'tile' + str(num) + '.jp2')
+            gmlbench.writejp2(path, gmlbench.gmldocument(x_low = x_low))
+            self.tiles.append(path)
+
+        for suffix in ('.tfw', '.prj'):
+            with open(os.path.join(self.directory, 'tile0' + suffix), 'w') as o:
+                o.write(suffix)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def files(self):
+        return sorted(name for name in os.listdir(self.directory) if name != 'rename.jsonl')
+
+    def main(self, *argv):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            status = renamemain(list(argv) + [ '--journal', self.journal, '-w', '1' ])
+        return status, output.getvalue().splitlines()
+
+    def test_plan(self):
+        moves, collisions = renameplan([ (self.tiles[0], self.path('a.jp2')), (self.tiles[1], self.tiles[1]) ])
+
+        self.assertEqual(collisions, [])
+        self.assertEqual([ (source, target) for source, temppath, target in moves ],
+                         [ (self.tiles[0], self.path('a.jp2')),
+                           (self.path('tile0.tfw'), self.path('a.tfw')),
+                           (self.path('tile0.prj'), self.path('a.prj')) ])
+        self.assertEqual(moves[0][1], self.path('.tile0.jp2.renaming'))
+
+    def test_plan_collisions(self):
+        # Same target for both tiles, and an existing file not renamed away
+        moves, collisions = renameplan([ (self.tiles[0], self.path('a.jp2')), (self.tiles[1], self.path('a.jp2')) ])
+        self.assertEqual(collisions, [ (self.path('a.jp2'), self.tiles) ])
+
+        moves, collisions = renameplan([ (self.tiles[0], self.path('tile0.prj')) ])
+        self.assertEqual([ target for target, sources in collisions ], [ self.path('tile0.prj') ])
+
+        # Tiles may swap names
+        moves, collisions = renameplan([ (self.tiles[0], self.tiles[1]), (self.tiles[1], self.tiles[0]) ])
+        self.assertEqual(collisions, [])
+
+    def test_dryrun(self):
+        status, lines = self.main('-t', '{srs}_{x_low:.0f}.jp2', '-n', *self.tiles)
+
+        self.assertEqual(status, 0)
+        self.assertEqual(lines[0], self.tiles[0] + ' -> ' + self.path('3067_380000.jp2'))
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(self.files(), [ 'tile0.jp2', 'tile0.prj', 'tile0.tfw', 'tile1.jp2' ])
+        self.assertFalse(os.path.exists(self.journal))
+
+    def test_rename_and_rollback(self):
+        status, lines = self.main('-t', '{srs}_{x_low:.0f}.jp2', *self.tiles)
+
+        self.assertEqual(status, 0)
+        self.assertEqual(lines, [ '2 files renamed, 2 sidecars moved, 0 failed' ])
+        self.assertEqual(self.files(), [ '3067_380000.jp2', '3067_380000.prj', '3067_380000.tfw', '3067_386000.jp2' ])
+        with open(self.path('3067_380000.tfw')) as i:
+            self.assertEqual(i.read(), '.tfw')
+
+        plan, passes = readjournal(self.journal)
+        self.assertEqual(plan['template'], '{srs}_{x_low:.0f}.jp2')
+        self.assertEqual(passes, [ 'temporary', 'target' ])
+
+        status, lines = self.main('--rollback')
+
+        self.assertEqual(lines, [ '4 files restored' ])
+        self.assertEqual(self.files(), [ 'tile0.jp2', 'tile0.prj', 'tile0.tfw', 'tile1.jp2' ])
+        with open(self.path('tile0.prj')) as i:
+            self.assertEqual(i.read(), '.prj')
+
+        # A journal is rolled back once
+        with self.assertRaises(ValueError):
+            self.main('--resume')
+
+    def test_rename_into_directory(self):
+        status, lines = self.main('-t', '{srs}/{name}.jp2', *self.tiles)
+
+        self.assertEqual(status, 0)
+        self.assertEqual(sorted(os.listdir(self.path('3067'))), [ 'tile0.jp2', 'tile0.prj', 'tile0.tfw', 'tile1.jp2' ])
+
+        # Created directories are removed
+        self.main('--rollback')
+        self.assertFalse(os.path.exists(self.path('3067')))
+
+    def test_collision(self):
+        with self.assertWarns(UserWarning):
+            with self.assertRaises(ValueError) as error:
+                self.main('-t', '{srs}.jp2', *self.tiles)
+
+        self.assertIn('nothing renamed', str(error.exception))
+        self.assertEqual(self.files(), [ 'tile0.jp2', 'tile0.prj', 'tile0.tfw', 'tile1.jp2' ])
+        self.assertFalse(os.path.exists(self.journal))
+
+    def test_rollback_after_collision(self):
+        # A file appears at a target after the plan was made: the target
+        # pass stops, and the rollback restores every file
+        status, lines = self.main('-t', '{srs}_{x_low:.0f}.jp2', '-n', *self.tiles)
+        plan = [ line.split(' -> ') for line in lines ]
+
+        with open(self.path('3067_386000.jp2'), 'w') as o:
+            o.write('taken')
+
+        with self.assertWarns(UserWarning):
+            with self.assertRaises(ValueError):
+                self.main('-t', '{srs}_{x_low:.0f}.jp2', *self.tiles)
+        self.assertFalse(os.path.exists(self.journal))
+        os.remove(self.path('3067_386000.jp2'))
+
+        # Same plan, with the file appearing during the rename
+        import gmlparser
+        applyrenames = gmlparser.applyrenames
+
+        def interrupted(journalpath, moves, passes = ()):
+            with open(self.path('3067_386000.jp2'), 'w') as o:
+                o.write('taken')
+            applyrenames(journalpath, moves, passes)
+
+        gmlparser.applyrenames = interrupted
+        try:
+            with self.assertRaises(ValueError) as error:
+                self.main('-t', '{srs}_{x_low:.0f}.jp2', *self.tiles)
+        finally:
+            gmlparser.applyrenames = applyrenames
+
+        self.assertIn('appeared during rename', str(error.exception))
+        self.assertEqual(readjournal(self.journal)[1], [ 'temporary' ])
+
+        status, lines = self.main('--rollback')
+
+        self.assertEqual(lines, [ str(len(plan)) + ' files restored' ])
+        self.assertEqual(self.files(), [ '3067_386000.jp2', 'tile0.jp2', 'tile0.prj', 'tile0.tfw', 'tile1.jp2' ])
+        with open(self.path('3067_386000.jp2')) as i:
+            self.assertEqual(i.read(), 'taken')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+# Scanning files with broken box structure for GML data
+
+import io
+import os.path
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+
+from gmlparser import jp2scan
+
+def scan(data, chunksize = 4096):
+    f = io.BytesIO(data)
+    start, end = jp2scan(f, chunksize = chunksize)
+    return data[start:end]
+
+class JP2ScanTest(unittest.TestCase):
+
+    gml = b'<r><r>a</r><r/><r a="1" /></r>'
+    box = b'\0\0\0\0xml gml.data' + gml + b' trailing </r> \xff\xd9'
+
+    # Nested and self-closing root elements
+    def test_nested_root(self):
+        self.assertEqual(scan(self.box), self.gml)
+
+    # Tags across chunk boundaries
+    def test_small_chunks(self):
+        for chunksize in (4, 5, 7, 16):
+            self.assertEqual(scan(self.box, chunksize), self.gml)
+
+    def test_self_closing_root(self):
+        self.assertEqual(scan(b'xml gml.data<r x="1"/></r>'), b'<r x="1"/>')
+
+    def test_incomplete(self):
+        with self.assertRaises(ValueError):
+            scan(b'xml gml.data<r><r/>')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+# Serve mode: metadata queries over HTTP on a Unix socket
+
+import http.client
+import json
+import os.path
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+
+import gmlbench
+from gmlparser import DocumentLRU, MetadataServer, httpserver, servehandler
+
+# HTTP connection over a Unix socket
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socketpath):
+        http.client.HTTPConnection.__init__(self, 'localhost', timeout = 10)
+        self.socketpath = socketpath
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socketpath)
+
+class ServeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+        # Tiles under the root directory, and a file outside of it
+        self.root = os.path.join(self.directory, 'root')
+        os.makedirs(os.path.join(self.root, 'tiles'))
+        gmlbench.writejp2(os.path.join(self.root, 'tiles', 'a.jp2'), gmlbench.gmldocument())
+        gmlbench.writejp2(os.path.join(self.directory, 'secret.jp2'), gmlbench.gmldocument())
+
+        self.socketpath = os.path.join(self.directory, 'serve.sock')
+        self.metadata = MetadataServer(self.root, DocumentLRU(16))
+        self.server = httpserver(servehandler(self.metadata), self.socketpath)
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.start()
+
+        self.connection = UnixHTTPConnection(self.socketpath)
+
+    def tearDown(self):
+        self.connection.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.directory)
+
+    def get(self, url):
+        self.connection.request('GET', url)
+        response = self.connection.getresponse()
+        return response.status, response.getheader('Content-Type'), response.read().decode('utf-8')
+
+    def test_tfw(self):
+        status, content_type, body = self.get('/tfw?path=tiles/a.jp2')
+
+        self.assertEqual(status, 200)
+        self.assertEqual(content_type, 'text/plain; charset=utf-8')
+        self.assertEqual([ float(value) for value in body.split() ], [ 0.5, 0.0, 0.0, -0.5, 380000.25, 6675999.75 ])
+
+        # Same connection, document from the LRU
+        status, content_type, body = self.get('/json?path=tiles/a.jp2&formatting=raw')
+        self.assertEqual(status, 200)
+        self.assertEqual(content_type, 'application/json; charset=utf-8')
+        json.loads(body)
+
+        self.assertEqual(self.metadata.documents.stats()['entries'], 1)
+
+    def test_not_found(self):
+        for url in ('/tfw?path=tiles/missing.jp2', '/thumbnail?path=tiles/a.jp2'):
+            with self.subTest(url = url):
+                status, content_type, body = self.get(url)
+                self.assertEqual(status, 404)
+                self.assertTrue(body.startswith('Error: '))
+
+    def test_outside_root(self):
+        for path in ('../secret.jp2', 'tiles/../../secret.jp2', os.path.join(self.directory, 'secret.jp2')):
+            with self.subTest(path = path):
+                status, content_type, body = self.get('/tfw?path=' + path)
+                self.assertEqual(status, 403)
+
+        # Symbolic links out of the root directory are not followed
+        os.symlink(os.path.join(self.directory, 'secret.jp2'), os.path.join(self.root, 'tiles', 'link.jp2'))
+        status, content_type, body = self.get('/tfw?path=tiles/link.jp2')
+        self.assertEqual(status, 403)
+
+    def test_bad_request(self):
+        self.assertEqual(self.get('/tfw')[0], 400)
+        self.assertEqual(self.get('/json?path=tiles/a.jp2&formatting=ugly')[0], 400)
+
+        status, content_type, body = self.get('/stats')
+        stats = json.loads(body)
+        self.assertEqual((stats['requests'], stats['errors']), (3, 2))
+
+    def test_socket_in_use(self):
+        with self.assertRaises(ValueError):
+            httpserver(servehandler(self.metadata), self.socketpath)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# Worldfile, .prj and .aux.xml sidecars of tiles
+
+import contextlib
+import io
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+
+import gmlbench
+from gmlparser import CRSRegistry, sidecarsmain, worldfilepath, writesidecars
+
+epsgdirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'epsg')
+
+class SidecarsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.tile = os.path.join(self.directory, 'tile.jp2')
+        gmlbench.writejp2(self.tile, gmlbench.gmldocument())
+
+        # The image is older than any sidecar written by the tests
+        os.utime(self.tile, (1000000000, 1000000000))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def read(self, name):
+        with open(self.path(name), 'r') as i:
+            return i.read()
+
+    def main(self, *argv):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            status = sidecarsmain(list(argv) + [ '-w', '1' ])
+        return status, output.getvalue().splitlines()
+
+    def test_worldfilepath(self):
+        self.assertEqual(worldfilepath('a/image.jp2'), 'a/image.j2w')
+        self.assertEqual(worldfilepath('a/image.tif'), 'a/image.tfw')
+        self.assertEqual(worldfilepath('a/image.j2'), 'a/image.j2w')
+        self.assertEqual(worldfilepath('a/image'), 'a/image.wld')
+        self.assertEqual(worldfilepath('a/image.jp2', 'tfw'), 'a/image.tfw')
+
+    def test_worldfile(self):
+        status, lines = self.main(self.tile)
+
+        self.assertEqual(status, 0)
+        self.assertEqual(lines, [ '1 written, 0 skipped, 0 failed' ])
+        self.assertEqual(sorted(os.listdir(self.directory)), [ 'tile.j2w', 'tile.jp2' ])
+        self.assertEqual([ float(value) for value in self.read('tile.j2w').split() ],
+                         [ 0.5, 0.0, 0.0, -0.5, 380000.25, 6675999.75 ])
+
+    def test_aux(self):
+        status, lines = self.main('--aux', '--suffix', 'tfw', self.tile)
+
+        self.assertEqual(sorted(os.listdir(self.directory)), [ 'tile.jp2', 'tile.jp2.aux.xml', 'tile.tfw' ])
+
+        # Geotransform of the upper left pixel corner
+        aux = ET.fromstring(self.read('tile.jp2.aux.xml'))
+        self.assertEqual(aux.findtext('SRS'), 'EPSG:3067')
+        self.assertEqual([ float(value) for value in aux.findtext('GeoTransform').split(',') ],
+                         [ 380000.0, 0.5, 0.0, 6676000.0, 0.0, -0.5 ])
+
+    def test_registry(self):
+        registryfile = self.path('epsg.db')
+        registry = CRSRegistry(registryfile)
+        registry.importdir(epsgdirectory)
+        registry.close()
+
+        status, lines = self.main('--prj', '--aux', '--registry', registryfile, self.tile)
+
+        self.assertEqual(status, 0)
+        wkt = self.read('tile.prj')
+        self.assertTrue(wkt.startswith('PROJCS["ETRS89 / TM35FIN(E,N)"'))
+        self.assertEqual(ET.fromstring(self.read('tile.jp2.aux.xml')).findtext('SRS'), wkt)
+
+        # No well-known text for the reference system: nothing is written
+        other = self.path('other.jp2')
+        gmlbench.writejp2(other, gmlbench.gmldocument(srs = 3879))
+        with self.assertWarns(UserWarning):
+            status, lines = self.main('--prj', '--registry', registryfile, other)
+
+        self.assertEqual(status, 1)
+        self.assertEqual(lines, [ '0 written, 0 skipped, 1 failed' ])
+        self.assertFalse(os.path.exists(self.path('other.j2w')))
+
+    def test_skip_existing(self):
+        self.assertEqual(writesidecars(self.tile, aux = True), ('written', None))
+        written = os.stat(self.path('tile.j2w')).st_mtime_ns
+
+        status, lines = self.main('--aux', self.tile)
+        self.assertEqual(lines, [ '0 written, 1 skipped, 0 failed' ])
+        self.assertEqual(os.stat(self.path('tile.j2w')).st_mtime_ns, written)
+
+        # All requested sidecars must exist
+        self.assertEqual(writesidecars(self.tile, aux = True, suffix = 'tfw'), ('written', None))
+
+        # Sidecars older than the image are written again
+        with open(self.path('tile.j2w'), 'w') as o:
+            o.write('old')
+        os.utime(self.path('tile.j2w'), (0, 0))
+        self.assertEqual(writesidecars(self.tile, aux = True), ('written', None))
+        self.assertEqual(self.read('tile.j2w').split()[0], '0.5')
+
+        self.assertEqual(writesidecars(self.tile, aux = True), ('skipped', None))
+        self.assertEqual(writesidecars(self.tile, aux = True, force = True), ('written', None))
+
+    def test_failed(self):
+        broken = self.path('broken.jp2')
+        with open(broken, 'wb') as o:
+            o.write(b'not a JPEG2000 file')
+
+        status, message = writesidecars(broken)
+        self.assertEqual(status, 'failed')
+        self.assertFalse(os.path.exists(self.path('broken.j2w')))
+
+if __name__ == '__main__':
+    unittest.main()
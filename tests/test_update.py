@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# Replacing GML data of JPEG2000 files in place
+
+import os.path
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+
+import gmlbench
+from gmlparser import filesize, jp2check, locategmlbox, read_gml, readboxes, updategml
+
+# Longer GML data, which does not fit in the old box
+def lengthen(gml):
+    return gml.replace('</gml:FeatureCollection>', '<!--' + 'x' * 4096 + '--></gml:FeatureCollection>')
+
+# Same length, another origin
+def move(gml):
+    return gml.replace('380000.25 6675999.75', '380100.25 6675999.75')
+
+class UpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def tile(self, position = 'before'):
+        path = os.path.join(self.directory, 'tile.jp2')
+        gmlbench.writejp2(path, gmlbench.gmldocument(), codestream = 64 * 1024, position = position)
+        return path
+
+    # Set the length field of the top-level box of 'boxtype' to 0 (to
+    # the end of the file). Extended length headers become short ones.
+    def lengthzero(self, path, boxtype):
+        with open(path, 'rb') as f:
+            boxes = list(readboxes(f, 0, filesize(f)))
+            f.seek(0)
+            data = f.read()
+        box = [ box for box in boxes if box.boxtype == boxtype ][-1]
+        self.assertEqual(box.end, len(data))
+        with open(path, 'wb') as f:
+            f.write(data[:box.offset] + struct.pack('>I4s', 0, boxtype) + data[box.offset + box.headerlength:])
+
+    # Top-level box types, and the codestream contents
+    def boxes(self, path):
+        with open(path, 'rb') as f:
+            jp2check(f)
+            boxes = list(readboxes(f, 0, filesize(f)))
+            codestream = [ box for box in boxes if box.boxtype == b'jp2c' ][0]
+            f.seek(codestream.start)
+            return [ box.boxtype for box in boxes ], f.read(codestream.end - codestream.start)
+
+    # Update a file and read it back: the new GML data is found by the
+    # box walker and read_gml, and the codestream is unchanged
+    def update(self, path, transform, mode):
+
+        before, codestream = self.boxes(path)
+        gml = read_gml(path).parser.datalist
+
+        result = updategml(path, transform)
+        self.assertEqual(result['mode'], mode)
+
+        after, newcodestream = self.boxes(path)
+        self.assertEqual(newcodestream, codestream)
+
+        with open(path, 'rb') as f:
+            box = locategmlbox(f)
+            f.seek(box.start)
+            self.assertEqual(f.read(box.end - box.start).decode('utf-8').rstrip(' '), transform(gml))
+
+        self.assertEqual(read_gml(path).parser.datalist.rstrip(' '), transform(gml))
+
+        return before, after
+
+    def test_inplace(self):
+        path = self.tile()
+        size = os.path.getsize(path)
+        before, after = self.update(path, move, 'inplace')
+        self.assertEqual(after, before)
+        self.assertEqual(os.path.getsize(path), size)
+        self.assertEqual(read_gml(path).georef().c, 380100.25)
+
+    # Old box becomes a free box, and the new one is appended
+    def test_relocate(self):
+        path = self.tile('before')
+        before, after = self.update(path, lengthen, 'relocate')
+        self.assertEqual(after, [ b'free' if t == b'asoc' else t for t in before ] + [ b'asoc' ])
+
+    def test_extend(self):
+        path = self.tile('after')
+        before, after = self.update(path, lengthen, 'extend')
+        self.assertEqual(after, before)
+
+    # Codestream of length 0 before the end of the file gets its length
+    def test_relocate_codestream_to_end(self):
+        path = self.tile('before')
+        self.lengthzero(path, b'jp2c')
+        before, after = self.update(path, lengthen, 'relocate')
+        self.assertEqual(after, [ b'free' if t == b'asoc' else t for t in before ] + [ b'asoc' ])
+
+    # GML box of length 0 at the end of the file is extended
+    def test_extend_box_to_end(self):
+        path = self.tile('after')
+        self.lengthzero(path, b'asoc')
+        before, after = self.update(path, lengthen, 'extend')
+        self.assertEqual(after, before)
+
+if __name__ == '__main__':
+    unittest.main()
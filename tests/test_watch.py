@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+# Watch mode: new, changed and removed tiles, and the state file
+
+import json
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+
+import gmlbench
+from gmlparser import InotifyWatcher, watch
+
+class WatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.tiles = os.path.join(self.directory, 'tiles')
+        self.statefile = os.path.join(self.directory, 'state.json')
+        os.mkdir(self.tiles)
+
+        # A tile processed before startup, one added and one removed
+        # while the watcher was not running
+        self.tile('old.jp2')
+        self.tile('new.jp2')
+        st = os.stat(self.path('old.jp2'))
+        with open(self.statefile, 'w') as o:
+            json.dump({ self.path('old.jp2'): [ st.st_size, st.st_mtime_ns ],
+                        self.path('gone.jp2'): [ 1, 1 ] }, o)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.tiles, name)
+
+    def tile(self, name, x_low = 380000):
+        gmlbench.writejp2(self.path(name), gmlbench.gmldocument(x_low = x_low))
+
+    # Run the watcher through steps of (action, expected call). Each
+    # action is done when the calls so far have been seen. Steps
+    # without an action are expected without waiting.
+    def run_watch(self, steps, polling):
+
+        calls = []
+        expected = []
+        steps = list(steps)
+        deadline = time.monotonic() + 20
+
+        def process(paths):
+            calls.append(('process', paths))
+            # Broken files are not processed successfully
+            return [ path for path in paths if not path.endswith('broken.jp2') ]
+
+        def remove(paths):
+            calls.append(('remove', sorted(paths)))
+
+        def stop():
+            while len(steps) > 0 and steps[0][0] is None:
+                expected.append(steps.pop(0)[1])
+            # Unexpected calls, or expected calls not seen in time
+            if calls[0:len(expected)] != expected[0:len(calls)] or time.monotonic() > deadline:
+                return True
+            if calls != expected:
+                return False
+            if len(steps) == 0:
+                return True
+            action, call = steps.pop(0)
+            action()
+            expected.append(call)
+            return False
+
+        watch([ self.tiles ], process, remove, self.statefile, settle = 0.2,
+              polling = polling, interval = 0.05, stop = stop)
+
+        self.assertEqual(calls, expected)
+        self.assertEqual(steps, [])
+
+        with open(self.statefile, 'r') as i:
+            return json.load(i)
+
+    def scenario(self):
+
+        def rewrite():
+            self.tile('new.jp2', x_low = 386000)
+
+        def broken():
+            with open(self.path('broken.jp2'), 'wb') as o:
+                o.write(b'broken')
+
+        def subdirectory():
+            os.mkdir(self.path('sub'))
+            self.tile(os.path.join('sub', 'a.jp2'))
+
+        return [
+            # Startup: removed files first, then files not in the state
+            (None, ('remove', [ self.path('gone.jp2') ])),
+            (None, ('process', [ self.path('new.jp2') ])),
+            (rewrite, ('process', [ self.path('new.jp2') ])),
+            (broken, ('process', [ self.path('broken.jp2') ])),
+            (subdirectory, ('process', [ self.path(os.path.join('sub', 'a.jp2')) ])),
+            (lambda: shutil.rmtree(self.path('sub')), ('remove', [ self.path(os.path.join('sub', 'a.jp2')) ])),
+            (lambda: os.remove(self.path('old.jp2')), ('remove', [ self.path('old.jp2') ]))
+        ]
+
+    def check(self, state):
+        # Failed files are not in the state, and are not tried again
+        # until they change
+        self.assertEqual(sorted(state), [ self.path('new.jp2') ])
+        st = os.stat(self.path('new.jp2'))
+        self.assertEqual(state[self.path('new.jp2')], [ st.st_size, st.st_mtime_ns ])
+
+    def test_polling(self):
+        self.check(self.run_watch(self.scenario(), polling = True))
+
+    def test_inotify(self):
+        try:
+            InotifyWatcher([ self.tiles ]).close()
+        except OSError:
+            self.skipTest('inotify not available')
+        self.check(self.run_watch(self.scenario(), polling = False))
+
+    def test_restart(self):
+        self.run_watch(self.scenario()[0:2], polling = True)
+
+        # Nothing changed while stopped: nothing is processed again
+        started = time.monotonic()
+        def stop():
+            return time.monotonic() - started > 1
+
+        calls = []
+        watch([ self.tiles ], calls.append, calls.append, self.statefile, settle = 0.2,
+              polling = True, interval = 0.05, stop = stop)
+        self.assertEqual(calls, [])
+
+if __name__ == '__main__':
+    unittest.main()